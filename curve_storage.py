@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Compact Curve Storage
+Stores each sample's sieve curve as one binary BLOB in sample_curves instead of
+one sieve_data row per reading, so reading a curve is a single row fetch that
+decodes straight into NumPy arrays.
+
+Blob layout (little-endian):
+- 1 byte format version (FORMAT_VERSION)
+- 1 byte flags (FLAG_ZLIB: the payload is zlib-compressed)
+- 2 bytes number of readings n
+- payload: n float64 sieve sizes (coarsest first), then n float64 % passing
+
+The storage mode decides how new readings are written: 'rows' (sieve_data, the
+default), 'blob' or 'blob-zlib'. Readers handle both representations, so a
+database may hold a mix. Legacy queries keep working through
+install_curve_views(), which shadows sieve_data on a connection with a TEMP view
+that also unpacks the blobs into rows (only sample_id, sieve_size and
+percent_passing are stored; the other columns read as NULL). Queries that only
+need to know which samples have readings use its curve_samples view instead,
+which never unpacks a curve.
+"""
+
+import json
+import struct
+import zlib
+import numpy as np
+
+STORAGE_MODES = ("rows", "blob", "blob-zlib")
+DEFAULT_STORAGE = "rows"
+FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+HEADER = struct.Struct("<BBH")
+MAX_READINGS = 0xFFFF
+ZLIB_LEVEL = 6
+ID_CHUNK = 500   # Sample IDs per lookup query
+
+
+def check_storage(mode):
+    """Validate a storage mode name; returns it or raises ValueError."""
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown curve storage '{mode}'; use one of {', '.join(STORAGE_MODES)}")
+    return mode
+
+
+def create_curve_table(conn):
+    """Create the table of packed curves; a deleted sample takes its curve with it."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sample_curves (
+            sample_id INTEGER PRIMARY KEY,
+            curve BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS sample_curves_sample_delete AFTER DELETE ON samples
+        BEGIN
+            DELETE FROM sample_curves WHERE sample_id = OLD.id;
+        END
+    """)
+
+
+def encode_curve(sizes, passing, compress=False):
+    """
+    Pack one curve into a blob, sorted coarsest sieve first. With compress the
+    payload is zlib-compressed, unless that would not make it smaller.
+    """
+    sizes = np.asarray(sizes, dtype="<f8")
+    passing = np.asarray(passing, dtype="<f8")
+    if sizes.shape != passing.shape or sizes.ndim != 1:
+        raise ValueError("sieve sizes and percent passing must be 1-D arrays of the same length")
+    if len(sizes) > MAX_READINGS:
+        raise ValueError(f"A curve holds at most {MAX_READINGS} readings")
+
+    order = np.argsort(-sizes, kind="stable")
+    payload = sizes[order].tobytes() + passing[order].tobytes()
+    flags = 0
+    if compress:
+        packed = zlib.compress(payload, ZLIB_LEVEL)
+        if len(packed) < len(payload):
+            payload, flags = packed, FLAG_ZLIB
+    return HEADER.pack(FORMAT_VERSION, flags, len(sizes)) + payload
+
+
+def decode_curve(blob):
+    """Unpack a blob into (sieve sizes, percent passing) float64 arrays, coarsest sieve first."""
+    version, flags, count = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported curve format version {version}")
+    payload = memoryview(blob)[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    values = np.frombuffer(payload, dtype="<f8", count=2 * count).astype(float)
+    return values[:count], values[count:]
+
+
+def curve_json(blob):
+    """A blob's readings as a JSON array of [sieve size, % passing] pairs (SQL function)."""
+    sizes, passing = decode_curve(blob)
+    return json.dumps(np.column_stack((sizes, passing)).tolist())
+
+
+def write_curves(conn, curves, compress=False):
+    """
+    Store packed curves, a dict mapping sample ID to (sieve sizes, percent passing),
+    replacing any readings those samples had in either form. No commit.
+    """
+    conn.executemany("DELETE FROM sieve_data WHERE sample_id = ?", ((sample_id,) for sample_id in curves))
+    conn.executemany("INSERT OR REPLACE INTO sample_curves (sample_id, curve) VALUES (?, ?)",
+                     ((sample_id, encode_curve(sizes, passing, compress))
+                      for sample_id, (sizes, passing) in curves.items()))
+
+
+def read_curves(conn, sample_ids):
+    """
+    Curves of the given samples as a dict mapping sample ID to (sieve sizes, percent
+    passing) arrays, coarsest sieve first. Packed curves take one row each; samples
+    still stored as sieve_data rows are read from those, with a non-numeric size
+    (the 'pan' row of the test data) read as 0. Samples without readings are left out.
+    """
+    sample_ids = list(sample_ids)
+    curves = {}
+    for start in range(0, len(sample_ids), ID_CHUNK):
+        chunk = sample_ids[start:start + ID_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        for sample_id, blob in conn.execute(
+                f"SELECT sample_id, curve FROM sample_curves WHERE sample_id IN ({placeholders})", chunk):
+            curves[sample_id] = decode_curve(blob)
+
+        rows = [sample_id for sample_id in chunk if sample_id not in curves]
+        if not rows:
+            continue
+        placeholders = ", ".join("?" * len(rows))
+        readings = {}
+        for sample_id, size, percent in conn.execute(f"""
+                SELECT sample_id,
+                       CASE WHEN typeof(sieve_size) IN ('integer', 'real') THEN sieve_size ELSE 0 END,
+                       percent_passing
+                FROM sieve_data
+                WHERE sample_id IN ({placeholders})
+            """, rows):
+            readings.setdefault(sample_id, ([], []))
+            readings[sample_id][0].append(size)
+            readings[sample_id][1].append(percent)
+        for sample_id, (sizes, passing) in readings.items():
+            sizes = np.array(sizes, dtype=float)
+            order = np.argsort(-sizes, kind="stable")
+            curves[sample_id] = (sizes[order], np.array(passing, dtype=float)[order])
+    return curves
+
+
+def read_curve(conn, sample_id):
+    """One sample's (sieve sizes, percent passing) arrays, or None if it has no readings."""
+    return read_curves(conn, [sample_id]).get(sample_id)
+
+
+def install_curve_views(conn):
+    """
+    Set up the TEMP views that read curves in either form on a connection, across
+    the main database and every attached one (such as partitions):
+    - curve_samples: the sample_id of every sample with readings, without unpacking
+      any curve (a sample may appear once per form it is stored in)
+    - sieve_data, only while some database holds packed curves: shadows the stored
+      rows with the stored rows plus the unpacked rows of packed curves
+    Returns the connection.
+    """
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] != "temp"]
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(sieve_data)")]
+    unpacked = {"sample_id": "c.sample_id",
+                "sieve_size": "json_extract(j.value, '$[0]')",
+                "percent_passing": "json_extract(j.value, '$[1]')"}
+    select = ", ".join(columns)
+    select_unpacked = ", ".join(f"{unpacked.get(column, 'NULL')} AS {column}" for column in columns)
+
+    rows = []
+    samples = []
+    for schema in schemas:
+        rows.append(f"SELECT {select} FROM {schema}.sieve_data")
+        samples.append(f"SELECT sample_id FROM {schema}.sieve_data")
+        has_table = conn.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'sample_curves'"
+        ).fetchone()
+        if not has_table:
+            continue
+        samples.append(f"SELECT sample_id FROM {schema}.sample_curves")
+        if conn.execute(f"SELECT 1 FROM {schema}.sample_curves LIMIT 1").fetchone():
+            rows.append(f"SELECT {select_unpacked} FROM {schema}.sample_curves c, "
+                        f"json_each(curve_json(c.curve)) j")
+
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS curve_samples AS {' UNION ALL '.join(samples)}")
+    if len(rows) > len(schemas):
+        conn.create_function("curve_json", 1, curve_json, deterministic=True)
+        conn.execute("DROP VIEW IF EXISTS temp.sieve_data")
+        conn.execute(f"CREATE TEMP VIEW sieve_data AS {' UNION ALL '.join(rows)}")
+    return conn
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Sieve Analysis Data Exporter
+Streams samples, sieve readings and analysis results out of the SQLite database.
+
+Supported formats:
+- csv: one table per export
+- jsonl: any tables, one JSON object per row tagged with its table name
+- parquet: one table per export, written one row group per chunk
+- xlsx: any tables, one sheet per table
+
+Rows are fetched in chunks and written out as they arrive, so the whole database
+never has to fit in memory. Only xlsx needs scratch space: its zip container is
+assembled in an anonymous temporary file that disappears once it has been streamed.
+
+Usage:
+    python export_from_sqlite.py --db beach_sand.db --format csv --table sieve_data -o readings.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from curve_storage import install_curve_views
+
+DB_PATH = "sieve_analysis.db"
+CHUNK_SIZE = 5000           # Rows fetched from SQLite at a time
+XLSX_BLOCK_SIZE = 64 * 1024  # Bytes per block when streaming a finished workbook
+
+TABLES = ('samples', 'sieve_data', 'analysis_results')
+SINGLE_TABLE_FORMATS = {'csv', 'parquet'}
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Sample filters: filter name -> (samples column, SQL condition)
+SAMPLE_FILTERS = {
+    'name': ('name', "name LIKE '%' || ? || '%'"),
+    'location': ('location', "location = ?"),
+    'type': ('type', "type = ?"),
+    'date_from': ('date', "date >= ?"),
+    'date_to': ('date', "date <= ?"),
+}
+
+
+def build_query(conn, table, filters=None):
+    """
+    Build the SELECT for one table restricted to the samples matching filters.
+
+    filters may hold 'sample_ids' (a list) and any key of SAMPLE_FILTERS. Filters on
+    columns that this database's samples table does not have raise ValueError.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table '{table}'")
+
+    filters = filters or {}
+    sample_columns = {row[1] for row in conn.execute("PRAGMA table_info(samples)")}
+    conditions = []
+    params = []
+
+    sample_ids = filters.get('sample_ids')
+    if sample_ids:
+        conditions.append(f"id IN ({', '.join('?' * len(sample_ids))})")
+        params.extend(int(sample_id) for sample_id in sample_ids)
+
+    for key, (column, condition) in SAMPLE_FILTERS.items():
+        value = filters.get(key)
+        if value in (None, ''):
+            continue
+        if column not in sample_columns:
+            raise ValueError(f"Cannot filter by {key}: samples have no '{column}' column")
+        conditions.append(condition)
+        params.append(value)
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    if table == 'samples':
+        return f"SELECT * FROM samples{where} ORDER BY id", params
+
+    order = "sample_id, sieve_size DESC" if table == 'sieve_data' else "sample_id"
+    if where:
+        return (f"SELECT * FROM {table} WHERE sample_id IN (SELECT id FROM samples{where}) "
+                f"ORDER BY {order}"), params
+    return f"SELECT * FROM {table} ORDER BY {order}", params
+
+
+def connections(conn):
+    """
+    The stream functions take a connection, or a list of connections to the files
+    of a partitioned database in sample ID order, whose rows are exported one file
+    after the other.
+    """
+    return list(conn) if isinstance(conn, (list, tuple)) else [conn]
+
+
+def table_columns(conn, table):
+    """Column names of a table, as the export's queries return them."""
+    return [description[0] for description in
+            connections(conn)[0].execute(f"SELECT * FROM {table} LIMIT 0").description]
+
+
+def iter_chunks(conn, table, filters=None, chunk_size=CHUNK_SIZE):
+    """Yield (column names, list of row tuples) for a table, chunk_size rows at a time."""
+    for part in connections(conn):
+        query, params = build_query(part, table, filters)
+        cursor = part.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield columns, rows
+
+
+def stream_csv(conn, table, filters=None, chunk_size=CHUNK_SIZE):
+    """Yield a CSV export of one table as encoded chunks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table_columns(conn, table))
+    for _, rows in iter_chunks(conn, table, filters, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_jsonl(conn, tables, filters=None, chunk_size=CHUNK_SIZE):
+    """Yield a JSON Lines export of several tables; each row carries a 'table' key."""
+    for table in tables:
+        for columns, rows in iter_chunks(conn, table, filters, chunk_size):
+            lines = []
+            for row in rows:
+                record = {'table': table}
+                record.update(zip(columns, row))
+                lines.append(json.dumps(record))
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _DrainableBuffer:
+    """Write-only file object whose contents are handed out and cleared as we go."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_schema(conn, table):
+    """Arrow schema for a table, from the column types declared in SQLite."""
+    import pyarrow as pa
+
+    fields = []
+    for _, name, declared_type, *_ in conn.execute(f"PRAGMA table_info({table})"):
+        declared_type = (declared_type or '').upper()
+        if 'INT' in declared_type:
+            fields.append((name, pa.int64()))
+        elif any(kind in declared_type for kind in ('REAL', 'FLOA', 'DOUB')):
+            fields.append((name, pa.float64()))
+        else:
+            fields.append((name, pa.string()))
+    return pa.schema(fields)
+
+
+def stream_parquet(conn, table, filters=None, chunk_size=CHUNK_SIZE):
+    """Yield a Parquet export of one table, one row group per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(connections(conn)[0], table)
+    sink = _DrainableBuffer()
+    writer = pq.ParquetWriter(sink, schema)
+    for columns, rows in iter_chunks(conn, table, filters, chunk_size):
+        batch = pa.Table.from_pydict(
+            {column: [row[i] for row in rows] for i, column in enumerate(columns)},
+            schema=schema
+        )
+        writer.write_table(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream_xlsx(conn, tables, filters=None, chunk_size=CHUNK_SIZE):
+    """Yield a multi-sheet Excel export, one sheet per table."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for table in tables:
+        sheet = workbook.create_sheet(title=table)
+        sheet.append(table_columns(conn, table))
+        for _, rows in iter_chunks(conn, table, filters, chunk_size):
+            for row in rows:
+                sheet.append(row)
+
+    with tempfile.TemporaryFile() as scratch:
+        workbook.save(scratch)
+        scratch.seek(0)
+        while True:
+            block = scratch.read(XLSX_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def connect_database(db_path):
+    """Connection whose sieve_data also lists the readings of packed curves."""
+    return install_curve_views(sqlite3.connect(db_path))
+
+
+def stream_export(db_path, export_format, tables=None, filters=None, chunk_size=CHUNK_SIZE,
+                  connect=connect_database):
+    """
+    Generator producing an export of the given tables as bytes.
+
+    The database connection is opened on first iteration and closed when the
+    generator finishes, so the generator can be handed straight to a streaming
+    HTTP response. Arguments are validated before anything is yielded.
+    connect(db_path) opens the connection; the web app passes one that also
+    reads the other partitions of a partitioned database, or returns a list of
+    connections, one per partition, when they are too many to attach to one.
+    """
+    tables = list(tables or TABLES)
+    if export_format not in MIMETYPES:
+        raise ValueError(f"Unknown format '{export_format}'; use one of {', '.join(MIMETYPES)}")
+    for table in tables:
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}'; use one of {', '.join(TABLES)}")
+    if export_format in SINGLE_TABLE_FORMATS and len(tables) != 1:
+        raise ValueError(f"{export_format} exports hold exactly one table")
+
+    # Check the filters against the schema up front so errors surface before streaming
+    conn = connect(db_path)
+    try:
+        for part in connections(conn):
+            for table in tables:
+                build_query(part, table, filters)
+    except Exception:
+        for part in connections(conn):
+            part.close()
+        raise
+
+    def generate():
+        try:
+            if export_format == 'csv':
+                yield from stream_csv(conn, tables[0], filters, chunk_size)
+            elif export_format == 'parquet':
+                yield from stream_parquet(conn, tables[0], filters, chunk_size)
+            elif export_format == 'jsonl':
+                yield from stream_jsonl(conn, tables, filters, chunk_size)
+            else:
+                yield from stream_xlsx(conn, tables, filters, chunk_size)
+        finally:
+            for part in connections(conn):
+                part.close()
+
+    return generate()
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Export sieve analysis data from SQLite")
+    parser.add_argument('--db', default=DB_PATH, help="SQLite database to read")
+    parser.add_argument('--format', choices=sorted(MIMETYPES), default='csv')
+    parser.add_argument('--table', action='append', choices=TABLES, dest='tables',
+                        help="Table to export (repeat for jsonl/xlsx; default: all)")
+    parser.add_argument('--sample-id', action='append', type=int, dest='sample_ids',
+                        help="Only export this sample (repeatable)")
+    parser.add_argument('--name', help="Only samples whose name contains this text")
+    parser.add_argument('--location', help="Only samples from this location")
+    parser.add_argument('--type', help="Only samples of this type")
+    parser.add_argument('--date-from', help="Only samples dated on or after YYYY-MM-DD")
+    parser.add_argument('--date-to', help="Only samples dated on or before YYYY-MM-DD")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"ERROR: Database not found at {args.db}", file=sys.stderr)
+        return 1
+
+    filters = {
+        'sample_ids': args.sample_ids,
+        'name': args.name,
+        'location': args.location,
+        'type': args.type,
+        'date_from': args.date_from,
+        'date_to': args.date_to,
+    }
+    tables = args.tables
+    if tables is None and args.format in SINGLE_TABLE_FORMATS:
+        tables = ['sieve_data']
+
+    try:
+        chunks = stream_export(args.db, args.format, tables, filters, args.chunk_size)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        written = 0
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+    if args.output:
+        print(f"Exported {written} bytes to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
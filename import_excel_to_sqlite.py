@@ -8,19 +8,43 @@ The specific format expected is:
 - Sample names in row 2 (Sample-BS 001, Sample-BS 002, etc.)
 - % Passing headers in row 3, aligned with sample names
 - Actual data starts from row 4
+
+Several workbooks can be imported together with import_files(), which parses them
+in parallel and loads everything in one transaction. CSV and Parquet exports are
+accepted too, either wide (a sieve size column plus one column per sample) or long
+(one row per reading with sample, sieve size and % passing columns).
+
+Imports are idempotent: every file is fingerprinted by its content hash and every
+sample by the hash of its readings. A file that was imported before is skipped
+before parsing, and of a changed file only the new or changed samples are written.
+
+Readings are stored as one sieve_data row each by default, or packed into one
+blob per sample with --curve-storage blob / blob-zlib (see curve_storage.py).
 """
 
+import argparse
+import functools
+import hashlib
 import sqlite3
 import pandas as pd
 import os
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from profiling import stage, run_profiled, add_profile_argument
+from curve_storage import (STORAGE_MODES, DEFAULT_STORAGE, check_storage, create_curve_table,
+                           write_curves, install_curve_views)
 
 DB_PATH = "sieve_analysis.db"
 EXCEL_PATH = "sample data.xlsx"
+SAMPLE_MARKER = "Sample-BS"   # Text that identifies a sample name cell
+PERCENT_TOLERANCE = 0.5       # Allowance for rounding above 100% passing
+LOOKUP_CHUNK = 500            # Sample names per lookup query
+HASH_CHUNK = 1 << 20          # Bytes read at a time while hashing a file
 
-def create_database():
+def create_database(db_path=DB_PATH):
     """Creates the SQLite database and tables if they don't exist."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # Create samples table
@@ -45,210 +69,480 @@ def create_database():
     
     conn.commit()
     conn.close()
-    print(f"Database initialized at: {DB_PATH}")
+    print(f"Database initialized at: {db_path}")
 
-def import_excel_to_sqlite():
+def create_fingerprint_tables(conn):
     """
-    Parses the Excel file with sieve analysis data and imports it into SQLite.
+    Creates the tables remembering which files were imported and the fingerprint of
+    each sample's readings. Deleting a sample forgets its fingerprint and the files
+    it came from, so re-importing them brings it back.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS imported_files (
+        hash TEXT PRIMARY KEY,
+        filename TEXT,
+        samples INTEGER,
+        imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS imported_file_samples (
+        file_hash TEXT NOT NULL,
+        sample_id INTEGER NOT NULL,
+        PRIMARY KEY (file_hash, sample_id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_imported_file_samples_sample ON imported_file_samples (sample_id)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sample_fingerprints (
+        sample_id INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS import_fingerprints_sample_delete AFTER DELETE ON samples
+    BEGIN
+        DELETE FROM imported_files WHERE hash IN (
+            SELECT file_hash FROM imported_file_samples WHERE sample_id = OLD.id
+        );
+        DELETE FROM imported_file_samples WHERE sample_id = OLD.id;
+        DELETE FROM sample_fingerprints WHERE sample_id = OLD.id;
+    END
+    ''')
+
+def file_hash(file_path):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def curve_fingerprints(readings):
+    """
+    Fingerprint of each sample's readings (sieve sizes and % passing, in sieve order).
+    Returns a dict mapping sample name to a hex digest.
+    """
+    fingerprints = {}
+    ordered = readings.sort_values(["sample_name", "sieve_size"], ascending=[True, False])
+    for sample_name, group in ordered.groupby("sample_name", sort=False):
+        digest = hashlib.sha1()
+        digest.update(group["sieve_size"].to_numpy(dtype=np.float64).tobytes())
+        digest.update(group["percent_passing"].to_numpy(dtype=np.float64).tobytes())
+        fingerprints[sample_name] = digest.hexdigest()
+    return fingerprints
+
+def parse_workbook(excel_path):
+    """
+    Parses an Excel workbook with sieve analysis data into a long table of readings.
     
     The Excel file should have a specific structure:
     - Sieve sizes in the leftmost column (usually B)
     - Sample names in row 2 (usually columns C, E, G, etc.)
     - % Passing headers in row 3 (usually columns C, E, G, etc.)
     - Actual data starting from row 4
+    
+    Returns a DataFrame with sample_name, sieve_size and percent_passing columns
+    (values still raw, see normalize_readings) and the list of sample columns that
+    held no data at all. Raises ValueError if the layout is not recognised.
     """
-    if not os.path.exists(EXCEL_PATH):
-        print(f"ERROR: Excel file not found at {EXCEL_PATH}")
-        return
-        
-    print(f"Reading Excel file: {EXCEL_PATH}")
+    print(f"Reading Excel file: {excel_path}")
     
-    try:
-        # Read the Excel file, skipping the first row which is typically empty
-        # Row 2 (index 1) contains sample names
-        # Row 3 (index 2) contains column headers like "Sieve Size, mm" and "% Passing"
-        # Row 4+ (index 3+) contains the actual data
-        df = pd.read_excel(EXCEL_PATH, skiprows=1)
-        
-        # Print the column names for debugging
-        print("Excel columns after skiprows=1:")
-        for i, col in enumerate(df.columns):
-            print(f"  {i}: {col}")
-            
-        # First row of df now has the column headers (originally row 3 in Excel)
-        # Get the sieve size column name (usually the leftmost column)
-        sieve_col = None
-        
-        # Read the first few rows to check for "Sieve Size" text
-        df_first_rows = pd.read_excel(EXCEL_PATH, nrows=5, header=None)
-        print("\nChecking first 5 rows for 'Sieve Size' text:")
-        for idx, row in df_first_rows.iterrows():
-            print(f"Row {idx}: {row.values}")
-        
-        # Try different approach - read without setting any headers
-        df_raw = pd.read_excel(EXCEL_PATH, header=None)
-        
-        # Find the row containing 'Sieve Size'
-        sieve_row_idx = None
-        for idx, row in df_raw.iterrows():
-            row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-            row_text = " ".join(row_values).lower()
-            if 'sieve size' in row_text:
-                sieve_row_idx = idx
-                print(f"Found 'Sieve Size' in row {idx}: {row_values}")
-                break
-                
-        if sieve_row_idx is None:
-            print("ERROR: Could not find row containing 'Sieve Size'")
-            return
-            
-        # Re-read with the correct header rows
-        # Sample names should be in the row above 'Sieve Size'
-        sample_row_idx = sieve_row_idx - 1
-        
-        # Read sample names from the row above sieve_row_idx
-        df_samples = pd.read_excel(EXCEL_PATH, header=sample_row_idx)
-        
-        # Read actual data with sieve_row_idx as header
-        df_data = pd.read_excel(EXCEL_PATH, header=sieve_row_idx)
-        
-        print("\nSample row columns:")
-        for i, col in enumerate(df_samples.columns):
-            print(f"  {i}: {col}")
-            
-        print("\nData row columns:")
-        for i, col in enumerate(df_data.columns):
-            print(f"  {i}: {col}")
-        
-        # Now find the Sieve Size column in df_data
-        sieve_col = None
+    # Read the sheet once, without headers, and locate the header rows ourselves
+    df_raw = pd.read_excel(excel_path, header=None)
+    
+    # Find the row containing 'Sieve Size'
+    sieve_row_idx = None
+    for idx, row in df_raw.iterrows():
+        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
+        row_text = " ".join(row_values).lower()
+        if 'sieve size' in row_text:
+            sieve_row_idx = idx
+            break
+    
+    if sieve_row_idx is None or sieve_row_idx == 0:
+        raise ValueError("Could not find row containing 'Sieve Size'")
+    
+    # Sample names are in the row above 'Sieve Size', readings in the rows below it
+    sample_row = df_raw.iloc[sieve_row_idx - 1]
+    header_row = df_raw.iloc[sieve_row_idx]
+    df_data = df_raw.iloc[sieve_row_idx + 1:]
+    
+    # Now find the Sieve Size column
+    sieve_col = None
+    for col, header in header_row.items():
+        header_str = str(header).lower()
+        if 'sieve' in header_str and 'size' in header_str:
+            sieve_col = col
+            break
+    
+    # If still not found, use the leftmost column containing numeric values
+    if sieve_col is None:
         for col in df_data.columns:
-            col_str = str(col).lower()
-            if 'sieve' in col_str and 'size' in col_str:
+            values = pd.to_numeric(df_data[col], errors='coerce')
+            if values.notna().sum() > 5:  # At least 5 numeric values
                 sieve_col = col
-                print(f"Found sieve column: '{sieve_col}'")
                 break
-                
-        # If still not found, try a more flexible approach
-        if not sieve_col:
-            print("Trying flexible approach to find sieve column...")
-            # Look for the leftmost column containing numeric values
-            for col in df_data.columns:
-                values = pd.to_numeric(df_data[col], errors='coerce')
-                if values.notna().sum() > 5:  # At least 5 numeric values
-                    sieve_col = col
-                    print(f"Using column '{sieve_col}' as sieve size column (contains numeric values)")
-                    break
-        
-        if not sieve_col:
-            print("ERROR: Could not find 'Sieve Size' column")
-            return
-        
-        # Extract all sieve sizes (should be from second row onward in the dataframe)
-        sieve_sizes = pd.to_numeric(df_data[sieve_col], errors='coerce').dropna().tolist()
-        print(f"Found {len(sieve_sizes)} sieve sizes")
-        
-        # Find sample columns from the sample header row (df_samples)
-        # These are the columns with "Sample-BS" in their name
-        sample_columns = []
-        for col in df_samples.columns:
-            if isinstance(col, str) and 'Sample-BS' in col:
-                sample_columns.append(col)
-        
-        if not sample_columns:
-            print("ERROR: No sample columns found - could not find 'Sample-BS' in column names")
-            print(f"Available columns in sample row: {list(df_samples.columns)}")
-            return
-            
-        print(f"Found {len(sample_columns)} sample columns: {sample_columns}")
-        
-        # Create a mapping from sample names to data columns
-        # We need to find which columns in df_data correspond to the data for each sample
-        sample_data_pairs = []
-        
-        # The sample columns in df_samples should map to "% Passing" columns in df_data
-        # The mapping will depend on column positions
-        
-        for sample_col in sample_columns:
-            # Get the position of this column in df_samples
-            sample_idx = list(df_samples.columns).index(sample_col)
-            
-            # Find the corresponding data column in df_data
-            # It should be at the same position
-            if sample_idx < len(df_data.columns):
-                data_col = df_data.columns[sample_idx]
-                sample_data_pairs.append((sample_col, data_col))
-                print(f"Mapped sample '{sample_col}' (index {sample_idx}) to data column '{data_col}'")
-            else:
-                print(f"Warning: Could not find data column for sample '{sample_col}'")
-        
-        if not sample_data_pairs:
-            print("ERROR: Could not map any samples to data columns")
-            return
-        
-        # Connect to the database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Insert the data
-        total_samples = 0
-        total_datapoints = 0
-        
-        for sample_name, percent_col in sample_data_pairs:
-            # Insert the sample
-            cursor.execute("INSERT OR IGNORE INTO samples (name) VALUES (?)", (sample_name,))
-            if cursor.rowcount > 0:
-                print(f"Added new sample: {sample_name}")
-                total_samples += 1
-            
-            # Get the sample_id
-            cursor.execute("SELECT id FROM samples WHERE name = ?", (sample_name,))
-            sample_id = cursor.fetchone()[0]
+    
+    if sieve_col is None:
+        raise ValueError("Could not find 'Sieve Size' column")
+    
+    # Find sample columns - the ones with "Sample-BS" in the sample name row
+    sample_columns = [col for col, name in sample_row.items()
+                      if isinstance(name, str) and SAMPLE_MARKER in name]
+    
+    if not sample_columns:
+        raise ValueError(f"No sample columns found - could not find '{SAMPLE_MARKER}' in the sample name row")
+    
+    print(f"Found {len(sample_columns)} sample columns in {os.path.basename(excel_path)}")
+    
+    # Keep only rows that have a sieve size, then reshape to one row per reading
+    df_data = df_data[pd.to_numeric(df_data[sieve_col], errors='coerce').notna()]
+    wide = df_data[[sieve_col] + sample_columns]
+    wide.columns = ['sieve_size'] + [sample_row[col].strip() for col in sample_columns]
+    readings = wide.melt(id_vars='sieve_size', var_name='sample_name', value_name='percent_passing')
+    
+    # Sample columns that hold nothing at all are reported as skipped
+    has_data = readings.groupby('sample_name', sort=False)['percent_passing'].count()
+    empty_samples = has_data[has_data == 0].index.tolist()
+    readings = readings[~readings['sample_name'].isin(empty_samples)]
+    
+    return readings[['sample_name', 'sieve_size', 'percent_passing']], empty_samples
+
+def _find_column(columns, *keywords):
+    """Return the first column whose simplified header contains any keyword, or None."""
+    for col in columns:
+        simple = ''.join(ch for ch in str(col).lower() if ch.isalnum())
+        if any(keyword in simple for keyword in keywords):
+            return col
+    return None
+
+def readings_from_table(df):
+    """
+    Converts a table of readings in either layout to the long form used by the importer.
+    
+    - Long layout: one row per reading with sample, sieve size and % passing columns,
+      three different columns and the only one mentioning "passing" among them
+    - Wide layout: a sieve size column followed by one % passing column per sample
+      (headers such as "Sample 1 % passing" are sample columns)
+    
+    Returns the readings and the list of sample columns that held no data.
+    """
+    sieve_col = _find_column(df.columns, 'sieve', 'size')
+    passing_cols = [col for col in df.columns if _find_column([col], 'passing') is not None]
+    passing_col = passing_cols[0] if len(passing_cols) == 1 and passing_cols[0] != sieve_col else None
+    sample_col = _find_column([col for col in df.columns if col not in (sieve_col, passing_col)], 'sample', 'name')
+    
+    if sample_col is not None and passing_col is not None and sieve_col is not None:
+        readings = df[[sample_col, sieve_col, passing_col]]
+        readings.columns = ['sample_name', 'sieve_size', 'percent_passing']
+        readings = readings.dropna(subset=['sample_name'])
+        return readings.assign(sample_name=readings['sample_name'].astype(str).str.strip()), []
+    
+    # Wide layout: the sieve column, or failing that the first column, holds the sizes
+    if sieve_col is None:
+        sieve_col = df.columns[0]
+    sample_columns = [col for col in df.columns if col != sieve_col]
+    if not sample_columns:
+        raise ValueError("No sample columns found")
+    
+    wide = df[[sieve_col] + sample_columns]
+    wide.columns = ['sieve_size'] + [str(col).strip() for col in sample_columns]
+    readings = wide.melt(id_vars='sieve_size', var_name='sample_name', value_name='percent_passing')
+    
+    has_data = readings.groupby('sample_name', sort=False)['percent_passing'].count()
+    empty_samples = has_data[has_data == 0].index.tolist()
+    return readings[~readings['sample_name'].isin(empty_samples)], empty_samples
+
+def parse_csv(csv_path):
+    """Parses a CSV export (wide or long layout) into a long table of readings."""
+    print(f"Reading CSV file: {csv_path}")
+    try:
+        df = pd.read_csv(csv_path, engine='pyarrow')
+    except ImportError:
+        df = pd.read_csv(csv_path)
+    return readings_from_table(df)
+
+def parse_parquet(parquet_path):
+    """Parses a Parquet file (wide or long layout) into a long table of readings."""
+    print(f"Reading Parquet file: {parquet_path}")
+    return readings_from_table(pd.read_parquet(parquet_path))
+
+def normalize_readings(readings):
+    """
+    Cleans and validates a long table of sieve readings.
+    
+    - Percent values may be strings with a '%' sign
+    - Workbooks usually store fractions (0-1); a sample whose readings never exceed 1
+      is scaled to percent (0-100)
+    - A sample needs at least two readings, all between 0 and 100%
+    
+    Returns the valid readings and the names of the samples that were rejected.
+    """
+    values = readings['percent_passing']
+    if values.dtype == object:
+        values = values.astype(str).str.replace('%', '', regex=False).str.strip()
+    
+    readings = readings.assign(
+        sieve_size=pd.to_numeric(readings['sieve_size'], errors='coerce'),
+        percent_passing=pd.to_numeric(values, errors='coerce')
+    ).dropna(subset=['sieve_size', 'percent_passing'])
+    
+    # A repeated sieve within a sample keeps its last reading
+    readings = readings.drop_duplicates(['sample_name', 'sieve_size'], keep='last')
+    
+    by_sample = readings.groupby('sample_name', sort=False)['percent_passing']
+    sample_max = by_sample.transform('max')
+    readings.loc[sample_max <= 1, 'percent_passing'] *= 100
+    
+    out_of_range = (readings['percent_passing'] < 0) | (readings['percent_passing'] > 100 + PERCENT_TOLERANCE)
+    bad = readings.loc[out_of_range, 'sample_name'].unique().tolist()
+    counts = readings.groupby('sample_name', sort=False)['percent_passing'].count()
+    bad += [name for name in counts[counts < 2].index if name not in bad]
+    
+    return readings[~readings['sample_name'].isin(bad)].reset_index(drop=True), bad
+
+def write_readings(conn, readings, storage=DEFAULT_STORAGE):
+    """
+    Writes validated readings to the database without committing.
+    Samples are matched by name; a re-imported sample has its readings replaced,
+    unless they are unchanged, in which case nothing is written for it. storage
+    picks sieve_data rows ('rows') or one packed curve per sample ('blob',
+    'blob-zlib' to compress it).
+    Returns two dicts mapping sample name to sample ID: the samples written (new or
+    changed) and the samples left unchanged.
+    """
+    cursor = conn.cursor()
+    sample_names = readings['sample_name'].unique().tolist()
+    fingerprints = curve_fingerprints(readings)
+    
+    # Look up existing samples in chunks to stay under SQLite's parameter limit
+    sample_ids = {}
+    for start in range(0, len(sample_names), LOOKUP_CHUNK):
+        chunk = sample_names[start:start + LOOKUP_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        for sample_id, sample_name in cursor.execute(
+                f"SELECT id, name FROM samples WHERE name IN ({placeholders})", chunk):
+            sample_ids.setdefault(sample_name, sample_id)
+    
+    # Existing samples whose readings have the same fingerprint are left alone
+    stored = {}
+    existing = list(sample_ids.values())
+    for start in range(0, len(existing), LOOKUP_CHUNK):
+        chunk = existing[start:start + LOOKUP_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        stored.update(cursor.execute(
+            f"SELECT sample_id, fingerprint FROM sample_fingerprints WHERE sample_id IN ({placeholders})", chunk))
+    unchanged = {name: sample_id for name, sample_id in sample_ids.items()
+                 if stored.get(sample_id) == fingerprints[name]}
+    changed_ids = [sample_id for name, sample_id in sample_ids.items() if name not in unchanged]
+    
+    cursor.executemany("DELETE FROM sieve_data WHERE sample_id = ?",
+                       ((sample_id,) for sample_id in changed_ids))
+    cursor.executemany("DELETE FROM sample_curves WHERE sample_id = ?",
+                       ((sample_id,) for sample_id in changed_ids))
+    # Files that supplied the old readings no longer match what is stored
+    cursor.executemany("""
+        DELETE FROM imported_files WHERE hash IN (SELECT file_hash FROM imported_file_samples WHERE sample_id = ?)
+    """, ((sample_id,) for sample_id in changed_ids))
+    
+    for sample_name in sample_names:
+        if sample_name not in sample_ids:
+            cursor.execute("INSERT INTO samples (name) VALUES (?)", (sample_name,))
+            sample_ids[sample_name] = cursor.lastrowid
+    
+    written = {name: sample_id for name, sample_id in sample_ids.items() if name not in unchanged}
+    rows = readings[~readings['sample_name'].isin(unchanged)]
+    if storage == 'rows':
+        cursor.executemany("""
+            INSERT INTO sieve_data (sample_id, sieve_size, percent_passing)
+            VALUES (?, ?, ?)
+        """, zip(
+            rows['sample_name'].map(written).tolist(),
+            rows['sieve_size'].tolist(),
+            rows['percent_passing'].tolist()
+        ))
+    else:
+        write_curves(conn, {
+            written[sample_name]: (group['sieve_size'].to_numpy(), group['percent_passing'].to_numpy())
+            for sample_name, group in rows.groupby('sample_name', sort=False)
+        }, compress=storage == 'blob-zlib')
+    cursor.executemany("INSERT OR REPLACE INTO sample_fingerprints (sample_id, fingerprint) VALUES (?, ?)",
+                       ((sample_id, fingerprints[name]) for name, sample_id in written.items()))
+    
+    print(f"Added {len(written) - len(changed_ids)} new samples, "
+          f"replaced readings for {len(changed_ids)} changed samples, "
+          f"left {len(unchanged)} unchanged samples alone")
+    return written, unchanged
+
+def parse_file(file_path):
+    """
+    Parses and validates one file of any supported type. Runs in a worker process,
+    so errors are returned rather than raised to keep one bad file from failing the batch.
+    """
+    try:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension not in PARSERS:
+            raise ValueError(f"Unsupported file type '{extension}'")
+        readings, empty_samples = PARSERS[extension](file_path)
+        readings, rejected = normalize_readings(readings)
+        return readings, empty_samples, rejected, None
+    except Exception as e:
+        return None, [], [], str(e)
+
+# Parser for each supported file extension
+PARSERS = {
+    '.xlsx': parse_workbook,
+    '.xls': parse_workbook,
+    '.csv': parse_csv,
+    '.parquet': parse_parquet,
+}
+
+def run_write(db_path, operation):
+    """Runs operation(conn) in one transaction on a connection of its own to db_path; returns its result."""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            return operation(conn)
+    finally:
+        conn.close()
+
+def create_import_tables(conn):
+    """Creates the tables an import writes to besides those of create_database()."""
+    create_fingerprint_tables(conn)
+    create_curve_table(conn)
+
+def import_files(file_paths, db_path=DB_PATH, max_workers=None, storage=DEFAULT_STORAGE, write=None):
+    """
+    Imports several workbooks (or CSV/Parquet files) at once.
+    
+    Files are hashed first: a file whose content was imported before, or that repeats
+    an earlier file of the batch, is skipped without being parsed ('duplicate' in its
+    summary). The other files are parsed in parallel on a process pool and all parsed
+    readings are then written in a single transaction, leaving samples whose readings
+    are already stored untouched. Returns one summary dict per file with the IDs of
+    the samples written and the number of samples imported (new or changed),
+    unchanged, skipped (no data) and failed (invalid data), plus an error message if
+    the whole file was unreadable. storage is passed on to write_readings().
+    
+    Every write goes through write(operation), which must run operation(conn) in a
+    transaction on db_path and return its result; by default run_write() does so on
+    a connection of its own (the web app passes its single writer thread instead).
+    """
+    check_storage(storage)
+    if write is None:
+        write = functools.partial(run_write, db_path)
+    
+    with stage("hash"):
+        write(create_import_tables)
+        hashes = [file_hash(path) for path in file_paths]
+        known = set()
+        conn = sqlite3.connect(db_path)
+        try:
+            for start in range(0, len(hashes), LOOKUP_CHUNK):
+                chunk = hashes[start:start + LOOKUP_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT hash FROM imported_files WHERE hash IN ({placeholders})", chunk))
+        finally:
+            conn.close()
+        duplicates = []
+        for digest in hashes:
+            duplicates.append(digest in known)
+            known.add(digest)
+    
+    with stage("parse"):
+        parsed = _parse_files([path for path, duplicate in zip(file_paths, duplicates) if not duplicate],
+                              max_workers)
+    
+    def write_parsed(conn):
+        summaries = []
+        results = iter(parsed)
+        for file_path, digest, duplicate in zip(file_paths, hashes, duplicates):
+            summary = {
+                'file': os.path.basename(file_path),
+                'sample_ids': [],
+                'imported': 0,
+                'unchanged': 0,
+                'skipped': 0,
+                'failed': 0,
+                'duplicate': duplicate,
+                'error': None,
+            }
+            summaries.append(summary)
+            if duplicate:
+                print(f"Skipped {summary['file']}: already imported")
+                continue
             
-            # Get percentage values for this sample
-            percent_values = df_data[percent_col].tolist()
+            readings, empty_samples, rejected, error = next(results)
+            summary.update(skipped=len(empty_samples), failed=len(rejected), error=error)
+            if error is not None:
+                continue
             
-            # Insert sieve data points
-            sample_datapoints = 0
-            for i, sieve_size in enumerate(sieve_sizes):
-                if i < len(percent_values):
-                    try:
-                        # Convert to float in case it's stored as string with % sign
-                        percent_value = percent_values[i]
-                        if isinstance(percent_value, str):
-                            percent_value = float(percent_value.replace('%', ''))
-                        
-                        # Only insert valid numbers
-                        if pd.notna(percent_value):
-                            # The values are stored as decimal (0-1) in Excel, 
-                            # but we want percentage (0-100)
-                            if percent_value <= 1:
-                                percent_value *= 100
-                                
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO sieve_data 
-                                (sample_id, sieve_size, percent_passing)
-                                VALUES (?, ?, ?)
-                            """, (sample_id, sieve_size, percent_value))
-                            sample_datapoints += 1
-                    except (ValueError, TypeError) as e:
-                        print(f"Error processing data for {sample_name}, sieve {sieve_size}: {e}")
+            sample_ids = {}
+            if readings is not None and not readings.empty:
+                written, unchanged = write_readings(conn, readings, storage)
+                summary['sample_ids'] = list(written.values())
+                summary['imported'] = len(written)
+                summary['unchanged'] = len(unchanged)
+                sample_ids = {**written, **unchanged}
+                print(f"Imported {len(written)} samples with "
+                      f"{int((~readings['sample_name'].isin(unchanged)).sum())} data points "
+                      f"from {summary['file']} ({len(unchanged)} unchanged)")
             
-            print(f"  Inserted {sample_datapoints} data points for {sample_name}")
-            total_datapoints += sample_datapoints
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"Successfully imported {total_samples} samples with {total_datapoints} data points")
-        
+            # Remember the file so the same content is skipped next time
+            conn.execute("INSERT OR REPLACE INTO imported_files (hash, filename, samples) VALUES (?, ?, ?)",
+                         (digest, summary['file'], len(sample_ids)))
+            conn.executemany("INSERT OR IGNORE INTO imported_file_samples (file_hash, sample_id) VALUES (?, ?)",
+                             ((digest, sample_id) for sample_id in sample_ids.values()))
+        return summaries
+    
+    with stage("write"):
+        return write(write_parsed)
+
+def _parse_files(file_paths, max_workers):
+    """Parses the files, on a process pool when there is more than one."""
+    if len(file_paths) > 1:
+        # Fresh worker processes (not forks of a possibly threaded web server);
+        # forkserver also avoids re-importing the caller's main module in each worker
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            return list(pool.map(parse_file, file_paths))
+    return [parse_file(path) for path in file_paths]
+
+def import_excel_to_sqlite(excel_path=EXCEL_PATH, db_path=DB_PATH, storage=DEFAULT_STORAGE):
+    """
+    Parses the Excel file with sieve analysis data and imports it into SQLite,
+    storing the readings as rows or packed curves (storage).
+    Returns the list of sample IDs that were imported, or None on failure.
+    """
+    if not os.path.exists(excel_path):
+        print(f"ERROR: Excel file not found at {excel_path}")
+        return None
+    
+    try:
+        summary = import_files([excel_path], db_path, storage=storage)[0]
     except Exception as e:
-        print(f"ERROR: Failed to process Excel file: {e}")
+        print(f"ERROR: Failed to import Excel file: {e}")
         import traceback
         traceback.print_exc()
-        return False
-        
-    return True
+        return None
+    
+    if summary['error']:
+        print(f"ERROR: Failed to process Excel file: {summary['error']}")
+        return None
+    
+    if summary['duplicate']:
+        print("This file was already imported; nothing to do")
+        return summary['sample_ids']
+    
+    print(f"Successfully imported {summary['imported']} samples "
+          f"({summary['unchanged']} unchanged, {summary['skipped']} empty, {summary['failed']} invalid)")
+    return summary['sample_ids']
 
 def verify_data_from_db():
     """Reads data from SQLite and displays it for verification."""
@@ -256,7 +550,8 @@ def verify_data_from_db():
         print(f"ERROR: Database not found at {DB_PATH}")
         return
         
-    conn = sqlite3.connect(DB_PATH)
+    # Packed curves are listed through the sieve_data row view
+    conn = install_curve_views(sqlite3.connect(DB_PATH))
     
     try:
         # First, get a list of all samples
@@ -309,7 +604,7 @@ def verify_data_from_db():
     finally:
         conn.close()
 
-def main():
+def main(storage=DEFAULT_STORAGE):
     """Main function to run the import and verification."""
     print("\n=== Sieve Analysis Data Importer ===")
     
@@ -326,11 +621,17 @@ def main():
     create_database()
     
     # Import data from Excel
-    if import_excel_to_sqlite():
+    if import_excel_to_sqlite(storage=storage) is not None:
         # Verify the imported data
         verify_data_from_db()
     
     print("\n=== Import completed ===")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Import sieve analysis data into SQLite")
+    parser.add_argument("--curve-storage", choices=STORAGE_MODES, default=DEFAULT_STORAGE,
+                        help="Store readings as sieve_data rows or as one packed curve per sample "
+                             "(default: %(default)s)")
+    add_profile_argument(parser, "import_profile")
+    args = parser.parse_args()
+    run_profiled(main, args.profile, args.curve_storage)
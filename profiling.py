@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Built-in Profiling for CLI and Batch Runs
+Used by the --profile option of sieve_analysis.py and import_excel_to_sqlite.py.
+
+While a Profiler is active it records:
+- wall time per named stage (analysis, splits, envelope, each plot, ...)
+- function call counts and times from cProfile
+- current and peak memory from tracemalloc
+- stack samples of the profiled thread, written as collapsed stacks
+  ("frame;frame;frame count" per line) for flamegraph.pl, speedscope or inferno
+
+Results go to <prefix>.folded (collapsed stacks), <prefix>.json (summary) and
+<prefix>.prof (raw cProfile data for pstats or snakeviz).
+
+When no profiler is active, stage() returns a shared no-op context manager, so the
+hooks left in the code cost next to nothing.
+"""
+
+import cProfile
+import contextlib
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005   # Seconds between stack samples
+TOP_FUNCTIONS = 30        # Functions listed in the JSON summary
+
+_active = None
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(name):
+    """Context manager timing a stage of the run (a no-op unless profiling)."""
+    if _active is None:
+        return _NO_STAGE
+    return _active.stage(name)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """Collects stage timings, call statistics, memory and stack samples for one run."""
+
+    def __init__(self, prefix="profile", sample_interval=SAMPLE_INTERVAL):
+        self.prefix = prefix
+        self.sample_interval = sample_interval
+        self.stages = []        # (name, depth, seconds, memory delta in bytes)
+        self.samples = Counter()
+        self._depth = 0
+        self._profile = cProfile.Profile()
+        self._stop_sampling = threading.Event()
+        self._sampler = None
+        self._thread_id = None
+        self._started = None
+        self.wall_time = None
+        self.peak_memory = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.write()
+        return False
+
+    def start(self):
+        """Start profiling the calling thread."""
+        global _active
+        if _active is not None:
+            raise RuntimeError("A profiler is already running")
+        _active = self
+        self._thread_id = threading.get_ident()
+        tracemalloc.start()
+        self._sampler = threading.Thread(target=self._sample, name="profiling-sampler", daemon=True)
+        self._sampler.start()
+        self._started = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self):
+        """Stop profiling."""
+        global _active
+        self._profile.disable()
+        self.wall_time = time.perf_counter() - self._started
+        self._stop_sampling.set()
+        self._sampler.join()
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        _active = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage and record how much memory it left allocated."""
+        memory_before = tracemalloc.get_traced_memory()[0]
+        depth = self._depth
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._depth -= 1
+            self.stages.append((name, depth, elapsed, tracemalloc.get_traced_memory()[0] - memory_before))
+
+    def _sample(self):
+        # Runs in its own thread, sampling the profiled thread's stack
+        while not self._stop_sampling.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def summary(self):
+        """Summary of the run as a dict (what write() stores in the JSON file)."""
+        stats = pstats.Stats(self._profile)
+        functions = []
+        for (filename, line, name), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+            functions.append({
+                'function': f"{name} ({os.path.basename(filename)}:{line})",
+                'calls': calls,
+                'own_seconds': round(own_time, 6),
+                'cumulative_seconds': round(cumulative_time, 6),
+            })
+        functions.sort(key=lambda entry: entry['cumulative_seconds'], reverse=True)
+
+        return {
+            'wall_seconds': round(self.wall_time, 6),
+            'peak_memory_bytes': self.peak_memory,
+            'total_calls': stats.total_calls,
+            'stack_samples': sum(self.samples.values()),
+            'sample_interval_seconds': self.sample_interval,
+            # Stages are listed in the order they finished; depth shows nesting
+            'stages': [{'stage': name, 'depth': depth, 'seconds': round(seconds, 6), 'memory_delta_bytes': delta}
+                       for name, depth, seconds, delta in self.stages],
+            'top_functions': functions[:TOP_FUNCTIONS],
+        }
+
+    def write(self):
+        """Write <prefix>.folded, <prefix>.json and <prefix>.prof; returns their paths."""
+        folded_path = f"{self.prefix}.folded"
+        json_path = f"{self.prefix}.json"
+        prof_path = f"{self.prefix}.prof"
+
+        with open(folded_path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(json_path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        self._profile.dump_stats(prof_path)
+
+        print(f"Profile written to {json_path}, {folded_path} and {prof_path}", file=sys.stderr)
+        return folded_path, json_path, prof_path
+
+
+def run_profiled(function, prefix, *args, **kwargs):
+    """Run function(*args, **kwargs) under a Profiler when prefix is set, else just run it."""
+    if not prefix:
+        return function(*args, **kwargs)
+    with Profiler(prefix):
+        return function(*args, **kwargs)
+
+
+def add_profile_argument(parser, default_prefix):
+    """Add the shared --profile [PREFIX] option to an argparse parser."""
+    parser.add_argument('--profile', nargs='?', const=default_prefix, metavar='PREFIX',
+                        help=f"Profile the run and write PREFIX.json/.folded/.prof (default prefix: {default_prefix})")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Screen Partition-Curve Simulation
+generate_underflow_data() and generate_overflow_data() in sieve_analysis.py split a
+curve with a perfect cut. Real screens misplace material near the cut; this module
+splits feeds with a partition curve instead: the fraction E(d) of each size d that
+reports to the overflow (oversize product).
+
+Partition models, with cut the size split equally between the products (mm) and
+sharpness how steep the curve is around it:
+- whiten: E = (exp(a x) - 1) / (exp(a x) + exp(a) - 2), x = d / cut, a = sharpness
+- logistic: E = 1 / (1 + (cut / d) ** sharpness)
+- ideal: E = 1 above the cut and 0 below it (sharpness is ignored)
+
+bypass is the fraction of every size that short-circuits to the overflow regardless
+of the screen (wet fines, blinding): E = bypass + (1 - bypass) * E.
+
+The feed is split by size class (material retained on each sieve, plus the pan),
+each class at the geometric mean of its bounds. Everything is vectorized: n feeds
+and m screen settings are simulated in one pass of (n, m, sieves) arrays.
+"""
+
+import numpy as np
+
+from sieve_analysis import pad_curves
+
+PARTITION_MODELS = ("whiten", "logistic", "ideal")
+DEFAULT_PARTITION_MODEL = "whiten"
+DEFAULT_SHARPNESS = 4.0
+MAX_SHARPNESS = 500.0   # Steeper than this is an ideal cut for any sieve series
+
+
+def check_partition_model(model):
+    """Validate a partition model name; returns it or raises ValueError."""
+    if model not in PARTITION_MODELS:
+        raise ValueError(f"Unknown partition model '{model}'; use one of {', '.join(PARTITION_MODELS)}")
+    return model
+
+
+def screen_settings(cut, sharpness=DEFAULT_SHARPNESS, bypass=0.0):
+    """
+    Broadcast the screen settings to three 1-D float arrays of the same length, one
+    entry per setting. Raises ValueError for a cut or sharpness that is not positive
+    or a bypass outside [0, 1).
+    """
+    cut, sharpness, bypass = (np.atleast_1d(np.asarray(values, dtype=float)) for values in (cut, sharpness, bypass))
+    try:
+        cut, sharpness, bypass = np.broadcast_arrays(cut.ravel(), sharpness.ravel(), bypass.ravel())
+    except ValueError:
+        raise ValueError("cut, sharpness and bypass lists must have the same length")
+    if not (np.isfinite(cut).all() and (cut > 0).all()):
+        raise ValueError("cut must be a positive size in mm")
+    if not (np.isfinite(sharpness).all() and (sharpness > 0).all()):
+        raise ValueError("sharpness must be positive")
+    if not (np.isfinite(bypass).all() and ((bypass >= 0) & (bypass < 1)).all()):
+        raise ValueError("bypass must be a fraction from 0 to below 1")
+    return cut, np.minimum(sharpness, MAX_SHARPNESS), bypass
+
+
+def partition_coefficients(model, sizes, cut, sharpness=DEFAULT_SHARPNESS, bypass=0.0):
+    """
+    Fraction of each particle size reporting to the overflow. sizes, cut, sharpness
+    and bypass broadcast against each other.
+    """
+    check_partition_model(model)
+    sizes = np.asarray(sizes, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if model == "whiten":
+            # Divided through by exp(a x) so large sizes do not overflow
+            decay = np.exp(-sharpness * sizes / cut)
+            corrected = (1 - decay) / (1 + (np.exp(sharpness) - 2) * decay)
+        elif model == "logistic":
+            corrected = 0.5 * (1 + np.tanh(0.5 * sharpness * (np.log(sizes) - np.log(cut))))
+        else:
+            corrected = (sizes > cut).astype(float)
+    corrected = np.where(sizes > 0, np.clip(corrected, 0.0, 1.0), 0.0)
+    return bypass + (1 - bypass) * corrected
+
+
+def size_classes(sizes, passing):
+    """
+    Split padded feed curves (one row per feed, coarsest sieve first, NaN padding)
+    into size classes: the material retained on each sieve and, last, the material
+    passing the finest sieve. Returns the mass of each class in % of the feed
+    (negative steps of non-monotone readings count as empty) and its representative
+    size, both of shape (n, sieves + 1).
+    """
+    n, length = sizes.shape
+    valid = ~(np.isnan(sizes) | np.isnan(passing))
+    count = valid.sum(axis=1)
+    rows = np.arange(n)
+    last = np.maximum(count - 1, 0)
+
+    previous = np.concatenate([np.full((n, 1), 100.0), passing[:, :-1]], axis=1)
+    retained = np.where(valid, np.clip(previous - passing, 0.0, None), 0.0)
+    pan = np.where(count > 0, np.clip(passing[rows, last], 0.0, None), 0.0)
+    masses = np.concatenate([retained, pan[:, None]], axis=1)
+
+    # Class bounds: a sieve and the next coarser one (the top class reaches sqrt(2)
+    # times the top sieve), and for the pan half the finest sieve up to it
+    upper = np.concatenate([sizes[:, :1] * np.sqrt(2), sizes[:, :-1], np.zeros((n, 1))], axis=1)
+    lower = np.concatenate([sizes, np.zeros((n, 1))], axis=1)
+    finest = sizes[rows, last]
+    upper[rows, length] = finest
+    lower = np.where(lower > 0, lower, upper / 2)
+    with np.errstate(invalid="ignore"):
+        representative = np.sqrt(np.where(upper > 0, upper * lower, 0.0))
+    return masses, np.nan_to_num(representative)
+
+
+def simulate_screens(sizes, passing, cut, sharpness=DEFAULT_SHARPNESS, bypass=0.0,
+                     model=DEFAULT_PARTITION_MODEL):
+    """
+    Split every feed on every screen setting.
+
+    sizes and passing are padded feed curves (see pad_curves()); cut, sharpness and
+    bypass give m settings (see screen_settings()). Returns a dict of arrays:
+    - sieve_sizes: (n, k) the feeds' sieves, coarsest first, at which the products'
+      curves are given
+    - overflow_passing, underflow_passing: (n, m, k) product curves in % passing
+      (NaN past a feed's last sieve, or for an empty product)
+    - overflow_yield, underflow_yield: (n, m) % of the feed reporting to each product
+    - coarse_recovery: (n, m) % of the feed coarser than the cut found in the overflow
+    - fines_recovery: (n, m) % of the feed finer than the cut found in the underflow
+      (the screening efficiency)
+    """
+    check_partition_model(model)
+    cut, sharpness, bypass = screen_settings(cut, sharpness, bypass)
+    sizes = np.asarray(sizes, dtype=float)
+    passing = np.asarray(passing, dtype=float)
+
+    # Coarsest sieve first, padding last
+    order = np.argsort(np.where(np.isnan(sizes), np.inf, -sizes), axis=1, kind="stable")
+    sizes = np.take_along_axis(sizes, order, axis=1)
+    passing = np.take_along_axis(passing, order, axis=1)
+    valid = ~(np.isnan(sizes) | np.isnan(passing))
+
+    masses, representative = size_classes(sizes, passing)
+    partition = partition_coefficients(model, representative[:, None, :], cut[None, :, None],
+                                       sharpness[None, :, None], bypass[None, :, None])
+    overflow = masses[:, None, :] * partition
+    underflow = masses[:, None, :] - overflow
+
+    feed_total = masses.sum(axis=1)[:, None]
+    overflow_total = overflow.sum(axis=2)
+    underflow_total = underflow.sum(axis=2)
+
+    def cumulative(product, total):
+        # Passing a sieve: everything in the finer classes
+        finer = total[:, :, None] - np.cumsum(product, axis=2)[:, :, :-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            curve = np.clip(100 * finer / total[:, :, None], 0.0, 100.0)
+        return np.where(valid[:, None, :] & (total[:, :, None] > 0), curve, np.nan)
+
+    coarse = representative[:, None, :] > cut[None, :, None]
+    coarse_feed = np.where(coarse, masses[:, None, :], 0.0).sum(axis=2)
+    fine_feed = np.where(coarse, 0.0, masses[:, None, :]).sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "sieve_sizes": np.where(valid, sizes, np.nan),
+            "overflow_passing": cumulative(overflow, overflow_total),
+            "underflow_passing": cumulative(underflow, underflow_total),
+            "overflow_yield": np.where(feed_total > 0, 100 * overflow_total / feed_total, np.nan),
+            "underflow_yield": np.where(feed_total > 0, 100 * underflow_total / feed_total, np.nan),
+            "coarse_recovery": np.where(coarse_feed > 0, 100 * np.where(coarse, overflow, 0.0).sum(axis=2)
+                                        / coarse_feed, np.nan),
+            "fines_recovery": np.where(fine_feed > 0, 100 * np.where(coarse, 0.0, underflow).sum(axis=2)
+                                       / fine_feed, np.nan),
+        }
+
+
+def simulate_curves(curves, cut, sharpness=DEFAULT_SHARPNESS, bypass=0.0, model=DEFAULT_PARTITION_MODEL):
+    """simulate_screens() for a list of (sieve_sizes, percent_passing) feed curves."""
+    sizes, passing = pad_curves(curves)
+    return simulate_screens(sizes, passing, cut, sharpness, bypass, model)
+
+
+def product_curve(simulation, feed, setting, product):
+    """One product's curve from a simulation as (sieve sizes, percent passing) lists, coarsest first."""
+    passing = simulation[f"{product}_passing"][feed, setting]
+    keep = ~np.isnan(passing)
+    return simulation["sieve_sizes"][feed][keep].tolist(), passing[keep].tolist()
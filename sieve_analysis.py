@@ -1,22 +1,47 @@
 #!/usr/bin/env python
 # Sieve Analysis Calculator
 #this is for ruchin
+import argparse
+from itertools import chain
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
 from colorama import init, Fore, Style
+from PIL import Image
 from matplotlib.ticker import LogLocator, NullFormatter, ScalarFormatter
+from profiling import stage, run_profiled, add_profile_argument
 
 # Initialize colorama for colored terminal output
 init()
 
+# How D-values are read off a curve between sieves:
+# - linear: straight lines in sieve size (the classic hand method)
+# - log-linear: straight lines in log sieve size, matching log-spaced sieve series
+# - pchip: monotone cubic (PCHIP) in log sieve size through the readings
+INTERPOLATION_MODELS = ("linear", "log-linear", "pchip")
+DEFAULT_INTERPOLATION = "linear"
+D_PERCENTS = (10, 25, 30, 50, 60, 75)
+
+def check_interpolation(model):
+    """Return model if it is a known interpolation model, else raise ValueError"""
+    if model not in INTERPOLATION_MODELS:
+        raise ValueError(f"Unknown interpolation model '{model}'; use one of {', '.join(INTERPOLATION_MODELS)}")
+    return model
+
 def interpolate(x1, y1, x2, y2, y):
     """Linear interpolation to find x given y"""
     if y1 == y2:
         return x1
     return x1 + (x2 - x1) * (y - y1) / (y2 - y1)
 
-def find_diameter_at_percent(sieve_sizes, percent_passing, target_percent):
+def find_diameter_at_percent(sieve_sizes, percent_passing, target_percent, model=DEFAULT_INTERPOLATION):
     """Find the particle diameter at a given percent passing"""
+    if check_interpolation(model) != "linear":
+        fit = fit_curves(*pad_curves([(sieve_sizes, percent_passing)]), model)
+        return float(evaluate_diameters(fit, [target_percent])[0, 0])
+    
     # Find the two points to interpolate between
     for i in range(len(percent_passing) - 1):
         if percent_passing[i] <= target_percent <= percent_passing[i+1] or \
@@ -52,18 +77,19 @@ def get_sorting_description(so):
     else:
         return "Very poorly sorted"
 
-def analyze_sample(sieve_sizes, percent_passing, sample_name="Original Sample"):
+def analyze_sample(sieve_sizes, percent_passing, sample_name="Original Sample", interpolation=DEFAULT_INTERPOLATION):
     """
     Perform sieve analysis on a sample
     Returns a dictionary with all calculated parameters
     """
     # Calculate D values
-    d10 = find_diameter_at_percent(sieve_sizes, percent_passing, 10)
-    d25 = find_diameter_at_percent(sieve_sizes, percent_passing, 25)
-    d30 = find_diameter_at_percent(sieve_sizes, percent_passing, 30)
-    d50 = find_diameter_at_percent(sieve_sizes, percent_passing, 50)
-    d60 = find_diameter_at_percent(sieve_sizes, percent_passing, 60)
-    d75 = find_diameter_at_percent(sieve_sizes, percent_passing, 75)
+    if check_interpolation(interpolation) == "linear":
+        d10, d25, d30, d50, d60, d75 = (find_diameter_at_percent(sieve_sizes, percent_passing, percent)
+                                        for percent in D_PERCENTS)
+    else:
+        # Fit the curve once and read every D-value off it
+        fit = fit_curves(*pad_curves([(sieve_sizes, percent_passing)]), interpolation)
+        d10, d25, d30, d50, d60, d75 = (float(value) for value in evaluate_diameters(fit, D_PERCENTS)[0])
     
     # Calculate coefficients
     cu = d60 / d10  # Coefficient of Uniformity
@@ -93,10 +119,236 @@ def analyze_sample(sieve_sizes, percent_passing, sample_name="Original Sample"):
         "so": so,
         "percent_063": percent_063,
         "sorting_desc": sorting_desc,
+        "interpolation": interpolation,
         "sieve_sizes": sieve_sizes,
         "percent_passing": percent_passing
     }
 
+def pad_curves(curves):
+    """
+    Stack curves of different lengths into two float arrays (one row per curve),
+    padded with NaN. curves is a list of (sieve_sizes, percent_passing) pairs.
+    """
+    lengths = np.fromiter((len(curve_sizes) for curve_sizes, _ in curves), dtype=np.intp, count=len(curves))
+    length = int(lengths.max(initial=0))
+    sizes = np.full((len(curves), length), np.nan)
+    passing = np.full((len(curves), length), np.nan)
+    # Fill every row at once through a mask rather than slice by slice
+    filled = np.arange(length) < lengths[:, None]
+    sizes[filled] = np.fromiter(chain.from_iterable(curve_sizes for curve_sizes, _ in curves),
+                                dtype=float, count=int(lengths.sum()))
+    passing[filled] = np.fromiter(chain.from_iterable(curve_passing for _, curve_passing in curves),
+                                  dtype=float, count=int(lengths.sum()))
+    return sizes, passing
+
+def find_diameters_batch(sizes, passing, target_percent):
+    """
+    find_diameter_at_percent() for every row of the padded arrays at once, with the
+    same rules: the first pair of neighbouring readings that brackets the target is
+    interpolated, otherwise the smallest or largest sieve is returned.
+    """
+    p1, p2 = passing[:, :-1], passing[:, 1:]
+    x1, x2 = sizes[:, :-1], sizes[:, 1:]
+    brackets = ((p1 <= target_percent) & (target_percent <= p2)) | \
+               ((p1 >= target_percent) & (target_percent >= p2))
+    found = brackets.any(axis=1)
+    rows = np.arange(len(sizes))
+    first = np.argmax(brackets, axis=1)
+    x1, y1, x2, y2 = x1[rows, first], p1[rows, first], x2[rows, first], p2[rows, first]
+    
+    # Same expression as interpolate(), so results match the scalar version exactly
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interpolated = np.where(y1 == y2, x1, x1 + (x2 - x1) * (target_percent - y1) / (y2 - y1))
+    outside = np.where(target_percent <= np.nanmin(passing, axis=1),
+                       np.nanmin(sizes, axis=1), np.nanmax(sizes, axis=1))
+    return np.where(found, interpolated, outside)
+
+def _pchip_slopes(x, y, count):
+    """
+    Fritsch-Carlson slopes of a monotone cubic through each row's knots (the same
+    as SciPy's PchipInterpolator), for left-aligned knots padded with NaN.
+    """
+    h = np.diff(x, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.diff(y, axis=1) / h
+    slopes = np.zeros_like(x)
+    rows = np.arange(len(x))
+    
+    # Interior knots: weighted harmonic mean of the neighbouring secants, 0 at extrema
+    h0, h1, d0, d1 = h[:, :-1], h[:, 1:], delta[:, :-1], delta[:, 1:]
+    w1, w2 = 2 * h1 + h0, h1 + 2 * h0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior = (w1 + w2) / (w1 / d0 + w2 / d1)
+    slopes[:, 1:-1] = np.where((np.sign(d0) * np.sign(d1) > 0), interior, 0.0)
+    
+    # End knots: three-point estimate, kept monotone; two knots make a straight line
+    def edge(h0, h1, d0, d1):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+        d = np.where(np.sign(d) != np.sign(d0), 0.0, d)
+        return np.where((np.sign(d0) != np.sign(d1)) & (np.abs(d) > np.abs(3 * d0)), 3 * d0, d)
+    
+    last = np.maximum(count - 1, 1)
+    if x.shape[1] > 2:
+        ends = np.minimum(last, x.shape[1] - 1)
+        slopes[:, 0] = np.where(count > 2, edge(h[:, 0], h[:, 1], delta[:, 0], delta[:, 1]), delta[:, 0])
+        tail = np.clip(ends - 1, 0, h.shape[1] - 1)
+        before = np.clip(ends - 2, 0, h.shape[1] - 1)
+        slopes[rows, ends] = np.where(count > 2,
+                                      edge(h[rows, tail], h[rows, before], delta[rows, tail], delta[rows, before]),
+                                      delta[rows, tail])
+    elif x.shape[1] == 2:
+        slopes[:, 0] = slopes[:, 1] = delta[:, 0]
+    return slopes
+
+def fit_curves(sizes, passing, model=DEFAULT_INTERPOLATION):
+    """
+    Precompute the interpolation of particle size against percent passing for every
+    row of the padded arrays, so any number of D-values can then be read off with
+    evaluate_diameters().
+    
+    linear and log-linear keep the readings as given and follow the rules of
+    find_diameter_at_percent(). pchip needs a monotone curve in log size: readings
+    are sorted by sieve size, the pan (size 0) and any reading below the one on a
+    finer sieve are dropped, and of several sieves with the same percent passing
+    only the finest is kept.
+    """
+    check_interpolation(model)
+    # fmin/fmax skip the NaN padding like nanmin/nanmax, without copying the arrays
+    fit = {"model": model,
+           "min_passing": np.fmin.reduce(passing, axis=1), "max_passing": np.fmax.reduce(passing, axis=1),
+           "min_size": np.fmin.reduce(sizes, axis=1), "max_size": np.fmax.reduce(sizes, axis=1)}
+    if model != "pchip":
+        with np.errstate(divide='ignore'):
+            fit.update(x=passing, y=np.log10(sizes) if model == "log-linear" else sizes)
+        return fit
+    
+    # Knots ordered by size with strictly increasing percent passing, left-aligned
+    valid = (sizes > 0) & ~np.isnan(passing)
+    order = np.argsort(np.where(valid, sizes, np.inf), axis=1, kind="stable")
+    sizes = np.take_along_axis(sizes, order, axis=1)
+    passing = np.take_along_axis(passing, order, axis=1)
+    valid = np.take_along_axis(valid, order, axis=1)
+    running = np.maximum.accumulate(np.where(valid, passing, -np.inf), axis=1)
+    previous = np.concatenate([np.full((len(passing), 1), -np.inf), running[:, :-1]], axis=1)
+    keep = valid & (passing > previous)
+    order = np.argsort(~keep, axis=1, kind="stable")
+    keep = np.take_along_axis(keep, order, axis=1)
+    x = np.where(keep, np.take_along_axis(passing, order, axis=1), np.nan)
+    with np.errstate(divide='ignore'):
+        y = np.where(keep, np.log10(np.take_along_axis(sizes, order, axis=1)), np.nan)
+    count = keep.sum(axis=1)
+    
+    fit.update(x=x, y=y, count=count, slopes=_pchip_slopes(x, y, count))
+    return fit
+
+def evaluate_diameters(fit, target_percents):
+    """
+    Particle diameters at each target percent passing for every curve of a fit, as
+    an array with one row per curve and one column per target.
+    """
+    targets = np.asarray(target_percents, dtype=float)
+    x, y = fit["x"], fit["y"]
+    # Targets no pair of readings brackets get the finest or the coarsest sieve
+    lowest = fit["min_passing"] if fit["model"] != "pchip" else x[:, 0] if x.shape[1] else fit["min_passing"]
+    outside = np.where(targets[None, :] <= lowest[:, None], fit["min_size"][:, None], fit["max_size"][:, None])
+    if x.shape[1] < 2:
+        return outside
+    
+    if fit["model"] != "pchip":
+        # First pair of neighbouring readings that brackets each target, as in find_diameters_batch()
+        t = targets[None, None, :]
+        p1, p2 = x[:, :-1, None], x[:, 1:, None]
+        brackets = ((p1 <= t) & (t <= p2)) | ((p1 >= t) & (t >= p2))
+        found = brackets.any(axis=1)
+        first = np.argmax(brackets, axis=1)
+        x1, x2 = np.take_along_axis(x, first, axis=1), np.take_along_axis(x, first + 1, axis=1)
+        y1, y2 = np.take_along_axis(y, first, axis=1), np.take_along_axis(y, first + 1, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(x1 == x2, y1, y1 + (y2 - y1) * (targets[None, :] - x1) / (x2 - x1))
+        if fit["model"] == "log-linear":
+            with np.errstate(over='ignore'):
+                values = 10 ** values
+        return np.where(found, values, outside)
+    
+    # Cubic Hermite segment holding each target, in log size
+    count = fit["count"][:, None]
+    segment = np.clip((x[:, :, None] <= targets[None, None, :]).sum(axis=1) - 1, 0, np.maximum(count - 2, 0))
+    x1, x2 = np.take_along_axis(x, segment, axis=1), np.take_along_axis(x, np.minimum(segment + 1, x.shape[1] - 1), axis=1)
+    y1, y2 = np.take_along_axis(y, segment, axis=1), np.take_along_axis(y, np.minimum(segment + 1, x.shape[1] - 1), axis=1)
+    m1 = np.take_along_axis(fit["slopes"], segment, axis=1)
+    m2 = np.take_along_axis(fit["slopes"], np.minimum(segment + 1, x.shape[1] - 1), axis=1)
+    h = x2 - x1
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        s = (targets[None, :] - x1) / h
+        values = ((2 * s ** 3 - 3 * s ** 2 + 1) * y1 + (s ** 3 - 2 * s ** 2 + s) * h * m1
+                  + (-2 * s ** 3 + 3 * s ** 2) * y2 + (s ** 3 - s ** 2) * h * m2)
+        values = 10 ** values
+    inside = (count >= 2) & (targets[None, :] >= x[:, :1]) & \
+             (targets[None, :] <= np.take_along_axis(x, np.maximum(count - 1, 0), axis=1))
+    return np.where(inside, values, outside)
+
+def percent_passing_at_batch(sizes, passing, sieve_size):
+    """
+    Percent passing at a sieve size for every row of the padded arrays, interpolated
+    between neighbouring sieves (the mirror image of find_diameters_batch()).
+    """
+    return find_diameters_batch(passing, sizes, sieve_size)
+
+def analyze_samples_batch(curves, sample_names=None, interpolation=DEFAULT_INTERPOLATION):
+    """
+    Perform sieve analysis on many samples at once.
+    
+    curves is a list of (sieve_sizes, percent_passing) pairs, each as accepted by
+    analyze_sample(). Returns one dictionary per curve with the same keys and values
+    analyze_sample() would give, or with an "error" key where analyze_sample() would
+    raise (a zero D10 or D25).
+    """
+    if not curves:
+        return []
+    sample_names = sample_names or [f"Sample {i + 1}" for i in range(len(curves))]
+    sizes, passing = pad_curves(curves)
+    
+    # Every curve is fitted once and all D-values are read off in one pass
+    diameters = evaluate_diameters(fit_curves(sizes, passing, interpolation), D_PERCENTS)
+    d = {f"d{percent}": diameters[:, i] for i, percent in enumerate(D_PERCENTS)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cu = d["d60"] / d["d10"]
+        so = np.sqrt(d["d75"] / d["d25"])
+    
+    # Percent passing at the first sieve that is exactly 0.063 mm, else 0
+    is_063 = sizes == 0.063
+    percent_063 = np.where(is_063.any(axis=1), passing[np.arange(len(sizes)), np.argmax(is_063, axis=1)], 0)
+    
+    sorting_desc = np.select(
+        [so < 1.2, so < 1.5, so < 2.0, so < 4.0],
+        ["Very well sorted", "Well sorted", "Moderately sorted", "Poorly sorted"],
+        "Very poorly sorted"
+    )
+    
+    results = []
+    for i, (curve_sizes, curve_passing) in enumerate(curves):
+        if d["d10"][i] == 0 or d["d25"][i] == 0:
+            results.append({"sample_name": sample_names[i], "error": "float division by zero"})
+            continue
+        results.append({
+            "sample_name": sample_names[i],
+            "d10": float(d["d10"][i]),
+            "d25": float(d["d25"][i]),
+            "d30": float(d["d30"][i]),
+            "d50": float(d["d50"][i]),
+            "d60": float(d["d60"][i]),
+            "d75": float(d["d75"][i]),
+            "cu": float(cu[i]),
+            "so": float(so[i]),
+            "percent_063": float(percent_063[i]),
+            "sorting_desc": str(sorting_desc[i]),
+            "interpolation": interpolation,
+            "sieve_sizes": curve_sizes,
+            "percent_passing": curve_passing
+        })
+    return results
+
 def generate_underflow_data(sieve_sizes, percent_passing, cutoff_size):
     """
     Generate underflow data for a given cutoff size
@@ -190,16 +442,46 @@ def generate_overflow_data(sieve_sizes, percent_passing, cutoff_size):
     
     return overflow_sizes, overflow_passing
 
+# Screen splits a product can be derived with, by name
+SCREEN_OPERATIONS = {
+    "underflow": generate_underflow_data,
+    "overflow": generate_overflow_data
+}
+
+def apply_screen_operations(sieve_sizes, percent_passing, operations):
+    """
+    Apply a chain of screen splits to a gradation curve
+    operations is a list of (kind, cutoff_size) pairs, e.g. [("underflow", 1.0), ("overflow", 0.075)]
+    for the 0.075mm screen overflow of the 1mm screen underflow
+    Returns the sieve sizes and percent passing arrays of the final product
+    """
+    for kind, cutoff_size in operations:
+        sieve_sizes, percent_passing = SCREEN_OPERATIONS[kind](sieve_sizes, percent_passing, cutoff_size)
+    return sieve_sizes, percent_passing
+
+# Design criteria of the analysis report and the grading envelope
+D50_RANGE = (0.3, 0.5)   # 0.3mm <= D50 <= 0.5mm
+CU_RANGE = (1.5, 2.5)    # 1.5 <= Cu <= 2.5
+SO_MAX = 2.0             # So < 2.0
+PERCENT_063_MAX = 5.0    # % passing 0.063mm < 5%
+
+# Compliance criteria the web app checks samples against (sample pages, dashboard
+# summaries, /api/analyze, what-if defaults); a separate set from the ones above
+COMPLIANCE_D50_RANGE = (0.25, 0.35)   # 0.25mm <= D50 <= 0.35mm
+COMPLIANCE_CU_MAX = 2.5               # Cu < 2.5
+COMPLIANCE_SO_RANGE = (1.1, 1.7)      # 1.1 <= So <= 1.7
+COMPLIANCE_FINES_MAX = 5.0            # % passing 0.063mm < 5%
+
 def evaluate_criteria(results):
     """
     Evaluate the sample against the specified criteria
     Returns a dictionary with evaluation results
     """
     # Define criteria
-    d50_range = (0.3, 0.5)  # 0.3mm <= D50 <= 0.5mm
-    cu_range = (1.5, 2.5)   # 1.5 <= Cu <= 2.5
-    so_max = 2.0            # So < 2.0
-    percent_063_max = 5.0   # % passing 0.063mm < 5%
+    d50_range = D50_RANGE
+    cu_range = CU_RANGE
+    so_max = SO_MAX
+    percent_063_max = PERCENT_063_MAX
     
     # Check criteria
     d50_in_range = d50_range[0] <= results["d50"] <= d50_range[1]
@@ -219,6 +501,19 @@ def evaluate_criteria(results):
         "percent_063_max": percent_063_max
     }
 
+def evaluate_criteria_batch(d50, cu, so, percent_063):
+    """
+    evaluate_criteria() over arrays of D50, Cu, So and percent passing 0.063 mm.
+    Returns a dictionary of boolean arrays with the same *_in_range keys.
+    """
+    d50, cu, so, percent_063 = (np.asarray(values, dtype=float) for values in (d50, cu, so, percent_063))
+    return {
+        "d50_in_range": (D50_RANGE[0] <= d50) & (d50 <= D50_RANGE[1]),
+        "cu_in_range": (CU_RANGE[0] <= cu) & (cu <= CU_RANGE[1]),
+        "so_in_range": so < SO_MAX,
+        "percent_063_in_range": percent_063 < PERCENT_063_MAX
+    }
+
 def print_analysis_results(results, criteria_eval):
     """Print the analysis results in a formatted way"""
     print(f"\n# {results['sample_name']} Analysis Results")
@@ -232,6 +527,7 @@ def print_analysis_results(results, criteria_eval):
     print(f"- Trask Sorting Coefficient (So) = {results['so']:.2f}")
     print(f"- Sorting Classification: {results['sorting_desc']}")
     print(f"- Percent passing 0.063 mm = {results['percent_063']:.2f}%")
+    print(f"- Interpolation model: {results['interpolation']}")
     
     # Print the criteria evaluation table
     print("\n## Compliance with Design Criteria")
@@ -268,12 +564,14 @@ def print_analysis_results(results, criteria_eval):
 
 def plot_distribution(results, filename="particle_size_distribution.png"):
     """Plot the particle size distribution curve"""
-    plt.figure(figsize=(10, 6))
-    plt.semilogx(results["sieve_sizes"], results["percent_passing"], 'o-', linewidth=2)
-    plt.grid(True, which="both", ls="-")
-    plt.xlabel('Particle Size (mm)')
-    plt.ylabel('Percent Passing (%)')
-    plt.title(f'Particle Size Distribution Curve - {results["sample_name"]}')
+    # A figure of our own rather than pyplot's global one, so threads can plot at once
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    ax.semilogx(results["sieve_sizes"], results["percent_passing"], 'o-', linewidth=2)
+    ax.grid(True, which="both", ls="-")
+    ax.set_xlabel('Particle Size (mm)')
+    ax.set_ylabel('Percent Passing (%)')
+    ax.set_title(f'Particle Size Distribution Curve - {results["sample_name"]}')
     
     # Add D values to the plot
     for d_value, d_percent, d_name in [
@@ -283,12 +581,12 @@ def plot_distribution(results, filename="particle_size_distribution.png"):
         (results["d60"], 60, 'D60'), 
         (results["d75"], 75, 'D75')
     ]:
-        plt.plot([d_value, d_value], [0, d_percent], 'r--', linewidth=1)
-        plt.plot([0.01, d_value], [d_percent, d_percent], 'r--', linewidth=1)
-        plt.text(d_value, 5, f"{d_name}\n{d_value:.2f}mm", 
-                 horizontalalignment='center', verticalalignment='bottom')
+        ax.plot([d_value, d_value], [0, d_percent], 'r--', linewidth=1)
+        ax.plot([0.01, d_value], [d_percent, d_percent], 'r--', linewidth=1)
+        ax.text(d_value, 5, f"{d_name}\n{d_value:.2f}mm", 
+                horizontalalignment='center', verticalalignment='bottom')
 
-    plt.savefig(filename)
+    fig.savefig(filename)
     print(f"\nParticle size distribution curve saved as '{filename}'")
 
 def generate_envelope_curves():
@@ -304,14 +602,14 @@ def generate_envelope_curves():
     
     # Upper bound curve - steeper curve (less uniform, wider range of particle sizes)
     # D50 = 0.5mm (upper bound), Cu = 2.5 (upper bound)
-    d50_upper = 0.5
-    cu_upper = 2.5
+    d50_upper = D50_RANGE[1]
+    cu_upper = CU_RANGE[1]
     d10_upper = d50_upper / cu_upper
     
     # Lower bound curve - flatter curve (more uniform, narrower range of particle sizes)
     # D50 = 0.3mm (lower bound), Cu = 1.5 (lower bound)
-    d50_lower = 0.3
-    cu_lower = 1.5
+    d50_lower = D50_RANGE[0]
+    cu_lower = CU_RANGE[0]
     d10_lower = d50_lower / cu_lower
     
     # Generate the curves using log-normal distribution approximation
@@ -355,61 +653,57 @@ def generate_envelope_curves():
     
     return envelope_sizes, lower_bound, upper_bound
 
-def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envelope.png", d50_microns=350):
+def _draw_envelope_base(results_list, criteria_eval_list, envelope):
     """
-    Plot multiple sample distributions with the grading envelope
-    
-    Parameters:
-    - results_list: List of result dictionaries from analyze_sample()
-    - criteria_eval_list: List of criteria evaluation dictionaries
-    - filename: Output filename for the plot
-    - d50_microns: D50 in microns to display in the title
+    Draw everything the envelope plot variants have in common: samples, envelope
+    bounds, classification bar, legend, criteria box and D-value markers.
+    Returns the figure, its main axes and the two envelope lines.
     """
-    # Get envelope curves
-    envelope_sizes, lower_bound, upper_bound = generate_envelope_curves()
+    envelope_sizes, lower_bound, upper_bound = envelope
     
-    # Create figure with semi-log x-axis
-    plt.figure(figsize=(12, 8))
+    # Create figure with semi-log x-axis (a figure of our own, not pyplot's global one)
+    fig = Figure(figsize=(12, 8))
+    ax = fig.add_subplot()
     
     # Setup the grid
-    plt.grid(True, which='major', linestyle='-', alpha=0.5)
-    plt.grid(True, which='minor', linestyle=':', alpha=0.2)
+    ax.grid(True, which='major', linestyle='-', alpha=0.5)
+    ax.grid(True, which='minor', linestyle=':', alpha=0.2)
     
     # Plot sample data first (so it's on top)
     colors = ['r-', 'g-', 'c-']
     markers = ['o', 's', '^']
     for i, (results, criteria_eval) in enumerate(zip(results_list, criteria_eval_list)):
         # Draw the distribution curve
-        plt.semilogx(results["sieve_sizes"], results["percent_passing"], colors[i], 
+        ax.semilogx(results["sieve_sizes"], results["percent_passing"], colors[i], 
                     linewidth=2, label=results["sample_name"], marker=markers[i], markersize=5)
     
     # Plot envelope bounds
-    plt.semilogx(envelope_sizes, upper_bound, 'b--', linewidth=2, label='Upper Bound')
-    plt.semilogx(envelope_sizes, lower_bound, 'b--', linewidth=2, label='Lower Bound')
+    envelope_lines = (
+        ax.semilogx(envelope_sizes, upper_bound, 'b--', linewidth=2, label='Upper Bound')[0],
+        ax.semilogx(envelope_sizes, lower_bound, 'b--', linewidth=2, label='Lower Bound')[0]
+    )
     
     # Create custom x-ticks for the soil classification
     soil_sizes = [0.0001, 0.001, 0.01, 0.1, 1, 10, 100]
-    plt.xticks(soil_sizes)
+    ax.set_xticks(soil_sizes)
     
     # Set plot limits and labels
-    plt.xlim(0.0001, 100)
-    plt.ylim(0, 100)
-    plt.xlabel('Particle Size (mm)', fontsize=12, fontweight='bold')
-    plt.ylabel('Percentage Passing (%)', fontsize=12, fontweight='bold')
-    plt.title(f'Grading Envelope for Beach Sand; D50 = {d50_microns}microns', fontsize=14, fontweight='bold')
+    ax.set_xlim(0.0001, 100)
+    ax.set_ylim(0, 100)
+    ax.set_xlabel('Particle Size (mm)', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Percentage Passing (%)', fontsize=12, fontweight='bold')
     
     # Add soil classification at the bottom
     # Create a secondary x-axis at the bottom for soil classification
-    ax = plt.gca()
-    ax_classification = plt.axes([0.1, 0.05, 0.8, 0.03], frameon=True)
+    ax_classification = fig.add_axes([0.1, 0.05, 0.8, 0.03], frameon=True)
     
     # Add soil classification boxes
     # Clay
-    ax_classification.add_patch(plt.Rectangle((0, 0), 0.2, 1, facecolor='yellow', alpha=0.5))
+    ax_classification.add_patch(Rectangle((0, 0), 0.2, 1, facecolor='yellow', alpha=0.5))
     ax_classification.text(0.1, 0.5, 'CLAY', ha='center', va='center', fontsize=9, fontweight='bold')
     
     # Silt
-    ax_classification.add_patch(plt.Rectangle((0.2, 0), 0.35-0.2, 1, facecolor='khaki', alpha=0.5))
+    ax_classification.add_patch(Rectangle((0.2, 0), 0.35-0.2, 1, facecolor='khaki', alpha=0.5))
     ax_classification.text(0.275, 0.5, 'SILT', ha='center', va='center', fontsize=9, fontweight='bold')
     
     # Split Silt into Fine, Medium, Coarse
@@ -420,7 +714,7 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
     ax_classification.text(0.325, 0.85, 'Coarse', ha='center', va='center', fontsize=7)
     
     # Sand
-    ax_classification.add_patch(plt.Rectangle((0.35, 0), 0.8-0.35, 1, facecolor='lightgreen', alpha=0.5))
+    ax_classification.add_patch(Rectangle((0.35, 0), 0.8-0.35, 1, facecolor='lightgreen', alpha=0.5))
     ax_classification.text(0.575, 0.5, 'SAND', ha='center', va='center', fontsize=9, fontweight='bold')
     
     # Split Sand into Fine, Medium, Coarse
@@ -431,7 +725,7 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
     ax_classification.text(0.725, 0.85, 'Coarse', ha='center', va='center', fontsize=7)
     
     # Gravel
-    ax_classification.add_patch(plt.Rectangle((0.8, 0), 1-0.8, 1, facecolor='lightgray', alpha=0.5))
+    ax_classification.add_patch(Rectangle((0.8, 0), 1-0.8, 1, facecolor='lightgray', alpha=0.5))
     ax_classification.text(0.9, 0.5, 'GRAVEL', ha='center', va='center', fontsize=9, fontweight='bold')
     
     # Split Gravel into Fine, Medium, Coarse
@@ -448,8 +742,7 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
     ax_classification.set_ylim(0, 1)
     
     # Add legend
-    plt.axes(ax)  # Switch back to main axes
-    plt.legend(loc='lower right', fontsize=10)
+    ax.legend(loc='lower right', fontsize=10)
     
     # Add a box with criteria information
     criteria_text = (
@@ -459,7 +752,7 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
         f"3. So < {criteria_eval_list[0]['so_max']}\n"
         f"4. % passing 0.063mm < {criteria_eval_list[0]['percent_063_max']}%"
     )
-    plt.annotate(criteria_text, xy=(0.02, 0.2), xycoords='axes fraction', 
+    ax.annotate(criteria_text, xy=(0.02, 0.2), xycoords='axes fraction', 
                  bbox=dict(boxstyle="round,pad=0.5", fc="white", alpha=0.8),
                  fontsize=10)
     
@@ -468,7 +761,7 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
         # Add a point for D50
         d50_x = results["d50"]
         d50_y = 50
-        plt.plot(d50_x, d50_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
+        ax.plot(d50_x, d50_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
         
         # Conditionally add D10 and D60 points for main samples
         if i == 0:  # Original sample
@@ -476,41 +769,107 @@ def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envel
             d10_y = 10
             d60_x = results["d60"]
             d60_y = 60
-            plt.plot(d10_x, d10_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
-            plt.plot(d60_x, d60_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
+            ax.plot(d10_x, d10_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
+            ax.plot(d60_x, d60_y, 'o', markersize=8, color=colors[i][0], markeredgecolor='black')
     
-    # Save the figure
-    plt.tight_layout()
-    plt.savefig(filename, dpi=300)
-    print(f"\nGrading envelope plot saved as '{filename}'")
+    return fig, ax, envelope_lines
+
+def plot_envelope_variants(results_list, criteria_eval_list, variants, dpi=300):
+    """
+    Save several versions of the grading envelope plot from one drawing.
     
-    # Create a second plot with D50 = 250 microns
-    if d50_microns == 350:
-        # Adjust figure title for second plot
-        plt.title(f'Grading Envelope for Beach Sand; D50 = 250microns', fontsize=14, fontweight='bold')
-        # Save as a different file
-        second_filename = filename.replace(".png", "_250microns.png")
-        plt.savefig(second_filename, dpi=300)
-        print(f"\nSecond grading envelope plot saved as '{second_filename}'")
+    Parameters:
+    - results_list: List of result dictionaries from analyze_sample()
+    - criteria_eval_list: List of criteria evaluation dictionaries
+    - variants: List of (filename, d50_microns) or (filename, d50_microns, envelope)
+      tuples, where envelope is (sizes, lower_bound, upper_bound) to draw a
+      different envelope in that file
+    - dpi: Resolution of the saved images
+    
+    The shared layers are rendered once; for each variant only the title (and the
+    envelope lines, if the variant has its own) are drawn over a copy of that
+    rendering. The PNG files are then encoded on a thread pool.
+    """
+    with stage("envelope curves"):
+        default_envelope = generate_envelope_curves()
+    per_variant_envelope = any(len(variant) > 2 for variant in variants)
+    
+    fig, ax, envelope_lines = _draw_envelope_base(results_list, criteria_eval_list, default_envelope)
+    
+    # Lay out with a title in place, then keep the title (and any per-variant envelope)
+    # out of the shared rendering
+    title = ax.set_title(f'Grading Envelope for Beach Sand; D50 = {variants[0][1]}microns',
+                         fontsize=14, fontweight='bold')
+    fig.tight_layout()
+    title.set_animated(True)
+    for line in envelope_lines:
+        line.set_animated(per_variant_envelope)
+    
+    fig.set_dpi(dpi)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    
+    with ThreadPoolExecutor() as pool:
+        saves = []
+        for variant in variants:
+            filename, d50_microns = variant[:2]
+            canvas.restore_region(background)
+            if per_variant_envelope:
+                sizes, lower_bound, upper_bound = variant[2] if len(variant) > 2 else default_envelope
+                envelope_lines[0].set_data(sizes, upper_bound)
+                envelope_lines[1].set_data(sizes, lower_bound)
+                for line in envelope_lines:
+                    ax.draw_artist(line)
+            title.set_text(f'Grading Envelope for Beach Sand; D50 = {d50_microns}microns')
+            ax.draw_artist(title)
+            
+            image = Image.frombuffer('RGBA', canvas.get_width_height(), bytes(canvas.buffer_rgba()), 'raw', 'RGBA', 0, 1)
+            saves.append((filename, pool.submit(image.save, filename, dpi=(dpi, dpi))))
+        
+        for filename, save in saves:
+            save.result()
+            print(f"\nGrading envelope plot saved as '{filename}'")
     
-    return plt
+    return fig
 
-def main():
+def plot_with_envelope(results_list, criteria_eval_list, filename="grading_envelope.png", d50_microns=350):
+    """
+    Plot multiple sample distributions with the grading envelope
+    
+    Parameters:
+    - results_list: List of result dictionaries from analyze_sample()
+    - criteria_eval_list: List of criteria evaluation dictionaries
+    - filename: Output filename for the plot
+    - d50_microns: D50 in microns to display in the title
+    
+    For D50 = 350 microns a second copy titled 250 microns is saved as well
+    (filename with "_250microns" appended).
+    """
+    variants = [(filename, d50_microns)]
+    if d50_microns == 350:
+        variants.append((filename.replace(".png", "_250microns.png"), 250))
+    return plot_envelope_variants(results_list, criteria_eval_list, variants)
+
+def main(interpolation=DEFAULT_INTERPOLATION):
     # Complete beach sand sieve analysis data - in descending order of sieve size
     sieve_sizes_original = [28, 20, 19, 14, 10, 6.3, 5, 4.75, 3.35, 2.36, 2, 1.18, 0.600, 0.425, 0.300, 0.212, 0.150, 0.075, 0.063, 0]
     percent_passing_original = [100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 67.5, 53.8, 43.8, 32.6, 1.1, 0.4, 0.0]
     
     # Part 1: Analyze the original sample
     print("\n===== ORIGINAL SAMPLE ANALYSIS =====")
-    original_results = analyze_sample(sieve_sizes_original, percent_passing_original, "Original Sample")
-    original_criteria = evaluate_criteria(original_results)
+    with stage("analysis: original"):
+        original_results = analyze_sample(sieve_sizes_original, percent_passing_original, "Original Sample", interpolation)
+        original_criteria = evaluate_criteria(original_results)
     print_analysis_results(original_results, original_criteria)
     
     # Part 2: Analyze the 1mm screen underflow
     print("\n===== 1mm SCREEN UNDERFLOW ANALYSIS =====")
-    underflow_1mm_sizes, underflow_1mm_passing = generate_underflow_data(sieve_sizes_original, percent_passing_original, 1.0)
-    underflow_1mm_results = analyze_sample(underflow_1mm_sizes, underflow_1mm_passing, "1mm Screen Underflow")
-    underflow_1mm_criteria = evaluate_criteria(underflow_1mm_results)
+    with stage("split: 1mm underflow"):
+        underflow_1mm_sizes, underflow_1mm_passing = generate_underflow_data(sieve_sizes_original, percent_passing_original, 1.0)
+    with stage("analysis: 1mm underflow"):
+        underflow_1mm_results = analyze_sample(underflow_1mm_sizes, underflow_1mm_passing, "1mm Screen Underflow", interpolation)
+        underflow_1mm_criteria = evaluate_criteria(underflow_1mm_results)
     print_analysis_results(underflow_1mm_results, underflow_1mm_criteria)
     
     # Print the underflow passing percentages for reference
@@ -525,9 +884,11 @@ def main():
     # Part 3: Analyze the 0.075mm screen overflow (from 1mm underflow)
     print("\n===== 0.075mm SCREEN OVERFLOW ANALYSIS (FROM 1mm UNDERFLOW) =====")
     # Calculate the proper overflow data (material retained on the 0.075mm sieve)
-    overflow_sizes, overflow_passing = generate_overflow_data(underflow_1mm_sizes, underflow_1mm_passing, 0.075)
-    overflow_results = analyze_sample(overflow_sizes, overflow_passing, "0.075mm Screen Overflow")
-    overflow_criteria = evaluate_criteria(overflow_results)
+    with stage("split: 0.075mm overflow"):
+        overflow_sizes, overflow_passing = generate_overflow_data(underflow_1mm_sizes, underflow_1mm_passing, 0.075)
+    with stage("analysis: 0.075mm overflow"):
+        overflow_results = analyze_sample(overflow_sizes, overflow_passing, "0.075mm Screen Overflow", interpolation)
+        overflow_criteria = evaluate_criteria(overflow_results)
     print_analysis_results(overflow_results, overflow_criteria)
     
     # Print the overflow passing percentages for reference
@@ -540,18 +901,27 @@ def main():
     print("-" * 50)
     
     # Create individual plots for each analysis
-    plot_distribution(original_results, "original_sample_distribution.png")
-    plot_distribution(underflow_1mm_results, "1mm_underflow_distribution.png")
-    plot_distribution(overflow_results, "0075mm_overflow_distribution.png")
+    for results, filename in [
+        (original_results, "original_sample_distribution.png"),
+        (underflow_1mm_results, "1mm_underflow_distribution.png"),
+        (overflow_results, "0075mm_overflow_distribution.png")
+    ]:
+        with stage(f"plot: {filename}"):
+            plot_distribution(results, filename)
     
     # Create the combined plot with grading envelope
     results_list = [original_results, underflow_1mm_results, overflow_results]
     criteria_eval_list = [original_criteria, underflow_1mm_criteria, overflow_criteria]
     
     # Create all versions of the grading envelope plot
-    plot_with_envelope(results_list, criteria_eval_list, "beach_sand_grading_envelope_350microns.png", 350)
-    plot_with_envelope(results_list, criteria_eval_list, "beach_sand_grading_envelope_250microns.png", 250)
-    plot_with_envelope(results_list, criteria_eval_list, "beach_sand_grading_envelope_400microns.png", 400)
+    # (including the 250-micron copy of the 350-micron plot), drawn once and saved per variant
+    with stage("envelope plots"):
+        plot_envelope_variants(results_list, criteria_eval_list, [
+            ("beach_sand_grading_envelope_350microns.png", 350),
+            ("beach_sand_grading_envelope_350microns_250microns.png", 250),
+            ("beach_sand_grading_envelope_250microns.png", 250),
+            ("beach_sand_grading_envelope_400microns.png", 400)
+        ])
     
     # Summary
     print("\n===== ANALYSIS SUMMARY =====")
@@ -573,4 +943,9 @@ def main():
         print(f"{sample}: {passed}/4 criteria met")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Beach sand sieve analysis")
+    parser.add_argument("--interpolation", choices=INTERPOLATION_MODELS, default=DEFAULT_INTERPOLATION,
+                        help="How D-values are interpolated between sieves (default: %(default)s)")
+    add_profile_argument(parser, "sieve_analysis_profile")
+    args = parser.parse_args()
+    run_profiled(main, args.profile, args.interpolation) 
\ No newline at end of file
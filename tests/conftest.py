@@ -0,0 +1,83 @@
+"""
+Shared fixtures. The repository root and web_app/ are put on the path so the tests
+import the modules the way the scripts and the app do. The web app is imported once
+per session against a database in a temporary directory (DATABASE), with its uploads
+and plots kept there too.
+"""
+
+import io
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT, 'web_app'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+SIZES = [4, 2, 1, 0.5, 0.25, 0.125, 0.063]
+PASSING = [100, 98, 85, 52, 20, 6, 1]
+
+
+def curves_csv(curves):
+    """A wide-layout CSV (sieve_size plus one column per sample) of {name: percent passing}."""
+    lines = ['sieve_size,' + ','.join(curves)]
+    for i, size in enumerate(SIZES):
+        lines.append(f'{size},' + ','.join(str(passing[i]) for passing in curves.values()))
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture(scope='session')
+def web_app(tmp_path_factory):
+    """The Flask app module, initialized on an empty database."""
+    directory = tmp_path_factory.mktemp('web_app')
+    os.environ['DATABASE'] = str(directory / 'beach_sand.db')
+    import app as web_app
+    web_app.app.config['TESTING'] = True
+    web_app.app.config['UPLOAD_FOLDER'] = str(directory / 'uploads')
+    web_app.app.config['STATIC_FOLDER'] = str(directory / 'static')
+    os.makedirs(web_app.app.config['UPLOAD_FOLDER'])
+    os.makedirs(os.path.join(web_app.app.config['STATIC_FOLDER'], 'plots'))
+    return web_app
+
+
+@pytest.fixture
+def client(web_app):
+    return web_app.app.test_client()
+
+
+@pytest.fixture
+def upload(client):
+    """Upload files ({filename: bytes or text}) and wait for the import job; returns its final state."""
+    def upload(files, **form):
+        data = dict(form, file=[(io.BytesIO(content.encode() if isinstance(content, str) else content), name)
+                                for name, content in files.items()])
+        response = client.post('/upload', data=data, headers={'Accept': 'application/json'},
+                               content_type='multipart/form-data')
+        assert response.status_code == 202, response.get_data(as_text=True)
+        job_id = response.get_json()['job_id']
+        client.get(f'/jobs/{job_id}/events').get_data()
+        return client.get(f'/jobs/{job_id}').get_json()
+    return upload
+
+
+@pytest.fixture
+def sample_ids(web_app):
+    """IDs of the stored samples by name."""
+    def sample_ids(*names):
+        conn = web_app.get_db_connection()
+        rows = {row['name']: row['id'] for row in conn.execute('SELECT id, name FROM samples')}
+        conn.close()
+        return [rows[name] for name in names]
+    return sample_ids
+
+
+@pytest.fixture
+def connection(tmp_path):
+    """A connection to an empty database file in the test's directory."""
+    conn = sqlite3.connect(tmp_path / 'test.db')
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
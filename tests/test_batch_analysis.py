@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES
+from curve_matrix import STANDARD_SIEVES
+from sieve_analysis import (CU_RANGE, D50_RANGE, INTERPOLATION_MODELS, analyze_sample, analyze_samples_batch,
+                            evaluate_criteria, evaluate_criteria_batch, generate_envelope_curves)
+
+KEYS = ('d10', 'd25', 'd30', 'd50', 'd60', 'd75', 'cu', 'so', 'percent_063')
+
+
+def random_curves(count, seed=37):
+    """Curves on random subsets of the standard sieves, coarsest first, some ending in the pan."""
+    rng = np.random.default_rng(seed)
+    curves = []
+    for _ in range(count):
+        sizes = np.sort(rng.choice(STANDARD_SIEVES[:25], rng.integers(4, 15), replace=False))[::-1].tolist()
+        passing = np.sort(rng.uniform(0, 100, len(sizes)))[::-1]
+        passing[0] = 100.0
+        passing = np.round(passing, 1).tolist()
+        if rng.random() < 0.3:
+            sizes.append(0)
+            passing.append(0.0)
+        curves.append((sizes, passing))
+    return curves
+
+
+@pytest.mark.parametrize('model', INTERPOLATION_MODELS)
+def test_batch_matches_one_at_a_time(model):
+    curves = random_curves(200) + [(SIZES, PASSING), ([1, 0], [50, 20])]
+    batch = analyze_samples_batch(curves, interpolation=model)
+    for (sizes, passing), result in zip(curves, batch):
+        try:
+            expected = analyze_sample(sizes, passing, result['sample_name'], model)
+        except ZeroDivisionError:
+            assert 'error' in result
+            continue
+        assert result['sorting_desc'] == expected['sorting_desc']
+        assert [result[key] for key in KEYS] == pytest.approx([expected[key] for key in KEYS], rel=1e-9, abs=1e-12)
+    assert 'error' in batch[-1]
+
+
+def test_batch_criteria_match_scalar_criteria():
+    results = [result for result in analyze_samples_batch(random_curves(100, seed=3)) if 'error' not in result]
+    batch = evaluate_criteria_batch(*([result[key] for result in results] for key in ('d50', 'cu', 'so', 'percent_063')))
+    for i, result in enumerate(results):
+        expected = evaluate_criteria(result)
+        assert {key: bool(values[i]) for key, values in batch.items()} == \
+            {key: expected[key] for key in batch}
+
+
+def test_report_criteria_and_envelope_agree():
+    # The report's criteria are not the web app's compliance criteria
+    result = {'d50': 0.45, 'cu': 1.8, 'so': 1.9, 'percent_063': 1.0}
+    assert all(evaluate_criteria(result)[key] for key in ('d50_in_range', 'cu_in_range', 'so_in_range'))
+    sizes, lower, upper = generate_envelope_curves()
+    # The envelope's bounds cross 50 % passing at the ends of the D50 range
+    assert sizes[np.argmin(np.abs(upper - 50))] == pytest.approx(D50_RANGE[1], rel=0.01)
+    assert sizes[np.argmin(np.abs(lower - 50))] == pytest.approx(D50_RANGE[0], rel=0.01)
+    assert CU_RANGE == (1.5, 2.5)
+
+
+def test_analyze_endpoint(client):
+    single = client.post('/api/analyze', json={'name': 'one', 'sieve_sizes': SIZES, 'percent_passing': PASSING})
+    assert single.status_code == 200
+    result = single.get_json()
+    expected = analyze_sample(SIZES, PASSING)
+    assert result['d50'] == pytest.approx(expected['d50'], abs=1e-6)
+    assert set(result['compliance']) == {'d50_compliant', 'cu_compliant', 'so_compliant', 'fines_compliant',
+                                         'total_compliant'}
+
+    batch = client.post('/api/analyze', json={'curves': [
+        {'sieve_sizes': SIZES, 'percent_passing': PASSING},
+        {'sieve_sizes': [1], 'percent_passing': [50]},
+        {'sieve_sizes': SIZES, 'percent_passing': ['a'] * len(SIZES)},
+    ]}).get_json()
+    assert (batch['count'], batch['failed']) == (3, 2)
+    assert 'error' not in batch['results'][0]
+
+    assert client.post('/api/analyze?interpolation=cubic', json=[{'sieve_sizes': SIZES,
+                                                                  'percent_passing': PASSING}]).status_code == 400
+    assert client.post('/api/analyze', json={'sieve_sizes': [1], 'percent_passing': [2]}).status_code == 400
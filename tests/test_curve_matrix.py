@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES
+from db_writer import DatabaseWriter
+from curve_matrix import STANDARD_SIEVES, CurveMatrix, create_curve_tables, curve_statistics, resample_curve
+
+
+@pytest.fixture
+def conn(connection):
+    connection.execute('CREATE TABLE samples (id INTEGER PRIMARY KEY)')
+    create_curve_tables(connection)
+    return connection
+
+
+def test_resample_interpolates_in_log_size():
+    vector = resample_curve([2, 0.5, 'pan', 0], [80, 40, 0, 0], grid=[0.25, 0.5, 1.0, 2.0, 4.0])
+    # Halfway between 0.5 and 2 mm in log size is 1 mm; outside the sieves the curve is held
+    assert vector.tolist() == pytest.approx([40, 40, 60, 80, 80])
+    assert resample_curve([1, 'pan'], [50, 0]) is None
+
+
+def test_update_remove_and_reload(conn):
+    curves = {sample_id: (SIZES, [p * sample_id / 3 for p in PASSING]) for sample_id in (1, 2, 3)}
+    matrix = CurveMatrix()
+    matrix.load(conn, [], None)
+    matrix.update(conn, curves, curves)
+    assert len(matrix) == 3
+
+    matrix.remove(1)
+    conn.execute('DELETE FROM curve_vectors WHERE sample_id = 1')
+    ids, vectors = matrix.select()
+    assert sorted(ids.tolist()) == [2, 3]
+    assert matrix.row(3).tolist() == pytest.approx(resample_curve(*curves[3]).tolist())
+
+    reloaded = CurveMatrix()
+    reloaded.load(conn, [2, 3], lambda sample_ids: {})
+    assert len(reloaded) == 2
+    assert np.array_equal(reloaded.row(2), matrix.row(2))
+
+
+def test_rolled_back_writes_leave_the_matrix_alone(conn, tmp_path):
+    matrix = CurveMatrix()
+    matrix.load(conn, [], None)
+    conn.commit()
+    path = str(tmp_path / 'test.db')
+    writer = DatabaseWriter()
+
+    def store_then_fail(conn, sample_ids, curves):
+        matrix.store(conn, sample_ids, curves)
+        raise ValueError('later step failed')
+
+    with pytest.raises(ValueError):
+        matrix.apply(writer.run(path, store_then_fail, [1], {1: (SIZES, PASSING)}))
+    assert len(matrix) == 0
+    matrix.apply(writer.run(path, matrix.store, [1], {1: (SIZES, PASSING)}))
+    writer.close()
+    assert matrix.row(1).tolist() == pytest.approx(resample_curve(SIZES, PASSING).tolist())
+    assert conn.execute('SELECT COUNT(*) FROM curve_vectors').fetchone()[0] == 1
+
+
+def test_other_grid_recomputes_stored_rows(conn):
+    curves = {1: (SIZES, PASSING)}
+    matrix = CurveMatrix()
+    matrix.load(conn, [], None)
+    matrix.update(conn, [1], curves)
+    coarse = CurveMatrix(grid=[0.125, 0.5, 2.0])
+    coarse.load(conn, [1], lambda sample_ids: {sample_id: curves[sample_id] for sample_id in sample_ids})
+    assert coarse.row(1).tolist() == pytest.approx([6, 52, 98])
+    stored = conn.execute('SELECT vector FROM curve_vectors WHERE sample_id = 1').fetchone()[0]
+    assert len(np.frombuffer(stored, dtype=np.float32)) == 3
+
+
+def test_statistics_per_sieve():
+    matrix = np.array([[0, 10], [10, 30]], dtype=np.float32)
+    statistics = curve_statistics(matrix, percentiles=(50,))
+    assert statistics['mean'] == [5, 20]
+    assert statistics['std'] == [5, 10]
+    assert statistics['percentiles']['50'] == [5, 20]
+    assert curve_statistics(np.zeros((0, len(STANDARD_SIEVES)))) is None
@@ -0,0 +1,85 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import PASSING, SIZES
+from curve_storage import (FORMAT_VERSION, HEADER, check_storage, create_curve_table, decode_curve, encode_curve,
+                           install_curve_views, read_curve, read_curves, write_curves)
+from import_excel_to_sqlite import create_database, import_files
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_path = str(tmp_path / 'curves.db')
+    create_database(db_path)
+    conn = sqlite3.connect(db_path)
+    create_curve_table(conn)
+    yield conn
+    conn.close()
+
+
+def test_blobs_round_trip():
+    for compress in (False, True):
+        blob = encode_curve(SIZES[::-1], PASSING[::-1], compress)
+        sizes, passing = decode_curve(blob)
+        assert sizes.tolist() == SIZES and passing.tolist() == PASSING
+    assert len(encode_curve(SIZES, PASSING)) == HEADER.size + 16 * len(SIZES)
+
+    # zlib is only used where it makes the blob smaller
+    long = encode_curve(np.arange(1000.0), np.full(1000, 50.0), compress=True)
+    assert long[1] == 1 and len(long) < 16000
+    noise = np.random.default_rng(0).random((2, 3))
+    assert encode_curve(*noise, compress=True)[1] == 0
+    assert decode_curve(long)[1].tolist() == [50.0] * 1000
+
+    with pytest.raises(ValueError):
+        encode_curve(SIZES, PASSING[:-1])
+    with pytest.raises(ValueError, match='version'):
+        decode_curve(HEADER.pack(FORMAT_VERSION + 1, 0, 0))
+    with pytest.raises(ValueError):
+        check_storage('parquet')
+
+
+def test_both_forms_are_read(conn):
+    conn.executemany('INSERT INTO samples (id, name) VALUES (?, ?)', [(1, 'rows'), (2, 'blob'), (3, 'empty')])
+    conn.executemany('INSERT INTO sieve_data (sample_id, sieve_size, percent_passing) VALUES (1, ?, ?)',
+                     zip(SIZES[::-1], PASSING[::-1]))
+    write_curves(conn, {2: (SIZES, PASSING)}, compress=True)
+    curves = read_curves(conn, [1, 2, 3])
+    assert sorted(curves) == [1, 2]
+    for sizes, passing in curves.values():
+        assert sizes.tolist() == SIZES and passing.tolist() == PASSING
+    assert read_curve(conn, 3) is None
+
+    # Packing sample 1 replaces its rows
+    write_curves(conn, {1: (SIZES, PASSING)})
+    assert conn.execute('SELECT COUNT(*) FROM sieve_data').fetchone()[0] == 0
+    assert read_curve(conn, 1)[1].tolist() == PASSING
+
+
+def test_views_unpack_blobs_into_rows(conn):
+    conn.execute("INSERT INTO samples (id, name) VALUES (1, 'blob')")
+    write_curves(conn, {1: (SIZES, PASSING)})
+    install_curve_views(conn)
+    rows = conn.execute('SELECT sample_id, sieve_size, percent_passing FROM sieve_data ORDER BY sieve_size DESC')
+    assert [tuple(row) for row in rows] == [(1, size, passing) for size, passing in zip(SIZES, PASSING)]
+    assert conn.execute('SELECT sample_id FROM curve_samples').fetchall() == [(1,)]
+
+
+def test_imports_store_the_same_curve_in_either_form(tmp_path):
+    csv_path = tmp_path / 'curves.csv'
+    pd.DataFrame({'sieve_size': SIZES, 'S-1': PASSING}).to_csv(csv_path, index=False)
+    curves = {}
+    for storage in ('rows', 'blob-zlib'):
+        db_path = str(tmp_path / f'{storage}.db')
+        create_database(db_path)
+        sample_id, = import_files([str(csv_path)], db_path=db_path, max_workers=1, storage=storage)[0]['sample_ids']
+        conn = sqlite3.connect(db_path)
+        curves[storage] = read_curve(conn, sample_id)
+        packed = conn.execute('SELECT COUNT(*) FROM sample_curves').fetchone()[0]
+        conn.close()
+        assert packed == (storage != 'rows')
+    for rows, blob in zip(curves['rows'], curves['blob-zlib']):
+        assert rows.tolist() == blob.tolist()
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import PASSING, curves_csv
+from db_writer import DatabaseWriter, execute
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'writes.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE items (value INTEGER)')
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def writer():
+    opened = []
+
+    def prepare(conn, path):
+        opened.append(conn)
+        return conn
+
+    writer = DatabaseWriter(prepare, max_delay=0.5, max_batch=3)
+    writer.opened = opened
+    yield writer
+    writer.close()
+
+
+def committed(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(value for value, in conn.execute('SELECT value FROM items'))
+    finally:
+        conn.close()
+
+
+def insert_and_commit(conn, value):
+    with conn:
+        conn.execute('INSERT INTO items VALUES (?)', (value,))
+    conn.commit()
+
+
+def insert_and_fail(conn, value):
+    conn.execute('INSERT INTO items VALUES (?)', (value,))
+    raise ValueError('bad reading')
+
+
+def snapshot(conn, path):
+    # What this batch's transaction and another connection each see so far
+    return [value for value, in conn.execute('SELECT value FROM items ORDER BY value')], committed(path)
+
+
+def test_batch_shares_one_transaction_and_rolls_back_a_failure(writer, path):
+    # A full batch (max_batch 3) runs at once
+    futures = [writer.submit(path, insert_and_commit, 1), writer.submit(path, insert_and_fail, 2),
+               writer.submit(path, snapshot, path)]
+    assert futures[0].result(timeout=5) is None
+    with pytest.raises(ValueError, match='bad reading'):
+        futures[1].result(timeout=5)
+    # The commits inside the first operation did not end the transaction, and the
+    # failed operation's insert was rolled back alone
+    assert futures[2].result(timeout=5) == ([1], [])
+    assert committed(path) == [1]
+
+    # The next batch reuses the connection
+    futures = [writer.submit(path, execute, 'INSERT INTO items VALUES (?)', (value,)) for value in (3, 4, 5)]
+    assert [future.result(timeout=5)[0] for future in futures] == [1, 1, 1]
+    assert committed(path) == [1, 3, 4, 5]
+    assert len(writer.opened) == 1
+
+
+def test_failed_transaction_reopens_the_connection(writer, path):
+    def end_transaction(conn):
+        conn.execute('ROLLBACK')   # takes the batch's savepoints with it
+
+    futures = [writer.submit(path, execute, 'INSERT INTO items VALUES (1)'), writer.submit(path, end_transaction)]
+    futures.append(writer.submit(path, execute, 'INSERT INTO items VALUES (2)'))
+    for future in futures:
+        with pytest.raises(sqlite3.Error):
+            future.result(timeout=5)
+    assert committed(path) == []
+
+    assert writer.run(path, execute, 'INSERT INTO items VALUES (3)')[0] == 1
+    assert committed(path) == [3]
+    assert len(writer.opened) == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        writer.opened[0].execute('SELECT 1')
+
+
+def test_close_finishes_queued_writes(path):
+    writer = DatabaseWriter()
+    release = threading.Event()
+    first = writer.submit(path, lambda conn: release.wait(5))
+    queued = writer.submit(path, execute, 'INSERT INTO items VALUES (1)')
+    release.set()
+    with pytest.raises(RuntimeError, match='wait for itself'):
+        writer.run(path, lambda conn: writer.submit(path, execute, 'SELECT 1'))
+    writer.close()
+    assert first.result() is True and queued.result() == (1, 1)
+    assert committed(path) == [1]
+    with pytest.raises(RuntimeError, match='closed'):
+        writer.submit(path, execute, 'SELECT 1')
+
+
+def test_deleting_a_sample_removes_its_readings(web_app, client, upload, sample_ids):
+    upload({'delete.csv': curves_csv({'DEL-1': PASSING})})
+    sample_id, = sample_ids('DEL-1')
+    conn = web_app.get_db_connection()
+    conn.execute("INSERT OR REPLACE INTO sample_curves (sample_id, curve) VALUES (?, x'00')", (sample_id,))
+    conn.commit()
+    conn.close()
+
+    client.post(f'/delete/{sample_id}')
+    conn = web_app.get_db_connection()
+    for table in ('samples', 'sieve_data', 'sample_curves', 'analysis_results'):
+        column = 'id' if table == 'samples' else 'sample_id'
+        assert conn.execute(f'SELECT COUNT(*) FROM main.{table} WHERE {column} = ?', (sample_id,)).fetchone()[0] == 0
+    conn.close()
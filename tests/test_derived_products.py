@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import PASSING, SIZES, curves_csv
+from derived_products import DerivedCache, parse_operations
+from sieve_analysis import analyze_sample, apply_screen_operations
+
+CHAIN = [('underflow', 1.0), ('overflow', 0.125)]
+
+
+def test_cached_curves_match_the_splits():
+    cache = DerivedCache()
+    entry = cache.curve(1, SIZES, PASSING, CHAIN)
+    sizes, passing = apply_screen_operations(SIZES, PASSING, CHAIN)
+    assert entry['sieve_sizes'] == pytest.approx(sizes)
+    assert entry['percent_passing'] == pytest.approx(passing)
+    # Both steps are memoized; the underflow alone is then a hit
+    assert len(cache) == 2
+    assert cache.curve(1, SIZES, PASSING, CHAIN[:1]) is not None and len(cache) == 2
+
+    analysis = cache.analysis(1, SIZES, PASSING, CHAIN, 'product')
+    assert cache.analysis(1, SIZES, PASSING, CHAIN, 'product') is analysis
+    assert analysis['d50'] == analyze_sample(sizes, passing)['d50']
+
+
+def test_changed_readings_drop_stale_products():
+    cache = DerivedCache()
+    cache.curve(1, SIZES, PASSING, CHAIN)
+    cache.curve(2, SIZES, PASSING[::-1], CHAIN[:1])
+    changed = [min(100, p + 5) for p in PASSING]
+    entry = cache.curve(1, SIZES, changed, CHAIN[:1])
+    assert entry['percent_passing'] == pytest.approx(apply_screen_operations(SIZES, changed, CHAIN[:1])[1])
+    assert len(cache) == 2   # the new underflow of sample 1 and sample 2's entry
+    cache.invalidate(2)
+    assert len(cache) == 1
+
+
+def test_operations_are_validated():
+    assert parse_operations([{'op': 'underflow', 'cutoff': '1'}, ['overflow', 0.075]]) == \
+        [('underflow', 1.0), ('overflow', 0.075)]
+    for operations in ([], [{'op': 'sieve', 'cutoff': 1}], [{'op': 'underflow', 'cutoff': -1}],
+                       [{'op': 'underflow', 'cutoff': 'nan'}], 'underflow'):
+        with pytest.raises(ValueError):
+            parse_operations(operations)
+    with pytest.raises(ValueError, match='no material'):
+        DerivedCache().curve(1, SIZES, PASSING, [('underflow', 0.01)])
+
+
+def test_products_are_computed_on_request(client, upload, sample_ids):
+    upload({'derived.csv': curves_csv({'DER-1': PASSING})})
+    parent, = sample_ids('DER-1')
+    response = client.post(f'/api/samples/{parent}/derived',
+                           json={'operations': [{'op': kind, 'cutoff': cutoff} for kind, cutoff in CHAIN]})
+    assert response.status_code == 201
+    product = client.get(f"/api/derived/{response.get_json()['id']}").get_json()
+    expected = analyze_sample(*apply_screen_operations(SIZES, PASSING, CHAIN))
+    assert product['d50'] == pytest.approx(expected['d50'], abs=1e-6)
+    assert product['parent_id'] == parent
+
+    assert client.delete(f"/api/derived/{response.get_json()['id']}").status_code == 200
+    assert client.get(f"/api/derived/{response.get_json()['id']}").status_code == 404
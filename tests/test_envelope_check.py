@@ -0,0 +1,56 @@
+import math
+
+import numpy as np
+import pytest
+
+from conftest import PASSING, curves_csv
+from curve_matrix import STANDARD_SIEVES
+from envelope_check import check_membership, envelope_on_grid
+
+
+def test_membership_of_each_row():
+    grid = [0.1, 1.0, 10.0]
+    low = np.array([0, 40, 90], dtype=np.float32)
+    high = np.array([10, 60, 100], dtype=np.float32)
+    matrix = np.array([
+        [5, 50, 95],    # inside
+        [5, 70, 95],    # 10 above at 1 mm
+        [5, 50, 80],    # 10 below at 10 mm
+        [12, 50, 95],   # 2 above at 0.1 mm
+    ], dtype=np.float32)
+    inside, excursion, sieve, above = check_membership(matrix, low, high, grid)
+    assert inside.tolist() == [True, False, False, False]
+    assert excursion.tolist() == pytest.approx([0, 10, 10, 2])
+    assert math.isnan(sieve[0]) and sieve[1:].tolist() == [1.0, 10.0, 0.1]
+    assert above[1:].tolist() == [True, False, True]
+
+    inside, *_ = check_membership(matrix, low, high, grid, tolerance=2.0)
+    assert inside.tolist() == [True, False, False, True]
+
+
+def test_envelope_band_is_ordered_and_monotone():
+    low, high = envelope_on_grid('beach_sand', STANDARD_SIEVES)
+    assert np.all(low <= high)
+    assert np.all(np.diff(low) >= 0) and np.all(np.diff(high) >= 0)
+    with pytest.raises(ValueError):
+        envelope_on_grid('gravel', STANDARD_SIEVES)
+
+
+def test_tolerance_checks_are_not_stored(web_app, client, upload):
+    upload({'envelope.csv': curves_csv({'ENV-1': PASSING, 'ENV-2': [100, 100, 100, 90, 60, 30, 10]})})
+    stored = client.post('/api/envelope/check', json={}).get_json()['checked']
+    assert stored == len(web_app.curve_matrix)
+    before = client.get('/api/envelope/membership').get_json()
+    assert before['counts']['outside'] >= 1
+
+    response = client.post('/api/envelope/check', json={'tolerance': 50})
+    assert response.status_code == 200
+    result = response.get_json()['envelopes']['beach_sand']
+    assert result['inside'] + result['outside'] == len(web_app.curve_matrix)
+    assert client.get('/api/envelope/membership').get_json() == before
+
+
+@pytest.mark.parametrize('body', [{'tolerance': -1}, {'tolerance': 'nan'}, {'tolerance': 'wide'},
+                                  {'limit': 'all'}, {'envelopes': 'beach_sand'}, {'envelopes': ['gravel']}])
+def test_bad_checks_are_rejected(client, body):
+    assert client.post('/api/envelope/check', json=body).status_code == 400
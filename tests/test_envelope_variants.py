@@ -0,0 +1,31 @@
+import numpy as np
+from PIL import Image
+
+from conftest import PASSING, SIZES
+from sieve_analysis import analyze_sample, evaluate_criteria, generate_envelope_curves, plot_envelope_variants
+
+
+def pixels(path):
+    return np.asarray(Image.open(path).convert('RGBA'))
+
+
+def test_variants_match_separate_renders(tmp_path):
+    results = [analyze_sample(SIZES, PASSING, 'Feed')]
+    criteria = [evaluate_criteria(results[0])]
+    sizes, lower, upper = generate_envelope_curves()
+    wider = (sizes, np.clip(lower - 10, 0, 100), np.clip(upper + 10, 0, 100))
+    paths = {name: str(tmp_path / f'{name}.png') for name in ('a', 'b', 'c', 'alone', 'wide', 'wide_alone')}
+
+    plot_envelope_variants(results, criteria, [(paths['a'], 350), (paths['b'], 350), (paths['c'], 250)], dpi=40)
+    plot_envelope_variants(results, criteria, [(paths['alone'], 250)], dpi=40)
+    plot_envelope_variants(results, criteria, [(paths['wide'], 350, wider)], dpi=40)
+    plot_envelope_variants(results, criteria, [(paths['wide_alone'], 350, wider), (str(tmp_path / 'x.png'), 350)],
+                           dpi=40)
+
+    # Only the title changes between the variants of one drawing...
+    assert np.array_equal(pixels(paths['a']), pixels(paths['b']))
+    assert not np.array_equal(pixels(paths['a']), pixels(paths['c']))
+    # ...and each variant is what drawing it on its own gives
+    assert np.array_equal(pixels(paths['c']), pixels(paths['alone']))
+    assert not np.array_equal(pixels(paths['a']), pixels(paths['wide']))
+    assert np.array_equal(pixels(paths['wide']), pixels(paths['wide_alone']))
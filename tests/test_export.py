@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import SIZES, PASSING
+from export_from_sqlite import stream_export
+from import_excel_to_sqlite import create_database, import_files
+
+
+@pytest.fixture
+def database(tmp_path):
+    db_path = str(tmp_path / 'export.db')
+    create_database(db_path)
+    csv_path = tmp_path / 'curves.csv'
+    pd.DataFrame({'sieve_size': SIZES, 'EXP-1': PASSING, 'EXP-2': PASSING}).to_csv(csv_path, index=False)
+    import_files([str(csv_path)], db_path=db_path)
+    return db_path
+
+
+def test_csv_export_in_chunks(database):
+    chunks = list(stream_export(database, 'csv', ['sieve_data'], chunk_size=3))
+    assert len(chunks) > 2
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+    assert len(rows) == 2 * len(SIZES)
+    assert {float(row['sieve_size']) for row in rows} == set(SIZES)
+
+
+def test_filtered_jsonl_and_parquet(database):
+    lines = [json.loads(line) for line in b''.join(
+        stream_export(database, 'jsonl', ['samples', 'sieve_data'], {'name': 'EXP-2'})).splitlines()]
+    samples = [line for line in lines if line['table'] == 'samples']
+    assert [sample['name'] for sample in samples] == ['EXP-2']
+    assert all(line['sample_id'] == samples[0]['id'] for line in lines if line['table'] == 'sieve_data')
+
+    table = pd.read_parquet(io.BytesIO(b''.join(stream_export(database, 'parquet', ['samples']))))
+    assert sorted(table['name']) == ['EXP-1', 'EXP-2']
+
+
+def test_invalid_exports_fail_before_streaming(database):
+    with pytest.raises(ValueError):
+        stream_export(database, 'pdf')
+    with pytest.raises(ValueError):
+        stream_export(database, 'csv', ['samples', 'sieve_data'])
+    # The importer's samples table has no location column
+    with pytest.raises(ValueError, match='location'):
+        stream_export(database, 'csv', ['samples'], {'location': 'North Beach'})
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pandas as pd
+
+from conftest import SIZES, PASSING
+from import_excel_to_sqlite import create_database, import_files
+
+CHANGED = [100, 98, 80, 52, 20, 6, 1]
+
+
+def write_csv(path, curves):
+    pd.DataFrame({'sieve_size': SIZES, **curves}).to_csv(path, index=False)
+    return str(path)
+
+
+def passing_of(db_path, name):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("""
+            SELECT percent_passing FROM sieve_data JOIN samples ON samples.id = sieve_data.sample_id
+            WHERE samples.name = ? ORDER BY sieve_size DESC
+        """, (name,))]
+    finally:
+        conn.close()
+
+
+def test_reimports_only_write_what_changed(tmp_path):
+    db_path = str(tmp_path / 'import.db')
+    create_database(db_path)
+    first = write_csv(tmp_path / 'first.csv', {'A': PASSING, 'B': PASSING})
+    copy = write_csv(tmp_path / 'copy.csv', {'A': PASSING, 'B': PASSING})
+    second = write_csv(tmp_path / 'second.csv', {'A': PASSING, 'B': CHANGED})
+
+    summary, repeated = import_files([first, copy], db_path=db_path, max_workers=1)
+    assert (summary['imported'], summary['duplicate']) == (2, False)
+    assert (repeated['imported'], repeated['duplicate'], repeated['sample_ids']) == (0, True, [])
+    assert import_files([first], db_path=db_path, max_workers=1)[0]['duplicate']
+
+    # Only the changed sample is rewritten
+    summary, = import_files([second], db_path=db_path, max_workers=1)
+    assert (summary['imported'], summary['unchanged'], summary['duplicate']) == (1, 1, False)
+    assert passing_of(db_path, 'B') == CHANGED
+    assert passing_of(db_path, 'A') == PASSING
+
+    # The first file no longer matches what is stored, so importing it again restores B
+    summary, = import_files([first], db_path=db_path, max_workers=1)
+    assert (summary['imported'], summary['unchanged'], summary['duplicate']) == (1, 1, False)
+    assert passing_of(db_path, 'B') == PASSING
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from conftest import SIZES, PASSING
+from import_excel_to_sqlite import create_database, import_files, parse_csv, readings_from_table
+
+
+def test_long_and_wide_layouts_agree():
+    wide = pd.DataFrame({'Sieve size (mm)': SIZES, 'A': PASSING, 'B': [p / 100 for p in PASSING]})
+    long = pd.DataFrame({'sample_name': ['A'] * len(SIZES), 'sieve_size': SIZES, 'percent_passing': PASSING})
+    from_wide, empty = readings_from_table(wide)
+    from_long, _ = readings_from_table(long)
+    assert empty == []
+    assert sorted(from_wide['sample_name'].unique()) == ['A', 'B']
+    a = from_wide[from_wide['sample_name'] == 'A'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(a[['sample_name', 'sieve_size', 'percent_passing']],
+                                  from_long.reset_index(drop=True), check_dtype=False)
+
+
+def test_passing_headers_are_wide_sample_columns():
+    # Two "% passing" sample columns: the wide layout, not one long passing column
+    table = pd.DataFrame({'Sieve size': SIZES, 'Sample 1 % passing': PASSING, 'Sample 2 % passing': PASSING})
+    readings, _ = readings_from_table(table)
+    assert sorted(readings['sample_name'].unique()) == ['Sample 1 % passing', 'Sample 2 % passing']
+    assert len(readings) == 2 * len(SIZES)
+
+
+def test_csv_and_parquet_import(tmp_path):
+    db_path = str(tmp_path / 'import.db')
+    create_database(db_path)
+    csv_path = tmp_path / 'wide.csv'
+    pd.DataFrame({'sieve_size': SIZES, 'CSV-1': PASSING}).to_csv(csv_path, index=False)
+    parquet_path = tmp_path / 'long.parquet'
+    pd.DataFrame({'sample_name': ['PQ-1'] * len(SIZES), 'sieve_size': SIZES,
+                  'percent_passing': PASSING}).to_parquet(parquet_path)
+
+    assert len(parse_csv(str(csv_path))[0]) == len(SIZES)
+    summaries = import_files([str(csv_path), str(parquet_path)], db_path=db_path, max_workers=1)
+    assert [summary['imported'] for summary in summaries] == [1, 1]
+    assert all(summary['error'] is None for summary in summaries)
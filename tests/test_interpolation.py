@@ -0,0 +1,54 @@
+import math
+
+import numpy as np
+import pytest
+from scipy.interpolate import PchipInterpolator
+
+from conftest import PASSING, SIZES
+from sieve_analysis import (D_PERCENTS, analyze_sample, check_interpolation, evaluate_diameters,
+                            find_diameter_at_percent, fit_curves, pad_curves)
+
+
+def test_log_linear_is_a_straight_line_in_log_size():
+    # D50 lies between the 0.5 mm (52 %) and 0.25 mm (20 %) sieves
+    expected = 10 ** (math.log10(0.5) + (math.log10(0.25) - math.log10(0.5)) * (50 - 52) / (20 - 52))
+    assert find_diameter_at_percent(SIZES, PASSING, 50, 'log-linear') == pytest.approx(expected)
+    linear = 0.5 + (0.25 - 0.5) * (50 - 52) / (20 - 52)
+    assert find_diameter_at_percent(SIZES, PASSING, 50) == pytest.approx(linear)
+    assert expected < linear
+
+
+def test_pchip_matches_scipy_and_is_monotone():
+    order = np.argsort(SIZES)
+    reference = PchipInterpolator(np.array(PASSING, dtype=float)[order], np.log10(np.array(SIZES)[order]))
+    result = analyze_sample(SIZES, PASSING, interpolation='pchip')
+    assert result['interpolation'] == 'pchip'
+    assert [result[f'd{percent}'] for percent in D_PERCENTS] == \
+        pytest.approx([10 ** reference(percent) for percent in D_PERCENTS])
+
+    fit = fit_curves(*pad_curves([(SIZES, PASSING)]), 'pchip')
+    diameters = evaluate_diameters(fit, np.linspace(1, 100, 199))[0]
+    assert np.all(np.diff(diameters) >= 0)
+    # Readings are passed through exactly
+    assert evaluate_diameters(fit, PASSING)[0] == pytest.approx(SIZES)
+
+
+def test_pchip_ignores_the_pan_and_non_monotone_readings():
+    sizes, passing = SIZES + [0], PASSING + [0]
+    bumpy = list(PASSING)
+    bumpy[3] = 90   # above the reading of the coarser 1 mm sieve
+    for curve in ((sizes, passing), (SIZES, bumpy)):
+        diameters = evaluate_diameters(fit_curves(*pad_curves([curve]), 'pchip'), D_PERCENTS)[0]
+        assert np.all(np.isfinite(diameters)) and np.all(np.diff(diameters) >= 0)
+
+
+def test_unknown_models_are_rejected(client):
+    assert check_interpolation('log-linear') == 'log-linear'
+    with pytest.raises(ValueError, match='Unknown interpolation'):
+        analyze_sample(SIZES, PASSING, interpolation='spline')
+    curve = {'sieve_sizes': SIZES, 'percent_passing': PASSING}
+    assert client.post('/api/analyze?interpolation=spline', json=curve).status_code == 400
+    result = client.post('/api/analyze', json=dict(curve, interpolation='log-linear')).get_json()
+    assert result['interpolation'] == 'log-linear'
+    assert result['d50'] == pytest.approx(
+        find_diameter_at_percent(SIZES, PASSING, 50, 'log-linear'), abs=1e-6)
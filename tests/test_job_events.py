@@ -0,0 +1,80 @@
+import json
+import threading
+
+import jobs
+from conftest import PASSING, curves_csv
+from jobs import Job
+
+
+def parse_events(text):
+    """(id, event type, data) of each event of a Server-Sent Events stream."""
+    events = []
+    for block in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if 'id' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_event_log_resumes_after_a_cursor():
+    job = Job('test')
+    job.set_status('running')
+    job.update(done=0, total=3, message='Starting')
+    job.partial([1])
+    events, complete = job.events_since(0, timeout=0)
+    assert [event_type for _, event_type, _ in events] == ['status', 'progress', 'partial']
+    assert not complete
+
+    job.result = 'ok'
+    job.set_status('finished')
+    later, complete = job.events_since(events[-1][0], timeout=0)
+    assert complete
+    assert [(event_type, data['result']) for _, event_type, data in later] == [('finished', 'ok')]
+    # The finished job keeps only its final event, partial results included
+    assert job.events_since(0, timeout=0) == (later, True)
+
+
+def test_event_log_is_capped(monkeypatch):
+    monkeypatch.setattr(jobs, 'MAX_EVENTS', 3)
+    job = Job('test')
+    for i in range(5):
+        job.partial([i])
+    events, _ = job.events_since(0, timeout=0)
+    assert [(number, data['results']) for number, _, data in events] == [(3, [2]), (4, [3]), (5, [4])]
+
+
+def test_reanalysis_stream(client, upload, web_app, monkeypatch):
+    upload({'events.csv': curves_csv({f'SSE-{i}': [min(100, p + i) for p in PASSING] for i in range(5)})})
+    # Hold the job open until the stream has read its partial results
+    release = threading.Event()
+    reanalyze_all = web_app.reanalyze_all
+
+    def held(job, *args):
+        result = reanalyze_all(job, *args)
+        release.wait(5)
+        return result
+
+    monkeypatch.setattr(web_app, 'reanalyze_all', held)
+    job_id = client.post('/api/reanalyze', json={'batch_size': 2}).get_json()['job_id']
+    response = client.get(f'/jobs/{job_id}/events')
+    assert response.mimetype == 'text/event-stream'
+    text = ''
+    for chunk in response.response:
+        text += chunk.decode() if isinstance(chunk, bytes) else chunk
+        if '"message": "Done"' in text:
+            release.set()
+    events = parse_events(text)
+
+    numbers = [number for number, _, _ in events]
+    assert numbers == sorted(set(numbers))
+    assert events[-1][1] == 'finished'
+    partial_ids = [result['sample_id'] for _, event_type, data in events if event_type == 'partial'
+                   for result in data['results']]
+    assert len(partial_ids) == len(set(partial_ids)) == events[-1][2]['progress']['total']
+    assert events[-1][2]['result']['analyzed'] == len(partial_ids)
+
+    resumed = parse_events(client.get(f'/jobs/{job_id}/events',
+                                      headers={'Last-Event-ID': str(numbers[-2])}).get_data(as_text=True))
+    assert resumed == events[-1:]
+    assert parse_events(client.get(f'/jobs/{job_id}/events').get_data(as_text=True)) == events[-1:]
+    assert client.get('/jobs/unknown/events').status_code == 404
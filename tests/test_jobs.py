@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from conftest import PASSING, curves_csv
+from jobs import JobQueue, JobQueueFull
+
+
+def test_job_result_and_failure():
+    queue = JobQueue(max_workers=1, max_pending=2)
+    finished = queue.submit('add', lambda job, a, b: a + b, 2, 3)
+    failed = queue.submit('fail', lambda job: 1 / 0)
+    for job in (finished, failed):
+        events, complete = job.events_since(0, timeout=5)
+        while not complete:
+            events, complete = job.events_since(events[-1][0], timeout=5)
+
+    assert queue.get(finished.id).to_dict()['status'] == 'finished'
+    assert finished.result == 5
+    assert failed.status == 'failed'
+    assert 'division by zero' in failed.error
+    assert queue.get('unknown') is None
+
+
+def test_queue_is_bounded():
+    queue = JobQueue(max_workers=1, max_pending=1)
+    release = threading.Event()
+    running = queue.submit('wait', lambda job: release.wait(5))
+    queue.submit('pending', lambda job: None)
+    with pytest.raises(JobQueueFull):
+        queue.submit('one too many', lambda job: None)
+    release.set()
+    running.events_since(0, timeout=5)
+
+
+def test_upload_runs_as_a_job(upload, sample_ids):
+    job = upload({'jobs.csv': curves_csv({'JOB-1': PASSING, 'JOB-2': PASSING})})
+    assert job['status'] == 'finished'
+    assert job['total'] and job['done'] == job['total']
+    assert len(sample_ids('JOB-1', 'JOB-2')) == 2
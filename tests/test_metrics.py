@@ -0,0 +1,55 @@
+import re
+import sqlite3
+import threading
+
+import metrics
+
+
+def sample_value(text, line_start):
+    match = re.search(rf'^{re.escape(line_start)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_stages_and_queries_fill_the_breakdown():
+    conn = metrics.trace_queries(sqlite3.connect(':memory:'))
+    with metrics.breakdown() as current:
+        with metrics.stage('test_outer'):
+            conn.execute('SELECT 1')
+            conn.execute('SELECT 2')
+        metrics.timed('test_function')(lambda: None)()
+    assert set(current['stages']) == {'test_outer', 'test_function'}
+    assert current['queries'] == 2
+    conn.close()
+
+
+def test_breakdowns_do_not_mix_across_threads():
+    seen = {}
+
+    def work(name):
+        with metrics.breakdown() as current:
+            with metrics.stage(name):
+                pass
+            seen[name] = set(current['stages'])
+
+    threads = [threading.Thread(target=work, args=(f'test_thread_{i}',)) for i in range(4)]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert seen == {f'test_thread_{i}': {f'test_thread_{i}'} for i in range(4)}
+
+
+def test_exposition_format():
+    before = sample_value(metrics.render_metrics(), 'sieve_plot_renders_total{kind="test"}')
+    metrics.inc('sieve_plot_renders_total', 2, kind='test')
+    metrics.observe('sieve_stage_seconds', 0.003, stage='test_render')
+    text = metrics.render_metrics()
+    assert sample_value(text, 'sieve_plot_renders_total{kind="test"}') == before + 2
+    assert sample_value(text, 'sieve_stage_seconds_bucket{stage="test_render",le="0.0025"}') == 0
+    assert sample_value(text, 'sieve_stage_seconds_bucket{stage="test_render",le="0.005"}') >= 1
+    assert '# TYPE sieve_stage_seconds histogram' in text
+
+
+def test_metrics_endpoint_counts_requests(client):
+    client.get('/api/stats')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert re.search(r'^sieve_requests_total\{.*\} [1-9]', text, re.MULTILINE)
+    assert 'sieve_request_seconds_count' in text
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+
+import pytest
+
+from partitions import ID_SHIFT, PartitionRouter, partition_slug
+
+
+@pytest.fixture
+def router(web_app, tmp_path):
+    main_path = str(tmp_path / 'beach_sand.db')
+    conn = sqlite3.connect(main_path)
+    web_app.create_sample_tables(conn)
+    router = PartitionRouter(main_path, 'project')
+    router.load(conn, web_app.create_sample_tables)
+    conn.close()
+    return router
+
+
+def insert_sample(path, name):
+    conn = sqlite3.connect(path)
+    sample_id = conn.execute('INSERT INTO samples (name) VALUES (?)', (name,)).lastrowid
+    conn.execute('INSERT INTO sieve_data (sample_id, sieve_size, percent_passing) VALUES (?, 1.0, 50)', (sample_id,))
+    conn.commit()
+    conn.close()
+    return sample_id
+
+
+def read(router, sql, sample_ids=None):
+    conn = router.attach(sqlite3.connect(router.main_path), sample_ids)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_ids_route_back_to_their_partition(router, web_app):
+    north = router.path_for_key('North Beach')
+    assert os.path.basename(north) == 'beach_sand.north-beach.db'
+    assert router.path_for_key(router.partition_key(project='north beach')) == north
+
+    main_id = insert_sample(router.main_path, 'main')
+    north_id = insert_sample(north, 'north')
+    assert north_id == (1 << ID_SHIFT) + 1
+    assert router.path_for_sample(main_id) == router.main_path
+    assert router.path_for_sample(north_id) == north
+
+    # A router loaded from the catalog finds the same files
+    reloaded = PartitionRouter(router.main_path, 'project')
+    conn = sqlite3.connect(router.main_path)
+    reloaded.load(conn, web_app.create_sample_tables)
+    conn.close()
+    assert reloaded.paths() == router.paths()
+    assert reloaded.path_for_sample(north_id) == north
+
+
+def test_reads_across_partitions(router):
+    ids = [insert_sample(router.path_for_key(project), project) for project in ('', 'north', 'south', 'north')]
+    assert sorted(row[0] for row in read(router, 'SELECT id FROM samples')) == sorted(ids)
+    assert read(router, 'SELECT COUNT(*) FROM sieve_data')[0][0] == 4
+    # Only the main database and the partitions of the given samples are read
+    assert sorted(row[0] for row in read(router, 'SELECT name FROM samples', [ids[1]])) == ['', 'north', 'north']
+    assert read(router, 'SELECT COUNT(*) FROM samples', [ids[0]])[0][0] == 1
+    assert router.fan_out(lambda conn: conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0]) == [1, 2, 1]
+
+    conn = router.attach(sqlite3.connect(router.main_path))
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("INSERT INTO samples (name) VALUES ('through a view')")
+    conn.close()
+
+
+def test_attach_limit(router, monkeypatch):
+    ids = [insert_sample(router.path_for_key(f'project {i}'), f'S{i}') for i in range(5)]
+    main_id = insert_sample(router.main_path, 'main')
+    monkeypatch.setattr(router, 'attach_limit', 2)
+
+    assert not router.fits()
+    assert router.fits(ids[:2] + [main_id])
+    with pytest.raises(ValueError, match='fan_out'):
+        router.attach(sqlite3.connect(router.main_path))
+
+    groups = router.id_groups([main_id] + ids)
+    assert [sample_id for group in groups for sample_id in group] == [main_id] + ids
+    assert all(router.fits(group) for group in groups)
+    assert len(groups) == 3
+    for group in groups:
+        assert sorted(row[0] for row in read(router, 'SELECT id FROM samples WHERE id IN (%s)'
+                                            % ','.join(map(str, group)), group)) == sorted(group)
+
+
+def test_keys_and_schemes():
+    assert partition_slug('  North Beach / 2024 ') == 'north-beach-2024'
+    assert partition_slug(None) == 'default'
+    assert PartitionRouter('x.db', 'year').partition_key(date='2023-05-01') == '2023'
+    unpartitioned = PartitionRouter('x.db')
+    assert unpartitioned.path_for_key('north') == 'x.db'
+    with pytest.raises(ValueError):
+        PartitionRouter('x.db', 'month')
@@ -0,0 +1,47 @@
+import json
+import time
+
+import pytest
+
+import profiling
+from profiling import Profiler, run_profiled
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+def test_profile_files(tmp_path):
+    prefix = str(tmp_path / 'run')
+    with Profiler(prefix, sample_interval=0.001):
+        with profiling.stage('outer'):
+            with profiling.stage('inner'):
+                busy(0.05)
+            data = [0] * 100000
+    del data
+
+    summary = json.loads((tmp_path / 'run.json').read_text())
+    assert [(stage['stage'], stage['depth']) for stage in summary['stages']] == [('inner', 1), ('outer', 0)]
+    assert summary['stages'][0]['seconds'] >= 0.05
+    assert summary['peak_memory_bytes'] >= 8 * 100000
+    assert summary['stack_samples'] > 0
+    assert any(entry['function'].startswith('busy ') for entry in summary['top_functions'])
+
+    folded = (tmp_path / 'run.folded').read_text().splitlines()
+    assert folded and all(line.rsplit(' ', 1)[1].isdigit() for line in folded)
+    assert any('busy (test_profiling.py' in line for line in folded)
+    assert (tmp_path / 'run.prof').stat().st_size > 0
+
+
+def test_hooks_are_inert_without_a_profiler(tmp_path):
+    assert profiling.stage('anything') is profiling.stage('else')
+    assert run_profiled(lambda a, b: a * b, None, 6, 7) == 42
+    assert not list(tmp_path.iterdir())
+
+
+def test_one_profiler_at_a_time(tmp_path):
+    with Profiler(str(tmp_path / 'first')):
+        with pytest.raises(RuntimeError):
+            Profiler(str(tmp_path / 'second')).start()
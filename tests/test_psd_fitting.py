@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES
+from psd_fitting import MODELS, create_fit_tables, fit_distributions, percent_passing, save_fits
+
+SIEVES = [8, 4, 2, 1, 0.5, 0.25, 0.125, 0.063]
+TRUE = {'lognormal': (0.4, 0.7), 'rosin_rammler': (0.6, 1.8), 'ggs': (3.0, 0.9)}
+
+
+def test_fits_recover_the_parameters_of_model_curves():
+    for model, (scale, shape) in TRUE.items():
+        passing = percent_passing(model, scale, shape, SIEVES)
+        curves = [(SIEVES, passing.tolist()), (SIEVES, (passing * 0.5 + 50).tolist())]
+        fit = fit_distributions(curves, [model])[model]
+        assert fit['converged'][0]
+        assert (fit['scale'][0], fit['shape'][0]) == pytest.approx((scale, shape), rel=1e-4)
+        assert fit['rmse'][0] < 1e-3 and fit['r2'][0] == pytest.approx(1)
+        # The second, distorted curve is fitted independently
+        assert fit['rmse'][1] > 0.1
+
+
+def test_model_shapes():
+    assert percent_passing('lognormal', 0.4, 0.7, 0.4) == pytest.approx(50)
+    assert percent_passing('rosin_rammler', 0.6, 1.8, 0.6) == pytest.approx(100 * (1 - np.exp(-1)))
+    assert percent_passing('ggs', 3.0, 0.9, [6.0, 3.0])[0] == 100
+    with pytest.raises(ValueError):
+        percent_passing('gaudin', 1, 1, 1)
+
+
+def test_too_few_readings_and_storage(connection):
+    fits = fit_distributions([(SIZES, PASSING), ([1, 0], [50, 0])])
+    assert all(np.isnan(fit['scale'][1]) for fit in fits.values())
+    # Every model fits a real curve reasonably
+    assert all(fits[model]['rmse'][0] < 10 for model in MODELS)
+
+    connection.execute('CREATE TABLE samples (id INTEGER PRIMARY KEY)')
+    connection.executemany('INSERT INTO samples VALUES (?)', [(1,), (2,)])
+    create_fit_tables(connection)
+    save_fits(connection, [1, 2], fits)
+    assert connection.execute('SELECT COUNT(*) FROM psd_fits').fetchone()[0] == len(MODELS)
+    # A refit that no longer gives a usable fit drops the old one
+    save_fits(connection, [2, 1], fits)
+    assert [row[0] for row in connection.execute('SELECT DISTINCT sample_id FROM psd_fits')] == [2]
+    save_fits(connection, [1, 2], fits)
+    connection.execute('DELETE FROM samples WHERE id = 1')
+    assert connection.execute('SELECT COUNT(*) FROM psd_fits').fetchone()[0] == 0
+
+
+def test_fit_endpoint(client):
+    scale, shape = TRUE['lognormal']
+    response = client.post('/api/fit', json={'sieve_sizes': SIEVES, 'models': ['lognormal'],
+                                             'percent_passing': percent_passing('lognormal', scale, shape,
+                                                                                SIEVES).tolist()})
+    fit, = response.get_json()['fits']
+    assert (fit['scale'], fit['shape']) == pytest.approx((scale, shape), rel=1e-4)
+    assert client.post('/api/fit', json={'sieve_sizes': SIZES, 'percent_passing': PASSING,
+                                         'models': ['weibull']}).status_code == 400
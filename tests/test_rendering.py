@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib.pyplot as plt
+
+from conftest import PASSING, SIZES
+from rendering import render_comparison
+from sieve_analysis import analyze_sample, plot_distribution
+
+
+def render(tmp_path, i):
+    passing = [min(100, p + i) for p in PASSING]
+    plot_distribution(analyze_sample(SIZES, passing, f'Sample {i}'), str(tmp_path / f'distribution_{i}.png'))
+    render_comparison([('a', SIZES, PASSING), (f'b{i}', SIZES, passing)], str(tmp_path / f'comparison_{i}.png'))
+    return i
+
+
+def test_threads_render_the_same_charts(tmp_path):
+    serial = tmp_path / 'serial'
+    threaded = tmp_path / 'threaded'
+    serial.mkdir()
+    threaded.mkdir()
+    for i in range(6):
+        render(serial, i)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        assert sorted(pool.map(lambda i: render(threaded, i), range(6))) == list(range(6))
+
+    for path in serial.iterdir():
+        assert path.read_bytes()[:8] == b'\x89PNG\r\n\x1a\n'
+        assert (threaded / path.name).read_bytes() == path.read_bytes()
+    # Nothing goes through pyplot's global figures
+    assert plt.get_fignums() == []
@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import PASSING, curves_csv
+from sample_search import create_search_tables, search_samples
+
+SAMPLES = [
+    (1, 'Sample-BS 001', 'North Beach', 'original'),
+    (2, 'Sample-BS 001234', 'South Beach', 'original'),
+    (3, 'Dredge 7', 'Harbour Mouth', 'underflow'),
+]
+
+
+@pytest.fixture
+def conn(connection):
+    connection.execute('CREATE TABLE samples (id INTEGER PRIMARY KEY, name TEXT, location TEXT, type TEXT)')
+    connection.executemany('INSERT INTO samples VALUES (?, ?, ?, ?)', SAMPLES[:2])
+    create_search_tables(connection)   # builds the index from the existing rows
+    connection.execute('INSERT INTO samples VALUES (?, ?, ?, ?)', SAMPLES[2])
+    return connection
+
+
+def found(conn, text, **kwargs):
+    return [(row['sample_id'], row['match']) for row in search_samples(conn, text, **kwargs)]
+
+
+def test_prefix_substring_and_fuzzy_matches(conn):
+    assert found(conn, 'bs 00') == [(1, 'prefix'), (2, 'prefix')]
+    assert found(conn, 'harb') == [(3, 'prefix')]
+    assert found(conn, '1234') == [(2, 'substring')]
+    assert found(conn, 'Nroth Baech') == [(1, 'fuzzy')]
+    assert found(conn, 'Nroth Baech', fuzzy=False) == []
+    assert found(conn, 'bs', limit=1) == [(1, 'prefix')]
+
+
+def test_index_follows_updates_and_deletes(conn):
+    conn.execute("UPDATE samples SET location = 'West Spit' WHERE id = 1")
+    conn.execute('DELETE FROM samples WHERE id = 2')
+    assert found(conn, 'north') == []
+    assert found(conn, 'west spit') == [(1, 'prefix')]
+    assert found(conn, '1234') == []
+
+
+def test_search_endpoint(client, upload):
+    upload({'search.csv': curves_csv({'Searchable Sample QX7': PASSING})})
+    results = client.get('/api/search?q=qx7').get_json()['results']
+    assert [result['name'] for result in results] == ['Searchable Sample QX7']
+    assert client.get('/api/search?q=').status_code == 400
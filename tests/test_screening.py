@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES
+from screening import partition_coefficients, screen_settings, simulate_curves
+from sieve_analysis import generate_underflow_data
+
+FEEDS = [(SIZES, PASSING), (SIZES[1:], [95, 70, 40, 15, 5, 2])]
+
+
+def test_products_add_up_to_the_feed():
+    for model in ('whiten', 'logistic', 'ideal'):
+        simulation = simulate_curves(FEEDS, cut=[0.3, 1.0], sharpness=[3, 8], bypass=[0, 0.1], model=model)
+        assert simulation['overflow_yield'] + simulation['underflow_yield'] == pytest.approx(np.full((2, 2), 100))
+        # Recombining the products in their yields gives the feed curve back
+        recombined = (simulation['overflow_passing'] * simulation['overflow_yield'][:, :, None]
+                      + simulation['underflow_passing'] * simulation['underflow_yield'][:, :, None]) / 100
+        for feed, (sizes, passing) in enumerate(FEEDS):
+            for setting in range(2):
+                assert recombined[feed, setting, :len(sizes)] == pytest.approx(passing)
+
+
+def test_an_ideal_screen_matches_the_perfect_split():
+    simulation = simulate_curves([(SIZES, PASSING)], cut=1.0, model='ideal')
+    assert simulation['underflow_yield'][0, 0] == pytest.approx(85)
+    assert (simulation['coarse_recovery'][0, 0], simulation['fines_recovery'][0, 0]) == pytest.approx((100, 100))
+
+    sizes, passing = generate_underflow_data(SIZES, PASSING, 1.0)
+    underflow = dict(zip(SIZES, simulation['underflow_passing'][0, 0]))
+    assert [underflow[size] for size in sizes] == pytest.approx(passing)
+    # The overflow is the 15 % retained on the 1 mm sieve and above
+    overflow = simulation['overflow_passing'][0, 0]
+    assert overflow[:3] == pytest.approx([100, (98 - 85) / 15 * 100, 0])
+
+
+def test_sharper_screens_misplace_less():
+    simulation = simulate_curves(FEEDS, cut=0.5, sharpness=[1, 2, 4, 16, 500])
+    assert np.all(np.diff(simulation['fines_recovery'], axis=1) > 0)
+    # Bypassed material goes to the overflow whatever its size
+    bypassed = simulate_curves(FEEDS, cut=0.5, bypass=0.2)
+    plain = simulate_curves(FEEDS, cut=0.5)
+    assert bypassed['underflow_yield'] == pytest.approx(plain['underflow_yield'] * 0.8)
+
+    assert partition_coefficients('whiten', [0, 1.0], 1.0) == pytest.approx([0, 0.5])
+    assert partition_coefficients('logistic', 1.0, 1.0) == pytest.approx(0.5)
+    for cut, sharpness, bypass in ((0, 4, 0), (1, -1, 0), (1, 4, 1), ([1, 2], [3, 4, 5], 0)):
+        with pytest.raises(ValueError):
+            screen_settings(cut, sharpness, bypass)
+
+
+def test_simulate_endpoint(client):
+    response = client.post('/api/screen/simulate', json={
+        'curves': [{'sieve_sizes': SIZES, 'percent_passing': PASSING}], 'cut': [0.5, 1.0], 'model': 'ideal'})
+    splits = response.get_json()['results'][0]['splits']
+    assert [split['underflow_yield'] for split in splits] == pytest.approx([52, 85])
+    assert splits[1]['underflow']['percent_passing'][-1] == pytest.approx(100 / 85, abs=1e-4)
+    for body in ({'curves': [{'sieve_sizes': SIZES, 'percent_passing': PASSING}]},
+                 {'curves': [{'sieve_sizes': SIZES, 'percent_passing': PASSING}], 'cut': 1, 'bypass': 1.5},
+                 {'curves': [{'sieve_sizes': SIZES, 'percent_passing': PASSING}], 'cut': 1, 'model': 'trommel'}):
+        assert client.post('/api/screen/simulate', json=body).status_code == 400
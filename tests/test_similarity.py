@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES, curves_csv
+from curve_index import CurveIndex
+from curve_matrix import CurveMatrix, create_curve_tables, resample_curve
+
+
+def test_query_matches_brute_force(connection):
+    connection.execute('CREATE TABLE samples (id INTEGER PRIMARY KEY)')
+    create_curve_tables(connection)
+    rng = np.random.default_rng(31)
+    curves = {sample_id: (SIZES, np.sort(rng.uniform(0, 100, len(SIZES)))[::-1]) for sample_id in range(1, 201)}
+    matrix = CurveMatrix()
+    matrix.update(connection, curves, curves)
+    index = CurveIndex(matrix)
+
+    query = resample_curve(SIZES, PASSING)
+    ids, vectors = matrix.select()
+    rms = np.sqrt(((vectors - query) ** 2).mean(axis=1))
+    expected = ids[np.argsort(rms)[:5]].tolist()
+    matches = index.query(query, k=5)
+    assert [sample_id for sample_id, _ in matches] == expected
+    assert [distance for _, distance in matches] == pytest.approx(np.sort(rms)[:5], abs=1e-3)
+    assert 7 not in [sample_id for sample_id, _ in index.query(matrix.row(7), k=3, exclude=7)]
+
+
+def test_similar_endpoints(client, upload, sample_ids):
+    shifted = [min(100, p + 2) for p in PASSING]
+    upload({'similar.csv': curves_csv({'SIM-A': PASSING, 'SIM-B': shifted})})
+    a, b = sample_ids('SIM-A', 'SIM-B')
+
+    matches = client.get(f'/api/samples/{a}/similar?k=50').get_json()['matches']
+    assert b in [match['sample_id'] for match in matches]
+    assert a not in [match['sample_id'] for match in matches]
+
+    response = client.post('/api/similar', json={'sieve_sizes': SIZES, 'percent_passing': PASSING, 'k': 1})
+    assert response.status_code == 200
+    assert response.get_json()['matches'][0]['distance'] == pytest.approx(0, abs=1e-3)
+
+
+@pytest.mark.parametrize('body', [
+    {'sieve_sizes': SIZES, 'percent_passing': PASSING, 'k': 'ten'},
+    {'sieve_sizes': SIZES, 'percent_passing': PASSING, 'k': None},
+    {'sieve_sizes': 4, 'percent_passing': 100},
+    {'sieve_sizes': [1], 'percent_passing': [50]},
+    [SIZES, PASSING],
+])
+def test_similar_rejects_bad_requests(client, body):
+    assert client.post('/api/similar', json=body).status_code == 400
@@ -0,0 +1,93 @@
+import math
+
+import pytest
+
+import spc
+from conftest import PASSING, curves_csv
+
+BASELINE = [1.0 + (0.01 if i % 2 else -0.01) for i in range(spc.BASELINE_SAMPLES)]
+
+
+@pytest.fixture
+def conn(connection):
+    spc.create_spc_tables(connection)
+    return connection
+
+
+def feed(conn, values, first_id=1, location='Line 1'):
+    raised = []
+    for offset, value in enumerate(values):
+        raised += spc.observe(conn, location, first_id + offset, {'d50': value})
+    return raised
+
+
+def test_baseline_then_alarms_on_a_shift(conn):
+    assert feed(conn, BASELINE) == []
+    chart = spc.chart_data(conn, 'Line 1', 'd50')
+    assert chart['baseline']['complete']
+    assert chart['baseline']['center'] == pytest.approx(1.0)
+    sigma = chart['baseline']['sigma']
+    assert sigma == pytest.approx(0.01 * math.sqrt(20 / 19))
+    assert chart['limits']['shewhart']['ucl'] == pytest.approx(1.0 + 3 * sigma)
+
+    # In control: no alarms, and charting the same sample twice changes nothing
+    assert feed(conn, [1.0], first_id=100) == []
+    assert feed(conn, [5.0], first_id=100) == []
+    raised = feed(conn, [1.1], first_id=101)
+    assert {alarm['rule'] for alarm in raised} >= {'shewhart', 'ewma', 'cusum_high'}
+    assert {alarm['rule'] for alarm in spc.list_alarms(conn, 'Line 1')} == {alarm['rule'] for alarm in raised}
+
+    # Back in line: the Shewhart alarm clears while the CUSUM still remembers the shift
+    feed(conn, [1.0], first_id=102)
+    open_rules = {alarm['rule'] for alarm in spc.list_alarms(conn, 'Line 1')}
+    assert 'shewhart' not in open_rules and 'cusum_high' in open_rules
+    assert [point['sample_id'] for point in spc.chart_data(conn, 'Line 1', 'd50')['points'][-3:]] == [100, 101, 102]
+
+    spc.reset_stream(conn, 'Line 1')
+    assert spc.list_alarms(conn, 'Line 1') == []
+    chart = spc.chart_data(conn, 'Line 1', 'd50')
+    assert (chart['samples'], chart['points'], chart['baseline']['complete']) == (0, [], False)
+
+    # Samples from before the reset stay out of the new baseline when analyzed again
+    assert feed(conn, [1.1, 1.0]) == [] and feed(conn, [1.0], first_id=200) == []
+    assert [point['sample_id'] for point in spc.chart_data(conn, 'Line 1', 'd50')['points']] == [200]
+
+
+def test_chart_statistics_and_limits():
+    state = {'n': 0, 'mean': 0, 'm2': 0, 'center': None, 'sigma': None, 'ewma': None,
+             'cusum_high': 0, 'cusum_low': 0}
+    for value in BASELINE:
+        state, violations = spc.chart_statistics(state, value)
+        assert violations == {}
+    state, violations = spc.chart_statistics(state, state['center'] - 4 * state['sigma'])
+    assert set(violations) == {'shewhart', 'ewma'}
+    assert state['cusum_low'] == pytest.approx(3.5 * state['sigma'])
+
+    assert spc.ewma_limit(1.0, 1) == pytest.approx(spc.EWMA_L * spc.EWMA_LAMBDA)
+    assert spc.ewma_limit(1.0, math.inf) == pytest.approx(
+        spc.EWMA_L * math.sqrt(spc.EWMA_LAMBDA / (2 - spc.EWMA_LAMBDA)))
+    assert spc.stream_name('  ') == spc.DEFAULT_STREAM
+
+
+def test_streams_are_separate(conn):
+    feed(conn, BASELINE, location='Line 1')
+    feed(conn, BASELINE[:5], first_id=50, location=None)
+    streams = {stream['stream']: stream['metrics']['d50'] for stream in spc.list_streams(conn)}
+    assert streams['Line 1']['baseline_complete']
+    assert streams[spc.DEFAULT_STREAM]['samples'] == 5
+    assert spc.chart_data(conn, 'Line 2', 'd50') is None
+
+
+def test_chart_endpoint(client):
+    assert client.get('/api/spc/chart?stream=Line 1&metric=sorting').status_code == 400
+
+
+def test_reanalysis_after_a_reset(client, upload, sample_ids):
+    upload({'spc.csv': curves_csv({'SPC-1': PASSING})}, sample_location='Reset Line')
+    sample_id, = sample_ids('SPC-1')
+    url = '/api/spc/chart?stream=Reset Line&metric=d50'
+    assert [point['sample_id'] for point in client.get(url).get_json()['points']] == [sample_id]
+
+    client.post('/api/spc/reset', json={'stream': 'Reset Line'})
+    client.get(f'/sample/{sample_id}/analyze')
+    assert client.get(url).get_json()['samples'] == 0
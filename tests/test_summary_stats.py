@@ -0,0 +1,95 @@
+import sqlite3
+
+import pytest
+
+import summary_stats
+from summary_stats import create_summary_tables, get_summary, list_groups, merge_summaries, rebuild_summary
+
+ANALYSES = [
+    # location, date, d50, cu, so, fines
+    ('North', '2024-01-10', 0.30, 2.0, 1.4, 1.0),   # meets every criterion
+    ('North', '2024-02-03', 0.45, 3.1, 1.9, 2.0),
+    ('South', '2024-01-22', 0.28, 2.2, 1.5, 7.5),   # too many fines
+]
+
+
+def tables(conn):
+    """The summary rows that count anything, sums rounded (removals leave zero rows and rounding behind)."""
+    return {
+        'groups': sorted(tuple(row) for row in conn.execute('SELECT * FROM summary_groups WHERE analyses != 0')),
+        'metrics': sorted((row['location'], row['month'], row['metric'], row['n'],
+                           round(row['total'], 9), round(row['total_sq'], 9))
+                          for row in conn.execute('SELECT * FROM summary_metrics WHERE n != 0')),
+        'histograms': sorted(tuple(row) for row in conn.execute('SELECT * FROM summary_histograms WHERE count != 0')),
+    }
+
+
+@pytest.fixture
+def conn(web_app, connection):
+    web_app.create_sample_tables(connection)
+    for i, (location, date, d50, cu, so, fines) in enumerate(ANALYSES, 1):
+        connection.execute('INSERT INTO samples (id, name, location, date) VALUES (?, ?, ?, ?)',
+                           (i, f'S{i}', location, date))
+        connection.execute('INSERT INTO analysis_results (sample_id, d50, cu, so, fines) VALUES (?, ?, ?, ?, ?)',
+                           (i, d50, cu, so, fines))
+    return connection
+
+
+def test_totals_follow_inserts(conn):
+    total = get_summary(conn)
+    assert total['analyses'] == 3
+    assert total['compliance']['fines_compliant']['count'] == 2
+    assert total['compliance']['all_compliant']['count'] == 1
+    assert total['metrics']['d50']['mean'] == pytest.approx((0.30 + 0.45 + 0.28) / 3)
+    assert get_summary(conn, 'North')['analyses'] == 2
+    assert get_summary(conn, month='2024-01')['analyses'] == 2
+    assert {(group['location'], group['month']) for group in list_groups(conn)} == {
+        ('North', '2024-01'), ('North', '2024-02'), ('South', '2024-01')}
+
+
+def test_updates_and_deletes_match_a_rebuild(conn):
+    conn.execute('UPDATE analysis_results SET d50 = 0.32, fines = 3.0 WHERE sample_id = 3')
+    conn.execute("UPDATE samples SET location = 'South' WHERE id = 2")
+    conn.execute('DELETE FROM samples WHERE id = 1')
+
+    assert get_summary(conn)['analyses'] == 2
+    assert get_summary(conn, 'North')['analyses'] == 0
+    assert get_summary(conn, 'South')['compliance']['all_compliant']['count'] == 1
+    incremental = tables(conn)
+    rebuild_summary(conn)
+    assert tables(conn) == incremental
+
+
+def test_changed_thresholds_rebuild_the_triggers(conn, monkeypatch):
+    create_summary_tables(conn)   # unchanged criteria keep the counts as they are
+    assert get_summary(conn)['compliance']['fines_compliant']['count'] == 2
+
+    monkeypatch.setitem(summary_stats.COMPLIANCE, 'fines_compliant', 'a.fines < 10.0')
+    create_summary_tables(conn)
+    assert get_summary(conn)['compliance']['fines_compliant']['count'] == 3
+    conn.execute("INSERT INTO samples (id, name, location, date) VALUES (4, 'S4', 'South', '2024-03-01')")
+    conn.execute('INSERT INTO analysis_results (sample_id, d50, cu, so, fines) VALUES (4, 0.3, 2.0, 1.4, 9.0)')
+    assert get_summary(conn)['compliance']['fines_compliant']['count'] == 4
+    incremental = tables(conn)
+    rebuild_summary(conn)
+    assert tables(conn) == incremental
+
+
+def test_merged_partitions_match_one_database(conn, tmp_path, web_app):
+    other = sqlite3.connect(tmp_path / 'other.db')
+    other.row_factory = sqlite3.Row
+    web_app.create_sample_tables(other)
+    other.execute("INSERT INTO samples (id, name, location, date) VALUES (4, 'S4', 'North', '2024-03-01')")
+    other.execute('INSERT INTO analysis_results (sample_id, d50, cu, so, fines) VALUES (4, 0.5, 2.4, 1.2, 0.5)')
+    merged = merge_summaries([get_summary(conn), get_summary(other)])
+
+    conn.execute("INSERT INTO samples (id, name, location, date) VALUES (4, 'S4', 'North', '2024-03-01')")
+    conn.execute('INSERT INTO analysis_results (sample_id, d50, cu, so, fines) VALUES (4, 0.5, 2.4, 1.2, 0.5)')
+    single = get_summary(conn)
+    assert merged['analyses'] == single['analyses'] == 4
+    assert merged['compliance'] == single['compliance']
+    for metric in ('d50', 'cu', 'so'):
+        assert merged['metrics'][metric]['mean'] == pytest.approx(single['metrics'][metric]['mean'])
+        assert merged['metrics'][metric]['std'] == pytest.approx(single['metrics'][metric]['std'])
+        assert merged['metrics'][metric]['histogram'] == single['metrics'][metric]['histogram']
+    other.close()
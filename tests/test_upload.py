@@ -0,0 +1,45 @@
+import io
+import zipfile
+
+from conftest import PASSING, curves_csv
+
+
+def zip_bytes(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def post(client, files):
+    data = {'file': [(io.BytesIO(content), name) for name, content in files.items()]}
+    return client.post('/upload', data=data, headers={'Accept': 'application/json'},
+                       content_type='multipart/form-data')
+
+
+def test_several_files_and_an_archive(upload, sample_ids):
+    archive = zip_bytes({'a/one.csv': curves_csv({'ZIP-1': PASSING}), 'b/two.csv': curves_csv({'ZIP-2': PASSING}),
+                         'notes.txt': 'not a workbook'})
+    job = upload({'batch.zip': archive, 'three.csv': curves_csv({'ZIP-3': PASSING})})
+    assert job['status'] == 'finished'
+    assert len(sample_ids('ZIP-1', 'ZIP-2', 'ZIP-3')) == 3
+
+
+def test_archive_checked_before_unpacking(web_app, client, monkeypatch):
+    monkeypatch.setitem(web_app.app.config, 'MAX_UPLOAD_BYTES', 64 * 1024)
+    bomb = zip_bytes({'big.csv': 'sieve_size,A\n' + '1,50\n' * 100000})
+    assert len(bomb) < 64 * 1024
+    response = post(client, {'bomb.zip': bomb})
+    assert response.status_code == 413
+
+    monkeypatch.setitem(web_app.app.config, 'MAX_FILES_PER_UPLOAD', 2)
+    response = post(client, {'many.zip': zip_bytes({f'{i}.csv': 'sieve_size,A\n1,50\n' for i in range(3)})})
+    assert response.status_code == 413
+    assert 'Too many files' in response.get_json()['error']
+
+
+def test_plain_file_over_the_limit(web_app, client, monkeypatch):
+    monkeypatch.setitem(web_app.app.config, 'MAX_UPLOAD_BYTES', 1024)
+    response = post(client, {'big.csv': b'sieve_size,A\n' + b'1,50\n' * 1000})
+    assert response.status_code == 413
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from conftest import PASSING, SIZES, curves_csv
+from sieve_analysis import analyze_sample, generate_underflow_data
+from what_if import LIMITS, CurveState, WhatIfCache, check_limits
+
+KEYS = ('d10', 'd25', 'd30', 'd50', 'd60', 'd75', 'cu', 'so')
+
+
+@pytest.mark.parametrize('model', ['linear', 'log-linear'])
+def test_splits_match_the_analysis_of_the_product(web_app, model):
+    state = CurveState(SIZES, PASSING, model)
+    whole = state.split()
+    expected = analyze_sample(SIZES, PASSING, interpolation=model)
+    assert whole['yield'] == 100
+    assert [whole[key] for key in KEYS] == pytest.approx([expected[key] for key in KEYS])
+
+    product = state.split(underflow=[1.0, 2.0])
+    expected = analyze_sample(*generate_underflow_data(SIZES, PASSING, 1.0), interpolation=model)
+    assert product['yield'] == pytest.approx(85)
+    assert [product[key] for key in KEYS] == pytest.approx([expected[key] for key in KEYS])
+    assert product['fines'] == pytest.approx(expected['percent_063'])
+    # The default limits are the compliance criteria the rest of the web app checks
+    criteria = check_limits(product, LIMITS)
+    compliance = web_app.check_compliance_batch(expected['d50'], expected['cu'], expected['so'],
+                                                expected['percent_063'])
+    assert [criteria[f'{key}_in_range'] for key in ('d50', 'cu', 'so', 'percent_063')] == \
+        [bool(compliance[f'{key}_compliant']) for key in ('d50', 'cu', 'so', 'fines')]
+
+
+@pytest.mark.parametrize('model', ['linear', 'log-linear', 'pchip'])
+def test_sizes_and_percent_passing_invert_each_other(model):
+    state = CurveState(SIZES, PASSING, model)
+    percents = np.linspace(2, 99, 25)
+    assert [state.passing_at(size) for size in state.diameters(percents)] == pytest.approx(percents)
+    assert state.passing_at(0.03) == pytest.approx(1 * 0.03 / 0.063)
+    assert state.passing_at(10) == 100
+
+
+def test_limits_and_empty_bands():
+    state = CurveState(SIZES, PASSING)
+    product = state.split(underflow=[1.0], overflow=[0.125])
+    assert product['yield'] == pytest.approx(79)
+    assert product['fines'] == 0
+    assert check_limits(product, dict(LIMITS, d50_min=0, d50_max=10))['d50_in_range']
+    assert not check_limits(product, dict(LIMITS, d50_min=10, d50_max=20))['d50_in_range']
+    empty = state.split(underflow=[0.25], overflow=[0.5])
+    assert empty['yield'] == 0 and 'd50' not in empty
+    assert check_limits(empty, LIMITS)['total_in_range'] == 0
+    with pytest.raises(ValueError):
+        CurveState([1], [50])
+
+
+def test_cache_reloads_after_invalidation():
+    loads = []
+    cache = WhatIfCache(max_entries=1)
+    load = lambda sample_id: loads.append(sample_id) or (SIZES, PASSING)
+    first = cache.state(1, 'linear', load)
+    assert cache.state(1, 'linear', load) is first and loads == [1]
+    cache.state(2, 'linear', load)
+    assert len(cache) == 1
+    cache.invalidate(2)
+    assert len(cache) == 0
+    assert cache.state(3, 'linear', lambda sample_id: None) is None
+
+
+def test_what_if_endpoint(client, upload, sample_ids):
+    upload({'what_if.csv': curves_csv({'WHATIF-1': PASSING})})
+    sample_id, = sample_ids('WHATIF-1')
+    url = f'/api/samples/{sample_id}/what-if'
+    result = client.get(f'{url}?underflow=1.0&interpolation=log-linear&d50_min=0.1').get_json()
+    expected = analyze_sample(*generate_underflow_data(SIZES, PASSING, 1.0), interpolation='log-linear')
+    assert result['d50'] == pytest.approx(expected['d50'], abs=1e-6)
+    assert result['limits']['d50_min'] == 0.1
+
+    for query in ('underflow=0.25&overflow=0.5', 'd50_min=nan', 'cu_max=inf', 'underflow=-1',
+                  'interpolation=spline'):
+        assert client.get(f'{url}?{query}').status_code == 400
+    assert client.get('/api/samples/999999/what-if').status_code == 404
@@ -1,39 +1,122 @@
 #!/usr/bin/env python
+import atexit
+import functools
+import io
+import json
 import os
 import sys
+import shutil
 import sqlite3
 import tempfile
+import time
 import uuid
+import zipfile
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash,
+                   send_file, jsonify, stream_with_context, g)
 from werkzeug.utils import secure_filename
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
 # Add parent directory to path so we can import the existing modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from import_excel_to_sqlite import import_excel_to_sqlite
+from import_excel_to_sqlite import import_files
+from curve_storage import check_storage, create_curve_table, read_curves, read_curve, install_curve_views, ID_CHUNK
+from screening import (simulate_curves, screen_settings, product_curve, check_partition_model,
+                       DEFAULT_PARTITION_MODEL, DEFAULT_SHARPNESS)
+from export_from_sqlite import stream_export, MIMETYPES, SINGLE_TABLE_FORMATS
+from jobs import JobQueue, JobQueueFull
+from db_writer import DatabaseWriter, execute
+import metrics
+from rendering import render_comparison
+from summary_stats import create_summary_tables, get_summary, list_groups, merge_summaries, merge_groups
+from curve_matrix import CurveMatrix, create_curve_tables, resample_curve, curve_statistics
+from curve_index import CurveIndex
+from envelope_check import (create_envelope_tables, update_membership, sync_membership, check_envelopes,
+                            outside_envelope, membership_counts, ENVELOPES, DEFAULT_ENVELOPE)
+from derived_products import (DerivedCache, create_derived_tables, parse_operations, operations_json,
+                              describe_product)
+from partitions import PartitionRouter
+from what_if import WhatIfCache, check_limits, LIMITS as WHAT_IF_LIMITS
+from sample_search import create_search_tables, search_samples
+import spc
+from psd_fitting import create_fit_tables, fit_distributions, describe_fits, save_fits, CURVE_SIZES, MODELS as PSD_MODELS
 
 # Import functions from sieve_analysis.py
 from sieve_analysis import (
-    interpolate, find_diameter_at_percent, analyze_sample,
-    plot_distribution, generate_envelope_curves, plot_with_envelope
+    find_diameter_at_percent, analyze_sample,
+    plot_distribution, generate_envelope_curves, plot_with_envelope,
+    pad_curves, analyze_samples_batch, percent_passing_at_batch,
+    check_interpolation, INTERPOLATION_MODELS,
+    COMPLIANCE_D50_RANGE, COMPLIANCE_CU_MAX, COMPLIANCE_SO_RANGE, COMPLIANCE_FINES_MAX
 )
 
+# Time every call into the analysis module as its own stage
+analyze_sample = metrics.timed('analyze_sample')(analyze_sample)
+plot_distribution = metrics.timed('plot_distribution')(plot_distribution)
+plot_with_envelope = metrics.timed('plot_with_envelope')(plot_with_envelope)
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
-app.config['DATABASE'] = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'beach_sand.db')
+app.config['DATABASE'] = os.environ.get('DATABASE') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'beach_sand.db')
 app.config['STATIC_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls'}
+app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls', 'csv', 'parquet'}
+app.config['ARCHIVE_EXTENSIONS'] = {'zip'}
+app.config['MAX_FILES_PER_UPLOAD'] = 500
+# Bytes the files of one upload may take once saved, archives unpacked
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('MAX_UPLOAD_BYTES', 512 * 1024 * 1024))
+app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', os.cpu_count() or 1))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get('JOB_MAX_PENDING', 16))
+app.config['MAX_ANALYZE_CURVES'] = int(os.environ.get('MAX_ANALYZE_CURVES', 10000))
+# Feeds x screen settings simulated by one /api/screen/simulate request
+app.config['MAX_SCREEN_SIMULATIONS'] = int(os.environ.get('MAX_SCREEN_SIMULATIONS', 1000000))
+app.config['REANALYZE_BATCH_SIZE'] = int(os.environ.get('REANALYZE_BATCH_SIZE', 500))
+app.config['SSE_KEEPALIVE_SECONDS'] = 15
+# How D-values are interpolated between sieves: 'linear', 'log-linear' or 'pchip'
+app.config['INTERPOLATION'] = check_interpolation(os.environ.get('INTERPOLATION', 'linear'))
+# How imported readings are stored: 'rows' (sieve_data), 'blob' or 'blob-zlib' (one packed curve per sample)
+app.config['CURVE_STORAGE'] = check_storage(os.environ.get('CURVE_STORAGE', 'rows'))
+# Write samples to one database file per 'project' or per 'year' (unset: everything in DATABASE)
+app.config['PARTITION_BY'] = os.environ.get('PARTITION_BY') or None
+# Log requests slower than this many seconds with a per-stage breakdown (unset: off)
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get('SLOW_REQUEST_SECONDS') else None
+# Seconds the database writer waits for more writes to join a transaction
+app.config['WRITE_BATCH_SECONDS'] = float(os.environ.get('WRITE_BATCH_SECONDS', 0.002))
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(os.path.join(app.config['STATIC_FOLDER'], 'plots'), exist_ok=True)
 
+# Background workers for imports and analyses
+job_queue = JobQueue(max_workers=app.config['JOB_WORKERS'],
+                     max_pending=app.config['JOB_MAX_PENDING'])
+
+# Which database file each sample is written to; loaded by init_db()
+partitions = PartitionRouter(app.config['DATABASE'], app.config['PARTITION_BY'])
+
+def prepare_write_connection(conn, path):
+    """Set up a connection of the database writer: rows readable by column name, statements counted."""
+    conn.row_factory = sqlite3.Row
+    return metrics.trace_queries(conn)
+
+# Every write to any database file goes through this one thread, batched into transactions
+db_writer = DatabaseWriter(prepare_write_connection, max_delay=app.config['WRITE_BATCH_SECONDS'])
+# Finish queued writes and close the writer's connections when the process exits
+atexit.register(db_writer.close)
+
+# Every sample's curve on the standard sieve series, loaded by init_db(),
+# and the nearest-neighbour index that searches it
+curve_matrix = CurveMatrix()
+curve_index = CurveIndex(curve_matrix)
+
+# Memoized curves and analyses of derived (screened) products
+derived_cache = DerivedCache()
+
+# Curves prepared for the what-if sliders, per sample and interpolation model
+what_if_cache = WhatIfCache()
+
 # Add template filter for formatting dates
 @app.template_filter('formatdate')
 def formatdate_filter(date_str):
@@ -51,36 +134,136 @@ def formatdate_filter(date_str):
 def inject_now():
     return {'now': datetime.now}
 
-def get_db_connection():
-    """Create a connection to the SQLite database."""
+@app.before_request
+def start_request_timer():
+    """Start timing the request and collecting its stages."""
+    g.metrics_token = metrics.start_breakdown()
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request duration and log it with its stages if it was slow."""
+    if 'metrics_token' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    breakdown = metrics.finish_breakdown(g.pop('metrics_token'))
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('sieve_request_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('sieve_requests_total', endpoint=endpoint, status=response.status_code)
+    
+    threshold = app.config['SLOW_REQUEST_SECONDS']
+    if threshold is not None and elapsed >= threshold:
+        metrics.inc('sieve_slow_requests_total', endpoint=endpoint)
+        stages = ', '.join(f'{name}={seconds:.3f}s'
+                           for name, seconds in sorted(breakdown['stages'].items(), key=lambda item: -item[1]))
+        app.logger.warning('Slow request %s %s: %.3fs (%s; %d queries)', request.method,
+                           request.full_path.rstrip('?'), elapsed, stages or 'no stages', breakdown['queries'])
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, stage, query and render metrics in the Prometheus text format."""
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def get_db_connection(sample_ids=None):
+    """
+    Create a connection to the SQLite database. When samples are partitioned it
+    reads samples, sieve data and analyses from the partitions holding sample_ids,
+    from none but the main database for (), or from every partition for None
+    (read-only); write those through db_writer to the file
+    partitions.path_for_sample() gives. Reads of every partition go through
+    read_partitions(), and of many samples through read_sample_rows() and
+    read_sample_curves(), which work past the number of partitions one connection
+    can attach.
+    """
     conn = sqlite3.connect(app.config['DATABASE'])
     conn.row_factory = sqlite3.Row
-    return conn
+    return metrics.trace_queries(install_curve_views(partitions.attach(conn, sample_ids)))
+
+def read_partitions(sql, parameters=(), key=None, reverse=False, limit=None):
+    """
+    Rows of a read-only query over every partition. With more partitions than one
+    connection can attach, the query runs on each partition (fan_out()) and their
+    rows are merged in partition order, sorted by key(row) if given, and cut to limit.
+    """
+    if partitions.fits():
+        conn = get_db_connection()
+        rows = conn.execute(sql, parameters).fetchall()
+        conn.close()
+        return rows
+    
+    def query(conn):
+        return install_curve_views(conn).execute(sql, parameters).fetchall()
+    
+    rows = [row for part in partitions.fan_out(query) for row in part]
+    if key is not None:
+        rows.sort(key=key, reverse=reverse)
+    return rows if limit is None else rows[:limit]
+
+def read_sample_rows(table, sample_ids, column='sample_id'):
+    """Rows of a partitioned table for the given samples, by sample ID (column holds the ID)."""
+    rows = {}
+    for group in partitions.id_groups(sample_ids):
+        conn = get_db_connection(group)
+        for start in range(0, len(group), ID_CHUNK):
+            chunk = group[start:start + ID_CHUNK]
+            for row in conn.execute(f'SELECT * FROM {table} WHERE {column} IN ({", ".join("?" * len(chunk))})',
+                                    chunk):
+                rows[row[column]] = row
+        conn.close()
+    return rows
+
+def read_sample_curves(sample_ids):
+    """read_curves() for the given samples, read from their own partitions."""
+    curves = {}
+    for group in partitions.id_groups(sample_ids):
+        conn = get_db_connection(group)
+        curves.update(read_curves(conn, group))
+        conn.close()
+    return curves
+
+def read_summary(location=None, month=None, groups=False):
+    """Summary statistics across every partition, read in parallel and merged."""
+    summary = merge_summaries(partitions.fan_out(lambda conn: get_summary(conn, location, month)))
+    if groups:
+        summary['groups'] = merge_groups(partitions.fan_out(list_groups))
+    return summary
 
 def get_sample(sample_id):
     """Get a sample by ID from the database."""
-    conn = get_db_connection()
+    conn = get_db_connection([sample_id])
     sample = conn.execute('SELECT * FROM samples WHERE id = ?', (sample_id,)).fetchone()
     conn.close()
     return sample
 
 def get_sieve_data(sample_id):
-    """Get sieve data for a sample from the database."""
-    conn = get_db_connection()
+    """Get sieve data rows (with weights, where stored) for a sample from the database."""
+    conn = get_db_connection([sample_id])
     sieve_data = conn.execute('SELECT * FROM sieve_data WHERE sample_id = ? ORDER BY sieve_size DESC', (sample_id,)).fetchall()
     conn.close()
     return sieve_data
 
-def prepare_analysis_data(sieve_data):
-    """Convert sieve data to format required by analysis functions."""
-    sieve_sizes = []
-    percent_passing = []
-    
-    for row in sieve_data:
-        sieve_sizes.append(row['sieve_size'])
-        percent_passing.append(row['percent_passing'])
-    
-    return sieve_sizes, percent_passing
+def get_curve(sample_id):
+    """A sample's sieve sizes and percent passing as lists for the analysis functions, coarsest first."""
+    conn = get_db_connection([sample_id])
+    curve = read_curve(conn, sample_id)
+    conn.close()
+    return ([], []) if curve is None else (curve[0].tolist(), curve[1].tolist())
+
+def check_compliance_batch(d50, cu, so, fines):
+    """Compliance criteria checks over arrays of D50, Cu, So and fines content."""
+    d50, cu, so, fines = (np.asarray(values, dtype=float) for values in (d50, cu, so, fines))
+    return {
+        'd50_compliant': (COMPLIANCE_D50_RANGE[0] <= d50) & (d50 <= COMPLIANCE_D50_RANGE[1]),
+        'cu_compliant': cu < COMPLIANCE_CU_MAX,
+        'so_compliant': (COMPLIANCE_SO_RANGE[0] <= so) & (so <= COMPLIANCE_SO_RANGE[1]),
+        'fines_compliant': fines < COMPLIANCE_FINES_MAX,
+    }
+
+def fines_content(analysis_results):
+    """Percent passing the 0.063mm sieve of an analyzed curve."""
+    sizes, passing = pad_curves([(analysis_results['sieve_sizes'], analysis_results['percent_passing'])])
+    return float(percent_passing_at_batch(sizes, passing, 0.063)[0])
 
 def check_criteria_compliance(analysis_results):
     """Check if analysis results meet design criteria."""
@@ -89,18 +272,17 @@ def check_criteria_compliance(analysis_results):
     so = analysis_results['so']
     
     # Get percent passing at 0.063mm for fine content
-    sieve_sizes = analysis_results['sieve_sizes']
-    percent_passing = analysis_results['percent_passing']
-    fine_content = interpolate(0.063, sieve_sizes, percent_passing)
+    fine_content = fines_content(analysis_results)
     
+    compliance = check_compliance_batch(d50, cu, so, fine_content)
     criteria = {
-        'd50_compliant': 0.25 <= d50 <= 0.35,
+        'd50_compliant': bool(compliance['d50_compliant']),
         'd50_actual': round(d50, 4),
-        'cu_compliant': cu < 2.5,
+        'cu_compliant': bool(compliance['cu_compliant']),
         'cu_actual': round(cu, 2),
-        'so_compliant': 1.1 <= so <= 1.7,
+        'so_compliant': bool(compliance['so_compliant']),
         'so_actual': round(so, 2),
-        'fines_compliant': fine_content < 5.0,
+        'fines_compliant': bool(compliance['fines_compliant']),
         'fines_actual': round(fine_content, 2)
     }
     
@@ -116,60 +298,449 @@ def check_criteria_compliance(analysis_results):
 @app.route('/')
 def index():
     """Home page - show list of samples."""
-    conn = get_db_connection()
-    recent_samples = conn.execute('SELECT * FROM samples ORDER BY date_added DESC LIMIT 5').fetchall()
-    conn.close()
-    return render_template('index.html', recent_samples=recent_samples)
+    recent_samples = read_partitions('SELECT * FROM samples ORDER BY date_added DESC LIMIT 5',
+                                     key=lambda row: row['date_added'], reverse=True, limit=5)
+    return render_template('index.html', recent_samples=recent_samples, summary=read_summary())
+
+@app.route('/api/stats')
+def stats():
+    """Summary statistics for a location and month (YYYY-MM); either may be '*' or omitted for all."""
+    return jsonify(read_summary(request.args.get('location'), request.args.get('month'),
+                                groups=bool(request.args.get('groups'))))
 
 @app.route('/samples')
 def samples():
     """Show a list of all samples."""
-    conn = get_db_connection()
-    samples = conn.execute('SELECT * FROM samples ORDER BY date_added DESC').fetchall()
-    conn.close()
+    samples = read_partitions('SELECT * FROM samples ORDER BY date_added DESC',
+                              key=lambda row: row['date_added'], reverse=True)
     return render_template('samples.html', samples=samples)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def is_archive(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ARCHIVE_EXTENSIONS']
+
+def wants_json():
+    """True when the client asked for JSON rather than an HTML page."""
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json'
+
+class UploadTooLarge(Exception):
+    """An upload holding more files, or more bytes once unpacked, than allowed."""
+
+def upload_size_error():
+    """The UploadTooLarge error for an upload over MAX_UPLOAD_BYTES."""
+    return UploadTooLarge(f'Upload too large; at most {app.config["MAX_UPLOAD_BYTES"] // (1024 * 1024)} MB '
+                          'of files (unpacked) at a time')
+
+def copy_limited(src, dst, budget, block_size=1024 * 1024):
+    """Copy src to dst, raising UploadTooLarge once more than budget bytes have come through."""
+    copied = 0
+    while True:
+        block = src.read(min(block_size, budget - copied + 1))
+        if not block:
+            return copied
+        copied += len(block)
+        if copied > budget:
+            raise upload_size_error()
+        dst.write(block)
+
+def save_upload(file, upload_dir, saved, rejected):
+    """
+    Save one uploaded file into upload_dir. ZIP archives are unpacked and each
+    workbook inside is saved on its own. Saved paths and rejected names are appended.
+    Raises UploadTooLarge once the upload holds more than MAX_FILES_PER_UPLOAD files
+    or MAX_UPLOAD_BYTES bytes: archives are checked against both before anything is
+    unpacked, and copying stops as soon as a file runs past its share.
+    """
+    max_files = app.config['MAX_FILES_PER_UPLOAD']
+    too_many = f'Too many files; upload at most {max_files} at a time'
+    budget = app.config['MAX_UPLOAD_BYTES'] - sum(os.path.getsize(path) for path in saved)
+    if allowed_file(file.filename):
+        if len(saved) >= max_files:
+            raise UploadTooLarge(too_many)
+        path = os.path.join(upload_dir, f"{len(saved)}_{secure_filename(file.filename)}")
+        with open(path, 'wb') as dst:
+            saved.append(path)
+            copy_limited(file.stream, dst, budget)
+        return
+    
+    if not is_archive(file.filename):
+        rejected.append(file.filename)
+        return
+    
+    try:
+        with zipfile.ZipFile(file.stream) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            if len(saved) + len(members) > max_files:
+                raise UploadTooLarge(too_many)
+            workbooks = []
+            for member in members:
+                name = os.path.basename(member.filename)
+                if not name or name.startswith('.'):
+                    continue
+                if not allowed_file(name):
+                    rejected.append(f"{file.filename}/{member.filename}")
+                    continue
+                workbooks.append((member, name))
+            # Sizes as the archive declares them; the copy below holds each file to its own
+            if sum(member.file_size for member, _ in workbooks) > budget:
+                raise upload_size_error()
+            
+            for member, name in workbooks:
+                path = os.path.join(upload_dir, f"{len(saved)}_{secure_filename(name)}")
+                with archive.open(member) as src, open(path, 'wb') as dst:
+                    saved.append(path)
+                    budget -= copy_limited(src, dst, min(member.file_size, budget))
+    except zipfile.BadZipFile:
+        rejected.append(file.filename)
+
+def fill_sample_details(conn, sample_ids, location, date):
+    """Give samples without a location or date those of their upload (a database writer operation)."""
+    conn.executemany('''
+        UPDATE samples SET location = COALESCE(location, ?), date = COALESCE(date, ?) WHERE id = ?
+    ''', ((location, date, sample_id) for sample_id in sample_ids))
+
+def import_and_analyze(job, upload_dir, file_paths, partition_key=None, location=None, date=None):
+    """
+    Background job: import uploaded files into a partition, then analyze the new samples.
+    The location and date given with the upload fill in samples that have none, so each
+    sample is charted in its own stream's control charts.
+    """
+    with metrics.breakdown() as timings:
+        job.update(message=f'Importing {len(file_paths)} file(s)')
+        try:
+            path = partitions.path_for_key(partition_key)
+            with metrics.stage('import_files'):
+                summaries = import_files(file_paths, path,
+                                         max_workers=app.config['IMPORT_WORKERS'],
+                                         storage=app.config['CURVE_STORAGE'],
+                                         write=functools.partial(db_writer.run, path))
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+    
+        # Strip the upload prefix so the summary shows the names the user sent
+        for summary in summaries:
+            summary['file'] = summary['file'].split('_', 1)[-1]
+    
+        sample_ids = [sample_id for summary in summaries for sample_id in summary['sample_ids']]
+    
+        if sample_ids and (location or date):
+            db_writer.run(path, fill_sample_details, sample_ids, location or None, date or None)
+    
+        # Keep the curve matrix in step with the new readings
+        curves = read_sample_curves(sample_ids)
+        with metrics.stage('curve_matrix_update'):
+            # Only a committed write reaches the shared in-memory matrix
+            curve_matrix.apply(db_writer.run(app.config['DATABASE'], curve_matrix.store, sample_ids, curves))
+        with metrics.stage('envelope_update'):
+            db_writer.run(app.config['DATABASE'], update_membership, curve_matrix, sample_ids)
+        for sample_id in sample_ids:
+            what_if_cache.invalidate(sample_id)
+    
+        job.update(done=0, total=len(sample_ids), message='Analyzing samples')
+        analyzed = []
+        failed = []
+        finished = []   # Results not yet published to the job's event stream
+        for i, sample_id in enumerate(sample_ids):
+            try:
+                results = run_analysis(sample_id)
+                analyzed.append(sample_id)
+                finished.append(result_summary(sample_id, results))
+            except Exception as e:
+                failed.append({'sample_id': sample_id, 'error': str(e)})
+                finished.append({'sample_id': sample_id, 'error': str(e)})
+            job.update(done=i + 1)
+            if len(finished) >= 50 or i + 1 == len(sample_ids):
+                job.partial(finished)
+                finished = []
+    
+        job.update(message='Done')
+    return {'files': summaries, 'analyzed': analyzed, 'failed': failed,
+            'timings': {'stages': {name: round(seconds, 4) for name, seconds in timings['stages'].items()},
+                        'queries': timings['queries']}}
+
 @app.route('/upload', methods=['GET', 'POST'])
 def upload():
-    """Handle file upload and import to database."""
+    """Handle file upload and queue it for import and analysis."""
     if request.method == 'POST':
-        if 'file' not in request.files:
-            flash('No file part', 'danger')
+        files = [file for file in request.files.getlist('file') if file.filename]
+        if not files:
+            flash('No selected file', 'danger')
             return redirect(request.url)
         
-        file = request.files['file']
-        if file.filename == '':
-            flash('No selected file', 'danger')
+        # Save everything where the worker can pick it up; the job removes it when done
+        upload_dir = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
+        saved = []
+        rejected = []
+        message = None
+        status = 400
+        try:
+            for file in files:
+                save_upload(file, upload_dir, saved, rejected)
+        except UploadTooLarge as e:
+            message, status = str(e), 413
+        
+        if message or not saved:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            if not message:
+                allowed = app.config['ALLOWED_EXTENSIONS'] | app.config['ARCHIVE_EXTENSIONS']
+                message = f'File type not allowed. Please upload {", ".join(sorted(allowed))}'
+            if wants_json():
+                return jsonify({'error': message, 'rejected': rejected}), status
+            flash(message, 'danger')
             return redirect(request.url)
         
-        if not allowed_file(file.filename):
-            flash(f'File type not allowed. Please upload {", ".join(app.config["ALLOWED_EXTENSIONS"])}', 'danger')
+        try:
+            # Project (or, failing that, location) and sampling date pick the partition
+            partition_key = partitions.partition_key(
+                project=request.form.get('project') or request.form.get('sample_location'),
+                date=request.form.get('sample_date'))
+            job = job_queue.submit('import', import_and_analyze, upload_dir, saved, partition_key,
+                                   request.form.get('sample_location'), request.form.get('sample_date'))
+        except JobQueueFull as e:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            if wants_json():
+                return jsonify({'error': str(e)}), 503
+            flash(str(e), 'warning')
             return redirect(request.url)
         
-        if file and allowed_file(file.filename):
-            # Save the file temporarily
-            filename = secure_filename(file.filename)
-            temp_dir = tempfile.mkdtemp()
-            temp_path = os.path.join(temp_dir, filename)
-            file.save(temp_path)
-            
-            # Import the data
-            try:
-                sample_name = request.form.get('sample_name', 'Unnamed Sample')
-                import_excel_to_sqlite(temp_path, app.config['DATABASE'], sample_name)
-                flash('File successfully uploaded and data imported', 'success')
-                os.remove(temp_path)
-                os.rmdir(temp_dir)
-                return redirect(url_for('index'))
-            except Exception as e:
-                flash(f'Error importing data: {str(e)}', 'danger')
-                return redirect(request.url)
+        if wants_json():
+            return jsonify({'job_id': job.id,
+                            'status_url': url_for('job_status', job_id=job.id),
+                            'events_url': url_for('job_events', job_id=job.id),
+                            'files': len(saved),
+                            'rejected': rejected}), 202
+        
+        flash(f'{len(saved)} file(s) uploaded and queued for import (job {job.id})', 'success')
+        if rejected:
+            flash(f'Ignored unsupported files: {", ".join(rejected)}', 'warning')
+        return redirect(url_for('index'))
     
     return render_template('upload.html', today=datetime.now().strftime('%Y-%m-%d'))
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status and progress of a background job."""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Stream a job's progress, partial results and outcome as Server-Sent Events.
+    Reconnecting clients resume after the Last-Event-ID header (or ?cursor=N).
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    try:
+        cursor = int(request.headers.get('Last-Event-ID') or request.args.get('cursor') or 0)
+    except ValueError:
+        cursor = 0
+    keepalive = app.config['SSE_KEEPALIVE_SECONDS']
+    
+    def generate():
+        position = cursor
+        yield 'retry: 3000\n\n'
+        while True:
+            events, complete = job.events_since(position, timeout=keepalive)
+            if not events and not complete:
+                # Comment line so proxies keep the connection open
+                yield ': keepalive\n\n'
+                continue
+            for number, event_type, data in events:
+                yield f'id: {number}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n'
+                position = number
+            if complete:
+                break
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def result_summary(sample_id, results):
+    """The headline numbers of an analysis, for progress streams."""
+    summary = {'sample_id': sample_id}
+    for key in ('d10', 'd50', 'd60', 'cu', 'so'):
+        summary[key] = json_number(results[key], 4)
+    return summary
+
+def reanalyze_all(job, batch_size, render_plots):
+    """
+    Background job: re-run the analysis of every sample with sieve data, a batch at a
+    time, publishing each finished batch on the job's event stream.
+    """
+    sample_ids = [row['id'] for row in read_partitions(
+        'SELECT id FROM samples WHERE id IN (SELECT sample_id FROM curve_samples) ORDER BY id')]
+    job.update(done=0, total=len(sample_ids), message='Re-analyzing samples')
+    
+    analyzed = 0
+    failed = []
+    for start in range(0, len(sample_ids), batch_size):
+        batch = sample_ids[start:start + batch_size]
+        finished = []
+        if render_plots:
+            # One sample at a time through the same path as the analyze button
+            for sample_id in batch:
+                try:
+                    finished.append(result_summary(sample_id, run_analysis(sample_id)))
+                except Exception as e:
+                    finished.append({'sample_id': sample_id, 'error': str(e)})
+        else:
+            finished = reanalyze_batch(batch)
+        
+        for result in finished:
+            if 'error' in result:
+                failed.append(result)
+            else:
+                analyzed += 1
+        job.update(done=start + len(batch))
+        job.partial(finished)
+    
+    job.update(message='Done')
+    return {'analyzed': analyzed, 'failed': failed}
+
+def reanalyze_batch(sample_ids):
+    """Vectorized analysis of a batch of stored samples, saved in one transaction per partition (no plots)."""
+    stored = read_sample_curves(sample_ids)
+    curves = {sample_id: stored.get(sample_id, ([], [])) for sample_id in sample_ids}
+    
+    with metrics.stage('batch_analysis'):
+        analyses = analyze_samples_batch(list(curves.values()), [str(sample_id) for sample_id in curves],
+                                         app.config['INTERPOLATION'])
+    
+    # One writer operation per partition the batch touches
+    finished = []
+    by_partition = {}
+    for sample_id, results in zip(curves, analyses):
+        if 'error' in results:
+            finished.append({'sample_id': sample_id, 'error': results['error']})
+            continue
+        by_partition.setdefault(partitions.path_for_sample(sample_id), []).append((sample_id, results))
+    
+    pending = []
+    for path, batch in by_partition.items():
+        with metrics.stage('psd_fitting'):
+            fits = fit_analyzed_curves([results for _, results in batch])
+        sizes, passing = pad_curves([(results['sieve_sizes'], results['percent_passing']) for _, results in batch])
+        fines = percent_passing_at_batch(sizes, passing, 0.063).tolist()
+        pending.append(db_writer.submit(path, save_batch_results, batch, fits, fines))
+    with metrics.stage('db_write_wait'):
+        for future in pending:
+            finished.extend(future.result())
+    return finished
+
+def save_batch_results(conn, batch, fits, fines):
+    """
+    Store the analyses, fines contents and fits of (sample ID, results) pairs of one
+    partition (a database writer operation). Returns their result summaries.
+    """
+    save_fits(conn, [sample_id for sample_id, _ in batch], fits)
+    finished = []
+    for (sample_id, results), sample_fines in zip(batch, fines):
+        values = (results['d10'], results['d25'], results['d50'], results['d60'],
+                  results['d75'], results['cu'], results['so'], sample_fines, results['interpolation'])
+        updated = conn.execute('''
+            UPDATE analysis_results
+            SET d10 = ?, d25 = ?, d50 = ?, d60 = ?, d75 = ?, cu = ?, so = ?, fines = ?, interpolation = ?,
+                date_analyzed = CURRENT_TIMESTAMP
+            WHERE sample_id = ?
+        ''', values + (sample_id,)).rowcount
+        if not updated:
+            conn.execute('''
+                INSERT INTO analysis_results (sample_id, d10, d25, d50, d60, d75, cu, so, fines, interpolation)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (sample_id,) + values)
+        finished.append(result_summary(sample_id, results))
+    return finished
+
+@app.route('/api/reanalyze', methods=['POST'])
+def api_reanalyze():
+    """
+    Queue a re-analysis of the whole database. Follow it at events_url.
+    Body (optional): {"render_plots": false, "batch_size": 500}
+    """
+    data = request.get_json(silent=True) or {}
+    batch_size = max(1, min(int(data.get('batch_size', app.config['REANALYZE_BATCH_SIZE'])), 10000))
+    try:
+        job = job_queue.submit('reanalyze', reanalyze_all, batch_size, bool(data.get('render_plots', False)))
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'job_id': job.id,
+                    'status_url': url_for('job_status', job_id=job.id),
+                    'events_url': url_for('job_events', job_id=job.id)}), 202
+
+@app.route('/api/search')
+def api_search():
+    """
+    Find samples by name, location or type: ?q=bs 001&limit=20&fuzzy=1.
+    Word prefixes match first, then text inside words, then (unless fuzzy=0)
+    the closest spellings of misspelt words.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'Give a search text as q'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 500))
+    fuzzy = request.args.get('fuzzy', '1') != '0'
+    
+    with metrics.stage('search'):
+        found = [result for results in partitions.fan_out(lambda conn: search_samples(conn, text, limit, fuzzy))
+                 for result in results]
+    # Each partition ranks its own matches; merge by kind of match, then score
+    kinds = {'prefix': 0, 'substring': 1, 'fuzzy': 2}
+    found.sort(key=lambda result: (kinds[result['match']], result['score']))
+    return jsonify({'query': text, 'count': len(found[:limit]), 'results': found[:limit]})
+
+@app.route('/api/spc')
+def api_spc_streams():
+    """Every production stream under statistical process control, with its open alarms."""
+    conn = get_db_connection(())
+    streams = spc.list_streams(conn)
+    alarms = spc.list_alarms(conn, limit=500)
+    conn.close()
+    return jsonify({'streams': streams, 'open_alarms': alarms})
+
+@app.route('/api/spc/alarms')
+def api_spc_alarms():
+    """Alarms, newest first: ?stream=...&metric=d50&all=1 (all=1 includes cleared alarms)."""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    conn = get_db_connection(())
+    alarms = spc.list_alarms(conn, request.args.get('stream'), request.args.get('metric'),
+                             open_only=request.args.get('all', '0') == '0', limit=limit)
+    conn.close()
+    return jsonify({'count': len(alarms), 'alarms': alarms})
+
+@app.route('/api/spc/chart')
+def api_spc_chart():
+    """
+    Control chart data of one stream and metric: ?stream=North Beach&metric=d50&limit=200.
+    Points carry the value, EWMA with its limits and both CUSUMs; limits hold the
+    Shewhart, EWMA and CUSUM settings.
+    """
+    stream = spc.stream_name(request.args.get('stream'))
+    metric = request.args.get('metric', 'd50')
+    if metric not in spc.METRICS:
+        return jsonify({'error': f"Unknown metric '{metric}'; use one of {', '.join(spc.METRICS)}"}), 400
+    limit = max(1, min(request.args.get('limit', 200, type=int), 5000))
+    conn = get_db_connection(())
+    chart = spc.chart_data(conn, stream, metric, limit)
+    conn.close()
+    if chart is None:
+        return jsonify({'error': f"No {metric} values charted for stream '{stream}'"}), 404
+    return jsonify(chart)
+
+@app.route('/api/spc/reset', methods=['POST'])
+def api_spc_reset():
+    """Start a new baseline for a stream after its process was corrected. Body: {"stream": "..."}"""
+    data = request.get_json(silent=True) or {}
+    stream = spc.stream_name(data.get('stream'))
+    db_writer.run(app.config['DATABASE'], spc.reset_stream, stream)
+    return jsonify({'stream': stream, 'reset': True})
+
 @app.route('/sample/<int:sample_id>')
 def sample_detail(sample_id):
     """View details of a single sample."""
@@ -184,6 +755,90 @@ def sample_detail(sample_id):
                           sample=sample, 
                           sieve_data=sieve_data)
 
+def run_analysis(sample_id):
+    """Analyze a stored sample, render its plot and save the results. Returns the results."""
+    with metrics.stage('load_sample'):
+        sample = get_sample(sample_id)
+        if not sample:
+            raise ValueError(f'Sample {sample_id} not found')
+        sieve_sizes, percent_passing = get_curve(sample_id)
+    
+    analysis_results = analyze_sample(sieve_sizes, percent_passing, sample['name'], app.config['INTERPOLATION'])
+    
+    # Generate plot and save to static folder
+    plot_filename = f"sample_{sample_id}_distribution.png"
+    plot_path = os.path.join(app.config['STATIC_FOLDER'], 'plots', plot_filename)
+    plot_distribution(analysis_results, plot_path)
+    metrics.inc('sieve_plot_renders_total', kind='distribution')
+    
+    with metrics.stage('save_results'):
+        save_analysis_results(sample_id, analysis_results, plot_filename)
+    
+    with metrics.stage('psd_fitting'):
+        save_distribution_fits([sample_id], [analysis_results])
+    
+    with metrics.stage('spc_update'):
+        update_control_charts(sample, analysis_results)
+    
+    return analysis_results
+
+def fit_analyzed_curves(analyses):
+    """Fit the parametric size distributions to analyzed curves, warm-started from their D-values."""
+    d_values = {key: [analysis[key] for analysis in analyses] for key in ('d10', 'd25', 'd50', 'd60', 'd75')}
+    return fit_distributions([(analysis['sieve_sizes'], analysis['percent_passing']) for analysis in analyses],
+                             d_values=d_values)
+
+def save_distribution_fits(sample_ids, analyses):
+    """Fit and store the parametric size distributions of analyzed samples of one partition."""
+    fits = fit_analyzed_curves(analyses)
+    db_writer.run(partitions.path_for_sample(sample_ids[0]), save_fits, sample_ids, fits)
+
+def update_control_charts(sample, analysis_results):
+    """Chart a newly analyzed sample on its stream's control charts and log any alarm raised."""
+    values = {'d50': analysis_results['d50'], 'cu': analysis_results['cu'],
+              'fines': fines_content(analysis_results)}
+    raised = db_writer.run(app.config['DATABASE'], spc.observe, sample['location'], sample['id'], values)
+    for alarm in raised:
+        metrics.inc('sieve_spc_alarms_total', metric=alarm['metric'], rule=alarm['rule'])
+        app.logger.warning('SPC alarm on %s: %s %s at sample %s (%.4g beyond %.4g)', alarm['stream'],
+                           alarm['metric'], alarm['rule'], alarm['sample_id'], alarm['statistic'],
+                           alarm['control_limit'])
+
+def save_analysis_results(sample_id, analysis_results, plot_filename):
+    """Insert or update the stored analysis of a sample, with its fines content."""
+    db_writer.run(partitions.path_for_sample(sample_id), write_analysis_results,
+                  sample_id, analysis_results, plot_filename, fines_content(analysis_results))
+
+def write_analysis_results(conn, sample_id, analysis_results, plot_filename, fines):
+    """Database writer operation behind save_analysis_results()."""
+    # Check if analysis already exists
+    existing = conn.execute('SELECT id FROM analysis_results WHERE sample_id = ?', 
+                           (sample_id,)).fetchone()
+    
+    if existing:
+        # Update existing analysis
+        conn.execute('''
+            UPDATE analysis_results
+            SET d10 = ?, d25 = ?, d50 = ?, d60 = ?, d75 = ?, cu = ?, so = ?, fines = ?, interpolation = ?,
+                plot_filename = ?
+            WHERE sample_id = ?
+        ''', (
+            analysis_results['d10'], analysis_results['d25'], analysis_results['d50'],
+            analysis_results['d60'], analysis_results['d75'], analysis_results['cu'],
+            analysis_results['so'], fines, analysis_results['interpolation'], plot_filename, sample_id
+        ))
+    else:
+        # Insert new analysis
+        conn.execute('''
+            INSERT INTO analysis_results 
+            (sample_id, d10, d25, d50, d60, d75, cu, so, fines, interpolation, plot_filename)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            sample_id, analysis_results['d10'], analysis_results['d25'], analysis_results['d50'],
+            analysis_results['d60'], analysis_results['d75'], analysis_results['cu'],
+            analysis_results['so'], fines, analysis_results['interpolation'], plot_filename
+        ))
+
 @app.route('/sample/<int:sample_id>/analyze')
 def analyze(sample_id):
     """Run analysis on a sample and save results."""
@@ -192,63 +847,558 @@ def analyze(sample_id):
         flash('Sample not found', 'danger')
         return redirect(url_for('index'))
     
-    sieve_data = get_sieve_data(sample_id)
-    sieve_sizes, percent_passing = prepare_analysis_data(sieve_data)
-    
     # Run analysis
     try:
-        analysis_results = analyze_sample(sieve_sizes, percent_passing)
-        
-        # Generate plot and save to static folder
-        plot_filename = f"sample_{sample_id}_distribution.png"
-        plot_path = os.path.join(app.config['STATIC_FOLDER'], 'plots', plot_filename)
-        plot_distribution(sieve_sizes, percent_passing, analysis_results, 
-                          sample['name'], save_path=plot_path)
-        
-        # Save analysis results to database
-        conn = get_db_connection()
-        
-        # Check if analysis already exists
-        existing = conn.execute('SELECT id FROM analysis_results WHERE sample_id = ?', 
-                               (sample_id,)).fetchone()
-        
-        if existing:
-            # Update existing analysis
-            conn.execute('''
-                UPDATE analysis_results
-                SET d10 = ?, d25 = ?, d50 = ?, d60 = ?, d75 = ?, cu = ?, so = ?, plot_filename = ?
-                WHERE sample_id = ?
-            ''', (
-                analysis_results['d10'], analysis_results['d25'], analysis_results['d50'],
-                analysis_results['d60'], analysis_results['d75'], analysis_results['cu'],
-                analysis_results['so'], plot_filename, sample_id
-            ))
-        else:
-            # Insert new analysis
-            conn.execute('''
-                INSERT INTO analysis_results 
-                (sample_id, d10, d25, d50, d60, d75, cu, so, plot_filename)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                sample_id, analysis_results['d10'], analysis_results['d25'], analysis_results['d50'],
-                analysis_results['d60'], analysis_results['d75'], analysis_results['cu'],
-                analysis_results['so'], plot_filename
-            ))
-        
-        conn.commit()
-        conn.close()
-        
+        run_analysis(sample_id)
         flash('Analysis completed successfully', 'success')
     except Exception as e:
         flash(f'Error during analysis: {str(e)}', 'danger')
     
     return redirect(url_for('sample_detail', sample_id=sample_id))
 
+def find_similar(sample_id, k):
+    """Top-k samples closest to a stored sample, with their names, as a list of dicts."""
+    vector = curve_matrix.row(sample_id)
+    metrics.inc('sieve_cache_requests_total', cache='curve_matrix', result='miss' if vector is None else 'hit')
+    if vector is None:
+        return []
+    with metrics.stage('similarity_query'):
+        matches = curve_index.query(vector, k=k, exclude=sample_id)
+    return describe_matches(matches)
+
+def describe_matches(matches):
+    """Attach sample name, location and date to (sample_id, distance) pairs."""
+    if not matches:
+        return []
+    rows = read_sample_rows('samples', [sample_id for sample_id, _ in matches], 'id')
+    
+    results = []
+    for sample_id, distance in matches:
+        row = rows.get(sample_id)
+        if row:
+            results.append({
+                'sample_id': sample_id,
+                'name': row['name'],
+                'location': row['location'],
+                'date': row['date'],
+                'distance': round(distance, 4),
+            })
+    return results
+
+def parse_curve(curve):
+    """Validate one posted curve; returns (name, sieve sizes, percent passing) or raises ValueError."""
+    if not isinstance(curve, dict):
+        raise ValueError('Each curve must be an object with sieve_sizes and percent_passing')
+    sizes = curve.get('sieve_sizes')
+    passing = curve.get('percent_passing')
+    if not isinstance(sizes, list) or not isinstance(passing, list) or len(sizes) != len(passing):
+        raise ValueError('sieve_sizes and percent_passing must be lists of the same length')
+    if len(sizes) < 2:
+        raise ValueError('At least two readings are needed')
+    try:
+        sizes = [float(size) for size in sizes]
+        passing = [float(percent) for percent in passing]
+    except (TypeError, ValueError):
+        raise ValueError('sieve_sizes and percent_passing must be numbers')
+    if not all(np.isfinite(sizes)) or not all(np.isfinite(passing)):
+        raise ValueError('sieve_sizes and percent_passing must be finite numbers')
+    return curve.get('name'), sizes, passing
+
+def json_number(value, digits=6):
+    """Round a float for JSON, turning NaN and infinity into null."""
+    return round(float(value), digits) if np.isfinite(value) else None
+
+@app.route('/api/analyze', methods=['POST'])
+def api_analyze():
+    """
+    Analyze curves without storing them. Accepts one curve
+    {"name": ..., "sieve_sizes": [...], "percent_passing": [...]}, a list of curves,
+    or {"curves": [...]}, and returns D-values, Cu, So, fines and criteria checks.
+    Choose the interpolation model with "interpolation" in the object or ?interpolation=
+    (linear, log-linear or pchip; default: the INTERPOLATION setting).
+    """
+    data = request.get_json(silent=True)
+    single = isinstance(data, dict) and 'curves' not in data
+    curves = [data] if single else (data.get('curves') if isinstance(data, dict) else data)
+    if not isinstance(curves, list) or not curves:
+        return jsonify({'error': 'Post a curve, a list of curves or {"curves": [...]}'}), 400
+    interpolation = (request.args.get('interpolation') or (data.get('interpolation') if isinstance(data, dict) else None)
+                     or app.config['INTERPOLATION'])
+    if interpolation not in INTERPOLATION_MODELS:
+        return jsonify({'error': f"Unknown interpolation model '{interpolation}'; "
+                                 f"use one of {', '.join(INTERPOLATION_MODELS)}"}), 400
+    if len(curves) > app.config['MAX_ANALYZE_CURVES']:
+        return jsonify({'error': f"At most {app.config['MAX_ANALYZE_CURVES']} curves per request"}), 413
+    
+    results = [None] * len(curves)
+    valid = []   # (index, name, sizes, passing)
+    for i, curve in enumerate(curves):
+        try:
+            valid.append((i,) + parse_curve(curve))
+        except ValueError as e:
+            results[i] = {'name': curve.get('name') if isinstance(curve, dict) else None, 'error': str(e)}
+    
+    if valid:
+        with metrics.stage('batch_analysis'):
+            names = [name if name is not None else f'Curve {i + 1}' for i, name, _, _ in valid]
+            analyses = analyze_samples_batch([(sizes, passing) for _, _, sizes, passing in valid], names,
+                                             interpolation)
+            ok = [analysis for analysis in analyses if 'error' not in analysis]
+            
+            sizes, passing = pad_curves([(a['sieve_sizes'], a['percent_passing']) for a in ok])
+            fines = percent_passing_at_batch(sizes, passing, 0.063) if ok else np.zeros(0)
+            columns = {key: np.array([a[key] for a in ok]) for key in ('d50', 'cu', 'so')}
+            compliance = check_compliance_batch(columns['d50'], columns['cu'], columns['so'], fines)
+        
+        row = 0
+        for (i, _, _, _), analysis in zip(valid, analyses):
+            if 'error' in analysis:
+                results[i] = {'name': analysis['sample_name'], 'error': analysis['error']}
+                continue
+            result = {'name': analysis['sample_name']}
+            for key in ('d10', 'd25', 'd30', 'd50', 'd60', 'd75', 'cu', 'so', 'percent_063'):
+                result[key] = json_number(analysis[key])
+            result['fines'] = json_number(fines[row])
+            result['sorting_desc'] = analysis['sorting_desc']
+            result['interpolation'] = analysis['interpolation']
+            result['compliance'] = {key: bool(values[row]) for key, values in compliance.items()}
+            result['compliance']['total_compliant'] = sum(result['compliance'].values())
+            results[i] = result
+            row += 1
+    
+    if single:
+        result = results[0]
+        return jsonify(result), (400 if 'error' in result else 200)
+    return jsonify({
+        'count': len(results),
+        'failed': sum(1 for result in results if 'error' in result),
+        'results': results,
+    })
+
+def parse_sizes(text):
+    """Sizes in mm from a comma-separated query parameter, or the default reporting sizes."""
+    if not text:
+        return CURVE_SIZES
+    sizes = [float(size) for size in text.split(',') if size.strip()]
+    if not sizes or not all(np.isfinite(sizes)) or min(sizes) <= 0 or len(sizes) > 200:
+        raise ValueError('sizes must be up to 200 positive numbers (mm)')
+    return tuple(sizes)
+
+@app.route('/api/samples/<int:sample_id>/fits')
+def api_sample_fits(sample_id):
+    """
+    The parametric size distributions fitted to a stored sample, best first, each
+    with its curve at ?sizes=0.002,0.004,... (mm; default down to clay sizes).
+    """
+    if not get_sample(sample_id):
+        return jsonify({'error': 'Sample not found'}), 404
+    try:
+        sizes = parse_sizes(request.args.get('sizes'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn = get_db_connection([sample_id])
+    rows = conn.execute('SELECT * FROM psd_fits WHERE sample_id = ?', (sample_id,)).fetchall()
+    conn.close()
+    if not rows:
+        return jsonify({'error': 'Sample has not been analyzed yet'}), 404
+    fits = {row['model']: {'scale': np.array([row['scale']]), 'shape': np.array([row['shape']]),
+                           'rmse': np.array([row['rmse']]),
+                           'r2': np.array([row['r2'] if row['r2'] is not None else np.nan]),
+                           'converged': np.array([bool(row['converged'])])}
+            for row in rows}
+    return jsonify({'sample_id': sample_id, 'fits': describe_fits(fits, 0, sizes)})
+
+@app.route('/api/screen/simulate', methods=['POST'])
+def api_screen_simulate():
+    """
+    Split feeds on screens with a non-ideal partition curve, for every combination
+    of feed and screen setting, without storing anything. Body:
+    {"curves": [...]} (as for /api/analyze) or {"sample_ids": [...]}, plus
+    "model" (whiten, logistic or ideal), "cut" (mm), "sharpness" and "bypass"
+    (0-1), each a number or a list of one value per setting, and
+    "include_curves" (default true) for the product curves.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Post {"curves": [...]} or {"sample_ids": [...]} with the screen settings'}), 400
+    model = data.get('model', DEFAULT_PARTITION_MODEL)
+    if data.get('cut') is None:
+        return jsonify({'error': 'cut (mm) is required'}), 400
+    try:
+        check_partition_model(model)
+        cut, sharpness, bypass = screen_settings(data.get('cut'), data.get('sharpness', DEFAULT_SHARPNESS),
+                                                 data.get('bypass', 0.0))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = []
+    valid = []   # (index, sizes, passing)
+    if 'sample_ids' in data:
+        try:
+            sample_ids = [int(sample_id) for sample_id in data['sample_ids']]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'sample_ids must be a list of sample IDs'}), 400
+        feeds = len(sample_ids)
+        if feeds <= app.config['MAX_ANALYZE_CURVES']:
+            curves = read_sample_curves(sample_ids)
+            for i, sample_id in enumerate(sample_ids):
+                results.append({'sample_id': sample_id})
+                if sample_id in curves:
+                    valid.append((i,) + curves[sample_id])
+                else:
+                    results[i]['error'] = 'Sample not found or has no sieve data'
+    else:
+        curves = data.get('curves')
+        if not isinstance(curves, list) or not curves:
+            return jsonify({'error': 'Post {"curves": [...]} or {"sample_ids": [...]} with the screen settings'}), 400
+        feeds = len(curves)
+        if feeds <= app.config['MAX_ANALYZE_CURVES']:
+            for i, curve in enumerate(curves):
+                try:
+                    name, sizes, passing = parse_curve(curve)
+                    results.append({'name': name})
+                    valid.append((i, sizes, passing))
+                except ValueError as e:
+                    results.append({'name': curve.get('name') if isinstance(curve, dict) else None, 'error': str(e)})
+    if feeds > app.config['MAX_ANALYZE_CURVES'] or feeds * len(cut) > app.config['MAX_SCREEN_SIMULATIONS']:
+        return jsonify({'error': f"At most {app.config['MAX_ANALYZE_CURVES']} feeds and "
+                                 f"{app.config['MAX_SCREEN_SIMULATIONS']} feed x setting combinations per request"}), 413
+    
+    if valid:
+        with metrics.stage('screen_simulation'):
+            simulation = simulate_curves([(sizes, passing) for _, sizes, passing in valid], cut, sharpness, bypass, model)
+        include_curves = data.get('include_curves', True)
+        for feed, (i, _, _) in enumerate(valid):
+            splits = []
+            for setting in range(len(cut)):
+                split = {key: json_number(simulation[key][feed, setting], 4)
+                         for key in ('overflow_yield', 'underflow_yield', 'coarse_recovery', 'fines_recovery')}
+                if include_curves:
+                    for product in ('overflow', 'underflow'):
+                        sizes, passing = product_curve(simulation, feed, setting, product)
+                        split[product] = {'sieve_sizes': sizes, 'percent_passing': [round(value, 4) for value in passing]}
+                splits.append(split)
+            results[i]['splits'] = splits
+    
+    return jsonify({
+        'model': model,
+        'settings': [{'cut': float(c), 'sharpness': float(k), 'bypass': float(b)}
+                     for c, k, b in zip(cut, sharpness, bypass)],
+        'count': len(results),
+        'failed': sum(1 for result in results if 'error' in result),
+        'results': results,
+    })
+
+@app.route('/api/fit', methods=['POST'])
+def api_fit():
+    """
+    Fit the parametric size distributions (lognormal, rosin_rammler, ggs) to posted
+    curves without storing them; same input as /api/analyze, plus optional "models"
+    and "sizes" (mm) for the fitted curves.
+    """
+    data = request.get_json(silent=True)
+    single = isinstance(data, dict) and 'curves' not in data
+    curves = [data] if single else (data.get('curves') if isinstance(data, dict) else data)
+    if not isinstance(curves, list) or not curves:
+        return jsonify({'error': 'Post a curve, a list of curves or {"curves": [...]}'}), 400
+    if len(curves) > app.config['MAX_ANALYZE_CURVES']:
+        return jsonify({'error': f"At most {app.config['MAX_ANALYZE_CURVES']} curves per request"}), 413
+    options = data if isinstance(data, dict) else {}
+    models = options.get('models') or PSD_MODELS
+    if not isinstance(models, list) and models is not PSD_MODELS or any(model not in PSD_MODELS for model in models):
+        return jsonify({'error': f"models must be a list of {', '.join(PSD_MODELS)}"}), 400
+    try:
+        sizes = parse_sizes(','.join(str(size) for size in options['sizes'])) if options.get('sizes') else CURVE_SIZES
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sizes must be up to 200 positive numbers (mm)'}), 400
+    
+    results = [None] * len(curves)
+    valid = []   # (index, name, sizes, passing)
+    for i, curve in enumerate(curves):
+        try:
+            valid.append((i,) + parse_curve(curve))
+        except ValueError as e:
+            results[i] = {'name': curve.get('name') if isinstance(curve, dict) else None, 'error': str(e)}
+    
+    if valid:
+        with metrics.stage('psd_fitting'):
+            fits = fit_distributions([(curve_sizes, passing) for _, _, curve_sizes, passing in valid], models)
+        for row, (i, name, _, _) in enumerate(valid):
+            described = describe_fits(fits, row, sizes)
+            results[i] = {'name': name, 'fits': described} if described else \
+                         {'name': name, 'error': 'Too few readings above size 0 to fit'}
+    
+    if single:
+        result = results[0]
+        return jsonify(result), (400 if 'error' in result else 200)
+    return jsonify({
+        'count': len(results),
+        'failed': sum(1 for result in results if 'error' in result),
+        'results': results,
+    })
+
+@app.route('/sample/<int:sample_id>/similar')
+def similar_samples(sample_id):
+    """Show the archived samples with the most similar gradation curves."""
+    sample = get_sample(sample_id)
+    if not sample:
+        flash('Sample not found', 'danger')
+        return redirect(url_for('index'))
+    
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    return render_template('similar_samples.html', sample=sample, matches=find_similar(sample_id, k))
+
+@app.route('/api/samples/<int:sample_id>/similar')
+def api_similar_samples(sample_id):
+    """JSON list of the k samples most similar to a stored sample."""
+    if not get_sample(sample_id):
+        return jsonify({'error': 'Sample not found'}), 404
+    k = max(1, min(request.args.get('k', 10, type=int), 1000))
+    return jsonify({'sample_id': sample_id, 'matches': find_similar(sample_id, k)})
+
+@app.route('/api/similar', methods=['POST'])
+def api_similar_curve():
+    """
+    JSON list of the k samples most similar to a posted curve:
+    {"sieve_sizes": [...], "percent_passing": [...], "k": 10}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Post {"sieve_sizes": [...], "percent_passing": [...], "k": 10}'}), 400
+    try:
+        k = max(1, min(int(data.get('k', 10)), 1000))
+        vector = resample_curve(data.get('sieve_sizes', []), data.get('percent_passing', []))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': 'k must be an integer and sieve_sizes and percent_passing lists of numbers'}), 400
+    if vector is None:
+        return jsonify({'error': 'Provide sieve_sizes and percent_passing with at least two readings'}), 400
+    return jsonify({'matches': describe_matches(curve_index.query(vector, k=k))})
+
+@app.route('/api/curves')
+def api_curves():
+    """
+    Selected samples' curves on the standard sieve series (repeat sample_id; default
+    all), with per-sieve mean, standard deviation and percentiles across them.
+    Add rows=0 to return only the statistics.
+    """
+    sample_ids = request.args.getlist('sample_id', type=int) or None
+    ids, matrix = curve_matrix.select(sample_ids)
+    response = {
+        'sieve_sizes': curve_matrix.grid.tolist(),
+        'count': len(ids),
+        'statistics': curve_statistics(matrix),
+    }
+    if request.args.get('rows', '1') != '0':
+        response['samples'] = {int(sample_id): row.tolist() for sample_id, row in zip(ids, matrix)}
+    return jsonify(response)
+
+@app.route('/api/envelope/membership')
+def api_envelope_membership():
+    """Counts inside and outside an envelope, and the samples outside it, worst first."""
+    envelope = request.args.get('envelope', DEFAULT_ENVELOPE)
+    if envelope not in ENVELOPES:
+        return jsonify({'error': f"Unknown envelope '{envelope}'"}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), 10000))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    conn = get_db_connection(())
+    response = {
+        'envelope': envelope,
+        'counts': membership_counts(conn, envelope),
+        'outside': outside_envelope(conn, envelope, limit, offset),
+    }
+    conn.close()
+    names = read_sample_rows('samples', [row['sample_id'] for row in response['outside']], 'id')
+    for row in response['outside']:
+        sample = names.get(row['sample_id'])
+        row['name'] = sample['name'] if sample else None
+    return jsonify(response)
+
+@app.route('/api/samples/<int:sample_id>/envelope')
+def api_sample_envelope(sample_id):
+    """Stored envelope membership of one sample, for every envelope."""
+    conn = get_db_connection(())
+    rows = conn.execute('SELECT * FROM envelope_membership WHERE sample_id = ?', (sample_id,)).fetchall()
+    conn.close()
+    if not rows:
+        return jsonify({'error': 'No envelope check for this sample'}), 404
+    return jsonify({'sample_id': sample_id, 'envelopes': [dict(row) for row in rows]})
+
+@app.route('/api/envelope/check', methods=['POST'])
+def api_envelope_check():
+    """
+    Re-check every sample against the envelopes and store the results. With a
+    "tolerance" in percent passing the check is a what-if: the counts inside and
+    outside and the worst samples outside ("limit", default 100) are returned and
+    nothing is stored, so the stored membership is always that of the envelope itself.
+    """
+    data = request.get_json(silent=True) or {}
+    envelopes = data.get('envelopes')
+    if envelopes is not None and (not isinstance(envelopes, list) or any(name not in ENVELOPES for name in envelopes)):
+        return jsonify({'error': f"Unknown envelope; use one of {', '.join(ENVELOPES)}"}), 400
+    try:
+        tolerance = float(data.get('tolerance', 0.0))
+        limit = max(1, min(int(data.get('limit', 100)), 10000))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'tolerance must be a number and limit an integer'}), 400
+    if not np.isfinite(tolerance) or tolerance < 0:
+        return jsonify({'error': 'tolerance must be a non-negative number of percent passing'}), 400
+    
+    if tolerance:
+        with metrics.stage('envelope_check'):
+            results = check_envelopes(curve_matrix, envelopes, tolerance, limit)
+        return jsonify({'tolerance': tolerance, 'envelopes': results})
+    checked = db_writer.run(app.config['DATABASE'], update_membership, curve_matrix, envelopes=envelopes)
+    return jsonify({'checked': checked})
+
+def derived_analysis(parent_id, operations, name):
+    """Curve, analysis and compliance of a derived product of a stored sample, as a JSON-ready dict."""
+    sieve_sizes, percent_passing = get_curve(parent_id)
+    analysis = derived_cache.analysis(parent_id, sieve_sizes, percent_passing, operations, name,
+                                      app.config['INTERPOLATION'])
+    result = {
+        'sieve_sizes': analysis['sieve_sizes'],
+        'percent_passing': analysis['percent_passing'],
+    }
+    for key in ('d10', 'd25', 'd30', 'd50', 'd60', 'd75', 'cu', 'so', 'percent_063'):
+        result[key] = json_number(analysis[key])
+    result['sorting_desc'] = analysis['sorting_desc']
+    result['interpolation'] = analysis['interpolation']
+    result['compliance'] = check_criteria_compliance(analysis)
+    return result
+
+def get_derived_product(product_id):
+    """Get a derived product by ID, with its operations decoded, or None."""
+    conn = get_db_connection(())
+    row = conn.execute('SELECT * FROM derived_products WHERE id = ?', (product_id,)).fetchone()
+    conn.close()
+    return describe_product(row) if row else None
+
+@app.route('/api/samples/<int:sample_id>/derived', methods=['GET', 'POST'])
+def api_derived_products(sample_id):
+    """
+    List a sample's derived products, or define a new one:
+    {"name": "1mm underflow", "operations": [{"op": "underflow", "cutoff": 1.0}, ...]}
+    Nothing is computed or copied until the product is requested.
+    """
+    sample = get_sample(sample_id)
+    if not sample:
+        return jsonify({'error': 'Sample not found'}), 404
+    
+    conn = get_db_connection(())
+    if request.method == 'GET':
+        rows = conn.execute('SELECT * FROM derived_products WHERE parent_id = ? ORDER BY id',
+                            (sample_id,)).fetchall()
+        conn.close()
+        return jsonify({'sample_id': sample_id, 'products': [describe_product(row) for row in rows]})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        operations = parse_operations(data.get('operations'))
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    name = data.get('name') or f"{sample['name']} " + ' / '.join(f'{cutoff}mm {kind}' for kind, cutoff in operations)
+    _, product_id = db_writer.run(app.config['DATABASE'], execute,
+                                  'INSERT INTO derived_products (parent_id, name, operations) VALUES (?, ?, ?)',
+                                  (sample_id, name, operations_json(operations)))
+    row = conn.execute('SELECT * FROM derived_products WHERE id = ?', (product_id,)).fetchone()
+    conn.close()
+    return jsonify(describe_product(row)), 201
+
+@app.route('/api/samples/<int:sample_id>/screen', methods=['POST'])
+def api_screen_sample(sample_id):
+    """
+    Curve and analysis of a sample after screen operations, without storing a product:
+    {"operations": [{"op": "underflow", "cutoff": 1.0}]}
+    """
+    sample = get_sample(sample_id)
+    if not sample:
+        return jsonify({'error': 'Sample not found'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        operations = parse_operations(data.get('operations'))
+        result = derived_analysis(sample_id, operations, sample['name'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = {'parent_id': sample_id, 'operations': json.loads(operations_json(operations))}
+    response.update(result)
+    return jsonify(response)
+
+def parse_cuts(name):
+    """Cut sizes in mm from a repeatable or comma-separated query parameter."""
+    cuts = [float(cut) for values in request.args.getlist(name) for cut in values.split(',') if cut.strip()]
+    if not all(np.isfinite(cuts)) or any(cut <= 0 for cut in cuts):
+        raise ValueError(f'{name} cuts must be positive sizes in mm')
+    return cuts
+
+def load_curve(sample_id):
+    """A stored sample's curve as arrays, or None if there is no such sample or it has no readings."""
+    conn = get_db_connection([sample_id])
+    exists = conn.execute('SELECT 1 FROM samples WHERE id = ?', (sample_id,)).fetchone()
+    curve = read_curve(conn, sample_id) if exists else None
+    conn.close()
+    return curve
+
+@app.route('/api/samples/<int:sample_id>/what-if')
+def api_what_if(sample_id):
+    """
+    Live split and criteria for the sample page's sliders, e.g.
+    ?underflow=1.0&overflow=0.075&d50_min=0.25&fines_max=3
+    Returns the product's yield, D-values, Cu, So and fines with the design criteria
+    checked against the given limits (defaults: the design criteria), or a 400 for
+    cuts that leave no material. Nothing is stored or plotted, and the curve is read
+    from the database only the first time.
+    """
+    interpolation = request.args.get('interpolation') or app.config['INTERPOLATION']
+    if interpolation not in INTERPOLATION_MODELS:
+        return jsonify({'error': f"Unknown interpolation model '{interpolation}'; "
+                                 f"use one of {', '.join(INTERPOLATION_MODELS)}"}), 400
+    try:
+        underflow = parse_cuts('underflow')
+        overflow = parse_cuts('overflow')
+        limits = {key: float(request.args.get(key, default)) for key, default in WHAT_IF_LIMITS.items()}
+        if not all(np.isfinite(list(limits.values()))):
+            raise ValueError('Design limits must be finite numbers')
+        state = what_if_cache.state(sample_id, interpolation, load_curve)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if state is None:
+        return jsonify({'error': 'Sample not found or has no readings'}), 404
+    
+    product = state.split(underflow, overflow)
+    if not product['yield']:
+        return jsonify({'error': 'The screen cuts leave no material to analyze'}), 400
+    result = {'sample_id': sample_id, 'interpolation': interpolation, 'underflow': underflow, 'overflow': overflow}
+    for key, value in product.items():
+        result[key] = json_number(value) if isinstance(value, float) else value
+    result['limits'] = limits
+    result['criteria'] = check_limits(product, limits)
+    return jsonify(result)
+
+@app.route('/api/derived/<int:product_id>', methods=['GET', 'DELETE'])
+def api_derived_product(product_id):
+    """A derived product with its curve and analysis (computed on demand), or delete it."""
+    product = get_derived_product(product_id)
+    if not product:
+        return jsonify({'error': 'Derived product not found'}), 404
+    
+    if request.method == 'DELETE':
+        db_writer.run(app.config['DATABASE'], execute, 'DELETE FROM derived_products WHERE id = ?', (product_id,))
+        return jsonify({'deleted': product_id})
+    
+    operations = parse_operations(product['operations'])
+    try:
+        product.update(derived_analysis(product['parent_id'], operations, product['name']))
+    except ValueError as e:
+        product['error'] = str(e)
+        return jsonify(product), 422
+    return jsonify(product)
+
 @app.route('/compare', methods=['GET', 'POST'])
 def compare_samples():
     """Compare multiple samples."""
-    conn = get_db_connection()
-    all_samples = conn.execute('SELECT * FROM samples ORDER BY name').fetchall()
+    all_samples = read_partitions('SELECT * FROM samples ORDER BY name', key=lambda row: row['name'])
     
     if request.method == 'POST':
         sample_ids = request.form.getlist('sample_ids')
@@ -263,26 +1413,22 @@ def compare_samples():
         samples = []
         analyses = []
         criteria_results = []
+        curves_by_id = read_sample_curves(sample_ids)
+        sample_rows = read_sample_rows('samples', sample_ids, 'id')
+        analysis_rows = read_sample_rows('analysis_results', sample_ids)
         
         for sample_id in sample_ids:
-            sample = conn.execute('SELECT * FROM samples WHERE id = ?', (sample_id,)).fetchone()
+            sample = sample_rows.get(sample_id)
             if sample:
                 samples.append(sample)
                 
-                analysis = conn.execute('SELECT * FROM analysis_results WHERE sample_id = ?', 
-                                      (sample_id,)).fetchone()
+                analysis = analysis_rows.get(sample_id)
                 
                 if analysis:
                     analyses.append(analysis)
                     
-                    sieve_data = conn.execute('''
-                        SELECT * FROM sieve_data 
-                        WHERE sample_id = ? 
-                        ORDER BY sieve_size DESC
-                    ''', (sample_id,)).fetchall()
-                    
-                    sieve_sizes = [row['sieve_size'] for row in sieve_data]
-                    percent_passing = [row['percent_passing'] for row in sieve_data]
+                    sieve_sizes, percent_passing = (values.tolist() for values in
+                                                    curves_by_id.get(sample_id, ((), ())))
                     
                     criteria = check_criteria_compliance({
                         'd50': analysis['d50'],
@@ -297,45 +1443,20 @@ def compare_samples():
         # Generate combined plot if we have analyses for all samples
         combined_plot = None
         if len(analyses) == len(samples) and len(samples) > 0:
-            plt.figure(figsize=(10, 6))
-            
-            # Plot each sample
+            curves = []
             for i, sample_id in enumerate(sample_ids):
-                sieve_data = conn.execute('''
-                    SELECT * FROM sieve_data 
-                    WHERE sample_id = ? 
-                    ORDER BY sieve_size DESC
-                ''', (sample_id,)).fetchall()
-                
-                sieve_sizes = [row['sieve_size'] for row in sieve_data]
-                percent_passing = [row['percent_passing'] for row in sieve_data]
-                
-                # Plot with different marker and line style for each sample
-                markers = ['o', 's', '^', 'd', 'v', '<', '>', 'p', '*']
-                linestyles = ['-', '--', '-.', ':']
-                
-                marker = markers[i % len(markers)]
-                linestyle = linestyles[i % len(linestyles)]
-                
-                plt.semilogx(sieve_sizes, percent_passing, marker=marker, linestyle=linestyle, 
-                           label=samples[i]['name'])
-            
-            plt.xlabel('Particle Size (mm)')
-            plt.ylabel('Percent Passing (%)')
-            plt.title('Particle Size Distribution Comparison')
-            plt.grid(True, which="both", ls="-")
-            plt.legend()
+                sieve_sizes, percent_passing = curves_by_id.get(sample_id, ([], []))
+                curves.append((samples[i]['name'], list(sieve_sizes), list(percent_passing)))
             
             # Save the plot
             combined_plot = f"combined_plot_{uuid.uuid4().hex[:8]}.png"
             plot_path = os.path.join(app.config['STATIC_FOLDER'], 'plots', combined_plot)
-            plt.savefig(plot_path)
-            plt.close()
+            with metrics.stage('render_compare_plot'):
+                render_comparison(curves, plot_path)
+            metrics.inc('sieve_plot_renders_total', kind='compare')
             
             combined_plot = f"plots/{combined_plot}"
         
-        conn.close()
-        
         return render_template('compare_samples.html', 
                               all_samples=all_samples,
                               selected_sample_ids=sample_ids,
@@ -344,7 +1465,6 @@ def compare_samples():
                               criteria_results=criteria_results,
                               combined_plot=combined_plot)
     
-    conn.close()
     return render_template('compare_samples.html', all_samples=all_samples, selected_sample_ids=[])
 
 @app.route('/download/<int:sample_id>')
@@ -367,21 +1487,71 @@ def download(sample_id):
     }
     
     df = pd.DataFrame(data)
-    
-    # Create a temporary file for the Excel
-    temp_dir = tempfile.mkdtemp()
     filename = f"{secure_filename(sample['name'])}_sieve_data.xlsx"
-    filepath = os.path.join(temp_dir, filename)
     
-    # Write to Excel
-    df.to_excel(filepath, index=False, sheet_name='Sieve Data')
+    # A single sample is small, so build the workbook in memory rather than on disk
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, sheet_name='Sieve Data')
+    buffer.seek(0)
     
     # Return the file for download
-    return send_file(filepath, 
+    return send_file(buffer, 
                      as_attachment=True, 
                      download_name=filename, 
                      last_modified=datetime.now())
 
+def get_export_connection(db_path):
+    """
+    Plain-row connection for exports, reading every partition and packed curves; a
+    list of connections, one per partition, when they are too many to attach to one.
+    """
+    if partitions.fits():
+        return install_curve_views(partitions.attach(sqlite3.connect(db_path)))
+    return [install_curve_views(sqlite3.connect(path)) for path in partitions.paths()]
+
+@app.route('/export')
+def export():
+    """
+    Stream any filtered set of samples, sieve data and analysis results.
+    
+    Query parameters: format (csv, jsonl, parquet, xlsx), table (repeatable),
+    sample_id (repeatable), name, location, type, date_from, date_to.
+    """
+    export_format = request.args.get('format', 'csv')
+    tables = request.args.getlist('table')
+    if not tables and export_format in SINGLE_TABLE_FORMATS:
+        tables = ['sieve_data']
+    
+    filters = {key: request.args.get(key) for key in ('name', 'location', 'type', 'date_from', 'date_to')}
+    filters['sample_ids'] = request.args.getlist('sample_id', type=int)
+    
+    try:
+        chunks = stream_export(app.config['DATABASE'], export_format, tables, filters, connect=get_export_connection)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    suffix = tables[0] if len(tables or []) == 1 else 'export'
+    filename = f"beach_sand_{suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(chunks),
+                    mimetype=MIMETYPES[export_format],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def delete_sample_rows(conn, sample_id):
+    """
+    Remove a sample and its readings from the database file holding it (a database
+    writer operation). Foreign keys are not enforced, so the readings are deleted here;
+    triggers remove its analyses, fits and, in the main database, the app-wide rows.
+    """
+    conn.execute('DELETE FROM sieve_data WHERE sample_id = ?', (sample_id,))
+    conn.execute('DELETE FROM sample_curves WHERE sample_id = ?', (sample_id,))
+    conn.execute('DELETE FROM samples WHERE id = ?', (sample_id,))
+
+def delete_app_rows(conn, sample_id):
+    """Remove a partitioned sample's rows from the main database's tables (a database writer operation)."""
+    for table in ('curve_vectors', 'envelope_membership', 'derived_products'):
+        column = 'parent_id' if table == 'derived_products' else 'sample_id'
+        conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (sample_id,))
+
 @app.route('/delete/<int:sample_id>', methods=['POST'])
 def delete(sample_id):
     """Delete a sample and its associated data."""
@@ -391,11 +1561,15 @@ def delete(sample_id):
         return redirect(url_for('index'))
     
     try:
-        conn = get_db_connection()
-        # Delete the sample (cascade will remove sieve data)
-        conn.execute('DELETE FROM samples WHERE id = ?', (sample_id,))
-        conn.commit()
-        conn.close()
+        # Delete the sample with its readings in one operation on the file holding it
+        path = partitions.path_for_sample(sample_id)
+        db_writer.run(path, delete_sample_rows, sample_id)
+        if path != app.config['DATABASE']:
+            # The app-wide tables live in the main database, out of reach of the partition's triggers
+            db_writer.run(app.config['DATABASE'], delete_app_rows, sample_id)
+        curve_matrix.remove(sample_id)
+        derived_cache.invalidate(sample_id)
+        what_if_cache.invalidate(sample_id)
         flash(f'Sample "{sample["name"]}" deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting sample: {str(e)}', 'danger')
@@ -405,15 +1579,13 @@ def delete(sample_id):
 @app.route('/envelope')
 def generate_envelope():
     """Generate and display grading envelope."""
-    conn = get_db_connection()
-    
     # Get all samples that have analysis results
-    samples_with_analysis = conn.execute('''
-        SELECT s.id, s.name 
+    samples_with_analysis = read_partitions('''
+        SELECT s.id, s.name, a.d10, a.d25, a.d50, a.d60, a.d75, a.cu, a.so
         FROM samples s
         JOIN analysis_results a ON s.id = a.sample_id
         ORDER BY s.name
-    ''').fetchall()
+    ''', key=lambda row: row['name'])
     
     # Generate envelope plot
     envelope_filename = "grading_envelope.png"
@@ -421,27 +1593,17 @@ def generate_envelope():
     
     # Get data for all samples to include in the envelope plot
     sample_data = []
+    curves = read_sample_curves([sample['id'] for sample in samples_with_analysis])
     
     for sample in samples_with_analysis:
-        sieve_data = conn.execute('''
-            SELECT sieve_size, percent_passing 
-            FROM sieve_data 
-            WHERE sample_id = ? 
-            ORDER BY sieve_size DESC
-        ''', (sample['id'],)).fetchall()
-        
-        analysis = conn.execute('''
-            SELECT d10, d25, d50, d60, d75, cu, so 
-            FROM analysis_results 
-            WHERE sample_id = ?
-        ''', (sample['id'],)).fetchone()
+        sieve_data = curves.get(sample['id'])
         
-        if sieve_data and analysis:
+        if sieve_data is not None:
             sample_data.append({
                 'name': sample['name'],
-                'sieve_sizes': [row['sieve_size'] for row in sieve_data],
-                'percent_passing': [row['percent_passing'] for row in sieve_data],
-                'analysis': dict(analysis)
+                'sieve_sizes': sieve_data[0].tolist(),
+                'percent_passing': sieve_data[1].tolist(),
+                'analysis': {key: sample[key] for key in ('d10', 'd25', 'd50', 'd60', 'd75', 'cu', 'so')}
             })
     
     if sample_data:
@@ -456,34 +1618,35 @@ def generate_envelope():
             save_path=envelope_path
         )
     
-    conn.close()
-    
     return render_template('envelope.html', 
                           samples=samples_with_analysis,
                           envelope_plot=f"plots/{envelope_filename}" if sample_data else None)
 
 # Create database tables if they don't exist
-def init_db():
-    conn = get_db_connection()
-    
+def create_sample_tables(conn):
+    """Create the per-sample tables; every partition of the database has its own set."""
     # Create samples table
     conn.execute('''
         CREATE TABLE IF NOT EXISTS samples (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
+            type TEXT DEFAULT 'original',
+            date TEXT,
+            location TEXT,
             date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     
     # Create sieve_data table
+    # Imported workbooks only carry percent passing, so the weight columns are optional
     conn.execute('''
         CREATE TABLE IF NOT EXISTS sieve_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             sample_id INTEGER NOT NULL,
             sieve_size REAL NOT NULL,
-            weight_retained REAL NOT NULL,
-            percent_retained REAL NOT NULL,
-            cumulative_retained REAL NOT NULL,
+            weight_retained REAL,
+            percent_retained REAL,
+            cumulative_retained REAL,
             percent_passing REAL NOT NULL,
             FOREIGN KEY (sample_id) REFERENCES samples (id)
         )
@@ -501,17 +1664,91 @@ def init_db():
             d75 REAL,
             cu REAL,
             so REAL,
+            fines REAL,
+            interpolation TEXT DEFAULT 'linear',
             plot_filename TEXT,
             date_analyzed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (sample_id) REFERENCES samples (id)
         )
     ''')
     
+    # Older databases may predate the sample metadata columns
+    sample_columns = {row[1] for row in conn.execute('PRAGMA table_info(samples)')}
+    for column, definition in [('type', "TEXT DEFAULT 'original'"), ('date', 'TEXT'), ('location', 'TEXT')]:
+        if column not in sample_columns:
+            conn.execute(f'ALTER TABLE samples ADD COLUMN {column} {definition}')
+    
+    # ...and analyses the record of how their D-values were interpolated
+    analysis_columns = {row[1] for row in conn.execute('PRAGMA table_info(analysis_results)')}
+    if 'interpolation' not in analysis_columns:
+        conn.execute("ALTER TABLE analysis_results ADD COLUMN interpolation TEXT DEFAULT 'linear'")
+    # ...and their fines content (backfilled by backfill_fines())
+    if 'fines' not in analysis_columns:
+        conn.execute('ALTER TABLE analysis_results ADD COLUMN fines REAL')
+    
+    # Summary statistics kept up to date by triggers
+    create_summary_tables(conn)
+    
+    # Full-text search over names, locations and types, also kept up to date by triggers
+    create_search_tables(conn)
+    
+    # Parametric size distributions fitted to each analyzed curve
+    create_fit_tables(conn)
+    
+    # Curves packed one blob per sample (CURVE_STORAGE=blob or blob-zlib)
+    create_curve_table(conn)
+
+def backfill_fines(path):
+    """
+    Give analyses stored before their fines content was kept the percent passing
+    0.063 mm of their curves (the summary triggers count them in as they change).
+    """
+    conn = install_curve_views(sqlite3.connect(path))
+    sample_ids = [row[0] for row in conn.execute('SELECT sample_id FROM analysis_results WHERE fines IS NULL')]
+    for start in range(0, len(sample_ids), ID_CHUNK):
+        curves = read_curves(conn, sample_ids[start:start + ID_CHUNK])
+        if not curves:
+            continue
+        sizes, passing = pad_curves(list(curves.values()))
+        fines = percent_passing_at_batch(sizes, passing, 0.063)
+        conn.executemany('UPDATE analysis_results SET fines = ? WHERE sample_id = ?',
+                         zip(fines.tolist(), curves))
     conn.commit()
     conn.close()
 
+def init_db():
+    # Set up the main database and load the partition catalog before anything is attached
+    conn = sqlite3.connect(app.config['DATABASE'])
+    create_sample_tables(conn)
+    
+    # Curves resampled onto the standard sieve series
+    create_curve_tables(conn)
+    
+    # Envelope membership of every curve
+    create_envelope_tables(conn)
+    
+    # Derived products, stored as a parent sample plus screen operations
+    create_derived_tables(conn)
+    
+    # Control charts of the production streams
+    spc.create_spc_tables(conn)
+    
+    conn.commit()
+    partitions.load(conn, create_sample_tables)
+    conn.close()
+    for path in partitions.paths():
+        backfill_fines(path)
+    
+    conn = get_db_connection(())
+    sample_ids = [row['id'] for row in read_partitions(
+        'SELECT id FROM samples WHERE id IN (SELECT sample_id FROM curve_samples)')]
+    curve_matrix.load(conn, sample_ids, read_sample_curves)
+    sync_membership(conn, curve_matrix)
+    conn.close()
+
 # Initialize database on startup
 init_db()
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001) 
\ No newline at end of file
+    # Charts are drawn on per-call figures, so requests can be served on several threads
+    app.run(debug=True, port=5001, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Curve Similarity Index
+Finds the archived samples whose gradation curves are closest to a given curve.
+
+The index works on the dense curve matrix from curve_matrix.py, where every
+sample's curve is resampled onto the standard sieve series. A query is a blocked
+brute-force scan of that matrix (one matrix-vector product per block), which
+answers in milliseconds even for a million samples.
+"""
+
+import numpy as np
+
+BLOCK_SIZE = 65536   # Rows scanned per block during a query
+
+
+class CurveIndex:
+    """Nearest-neighbour queries over the rows of a CurveMatrix."""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def query(self, vector, k=10, exclude=None):
+        """
+        Return the k nearest samples to vector as (sample_id, distance) pairs, closest
+        first. Distance is the root-mean-square difference in percent passing over
+        the grid.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        query_norm = float(vector @ vector)
+        best_ids = np.zeros(0, dtype=np.int64)
+        best_dist = np.zeros(0, dtype=np.float32)
+
+        with self.matrix.lock:
+            all_ids, vectors, norms = self.matrix.arrays()
+            for start in range(0, len(all_ids), BLOCK_SIZE):
+                stop = start + BLOCK_SIZE
+                # |a - b|^2 = |a|^2 - 2 a.b + |b|^2, with |a|^2 precomputed per row
+                dist = norms[start:stop] - 2.0 * (vectors[start:stop] @ vector) + query_norm
+                ids = all_ids[start:stop]
+                if exclude is not None:
+                    dist = np.where(ids == exclude, np.inf, dist)
+
+                ids = np.concatenate([best_ids, ids])
+                dist = np.concatenate([best_dist, dist])
+                if len(dist) > k:
+                    keep = np.argpartition(dist, k)[:k]
+                    ids, dist = ids[keep], dist[keep]
+                best_ids, best_dist = ids, dist
+
+        order = np.argsort(best_dist)
+        rms = np.sqrt(np.maximum(best_dist[order], 0.0) / len(self.matrix.grid))
+        return [(int(sample_id), float(distance))
+                for sample_id, distance in zip(best_ids[order], rms) if np.isfinite(distance)]
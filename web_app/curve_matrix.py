@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Canonical Sieve Grid and Dense Curve Matrix
+Samples come with different sieve series: the CLI example uses 20 sieves from
+28 mm down to the pan, the test data uses 4.0 mm down to a 'pan' row, and imported
+workbooks use whatever the lab had. This module resamples every curve onto one
+standard sieve series (interpolating in log-size space) and keeps the results as a
+dense samples x sieves float32 matrix.
+
+The matrix is persisted row by row in the curve_vectors table, loaded once at
+startup and updated whenever a sample's readings are written or deleted, so any
+cross-sample work (similarity search, envelope checks, statistics) can run as plain
+NumPy operations instead of walking ragged lists.
+"""
+
+import json
+import threading
+
+import numpy as np
+
+from curve_storage import read_curves
+
+# Standard test sieve apertures in mm (ISO 3310-1 / ASTM E11), 0.063 mm to 28 mm
+STANDARD_SIEVES = np.array([
+    0.063, 0.075, 0.090, 0.106, 0.125, 0.150, 0.180, 0.212, 0.250, 0.300,
+    0.355, 0.425, 0.500, 0.600, 0.710, 0.850, 1.00, 1.18, 1.40, 1.70,
+    2.00, 2.36, 2.80, 3.35, 4.00, 4.75, 5.60, 6.30, 8.00, 10.0,
+    12.5, 14.0, 16.0, 19.0, 20.0, 25.0, 28.0,
+])
+
+ID_CHUNK = 500       # Sample IDs per query
+
+
+def resample_curve(sieve_sizes, percent_passing, grid=STANDARD_SIEVES):
+    """
+    Interpolate a gradation curve onto the grid in log-size space.
+
+    Readings without a positive numeric size (such as the pan) are ignored. Outside
+    the sieves that were used, the curve is held at its nearest reading. Returns a
+    float32 vector, or None if fewer than two usable readings remain.
+    """
+    sizes = []
+    passing = []
+    for size, percent in zip(sieve_sizes, percent_passing):
+        try:
+            size = float(size)
+            percent = float(percent)
+        except (TypeError, ValueError):
+            continue
+        if size > 0 and np.isfinite(size) and np.isfinite(percent):
+            sizes.append(size)
+            passing.append(percent)
+
+    if len(sizes) < 2:
+        return None
+
+    order = np.argsort(sizes)
+    log_sizes = np.log(np.asarray(sizes)[order])
+    passing = np.asarray(passing)[order]
+    return np.interp(np.log(grid), log_sizes, passing).astype(np.float32)
+
+
+def create_curve_tables(conn):
+    """Create the curve matrix tables and the trigger that drops a deleted sample's row."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS curve_vectors (
+            sample_id INTEGER PRIMARY KEY,
+            vector BLOB NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS curve_matrix_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS curve_vectors_sample_delete AFTER DELETE ON samples
+        BEGIN
+            DELETE FROM curve_vectors WHERE sample_id = OLD.id;
+        END
+    ''')
+
+
+def curve_statistics(matrix, percentiles=(10, 50, 90)):
+    """Per-sieve mean, standard deviation and percentiles across the rows of a curve matrix."""
+    if len(matrix) == 0:
+        return None
+    return {
+        'mean': matrix.mean(axis=0).tolist(),
+        'std': matrix.std(axis=0).tolist(),
+        'percentiles': {str(p): values.tolist()
+                        for p, values in zip(percentiles, np.percentile(matrix, percentiles, axis=0))},
+    }
+
+
+class CurveMatrix:
+    """
+    Dense float32 matrix with one resampled curve per sample, kept in step with the
+    database. Rows are packed: removing a sample moves the last row into its place.
+    """
+
+    def __init__(self, grid=STANDARD_SIEVES):
+        self.grid = np.asarray(grid, dtype=np.float64)
+        self.lock = threading.Lock()
+        self._clear()
+
+    def __len__(self):
+        return self._count
+
+    def _clear(self):
+        self._vectors = np.zeros((0, len(self.grid)), dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}   # sample_id -> row in the matrix
+        self._count = 0
+
+    def load(self, conn, sample_ids=None, load_curves=None):
+        """
+        Load the stored rows and compute any that are missing. If the stored rows were
+        built on a different grid they are all recomputed. The samples with readings
+        are read through conn, unless given as sample_ids together with
+        load_curves(sample_ids), returning their curves as a read_curves() dict (for
+        samples in partitions conn does not attach).
+        """
+        grid_signature = json.dumps([round(float(size), 6) for size in self.grid])
+        stored_grid = conn.execute(
+            "SELECT value FROM curve_matrix_meta WHERE key = 'grid'"
+        ).fetchone()
+        if stored_grid is None or stored_grid[0] != grid_signature:
+            conn.execute('DELETE FROM curve_vectors')
+            conn.execute("INSERT OR REPLACE INTO curve_matrix_meta (key, value) VALUES ('grid', ?)",
+                         (grid_signature,))
+            conn.commit()
+
+        rows = conn.execute('SELECT sample_id, vector FROM curve_vectors').fetchall()
+        with self.lock:
+            self._clear()
+            for sample_id, blob in rows:
+                self._set(sample_id, np.frombuffer(blob, dtype=np.float32))
+
+        if sample_ids is None:
+            missing = [row[0] for row in conn.execute('''
+                SELECT id FROM samples
+                WHERE id NOT IN (SELECT sample_id FROM curve_vectors)
+                  AND id IN (SELECT sample_id FROM curve_samples)
+            ''')]
+        else:
+            with self.lock:
+                missing = [sample_id for sample_id in sample_ids if sample_id not in self._rows]
+        for start in range(0, len(missing), ID_CHUNK):
+            chunk = missing[start:start + ID_CHUNK]
+            self.update(conn, chunk, None if load_curves is None else load_curves(chunk))
+
+    def update(self, conn, sample_ids, curves=None):
+        """
+        Recompute and store the rows of the given samples (call after their readings
+        change). Their curves are read through conn unless given as a read_curves() dict.
+        """
+        self.apply(self.store(conn, sample_ids, curves))
+
+    def store(self, conn, sample_ids, curves=None):
+        """
+        The database half of update(): recompute the given samples' rows and write them
+        to curve_vectors, without touching the in-memory matrix. Returns the changes for
+        apply(), a dict mapping sample ID to its new row (None for a sample left without
+        one). Run as a database writer operation, the changes are applied once it commits,
+        so a rolled-back write leaves the matrix as it was.
+        """
+        sample_ids = list(sample_ids)
+        changes = {}
+        for start in range(0, len(sample_ids), ID_CHUNK):
+            chunk = sample_ids[start:start + ID_CHUNK]
+            if curves is None:
+                chunk_curves = read_curves(conn, chunk)
+            else:
+                chunk_curves = {sample_id: curves[sample_id] for sample_id in chunk if sample_id in curves}
+
+            stored = []
+            for sample_id in chunk:
+                sizes, passing = chunk_curves.get(sample_id, ([], []))
+                vector = resample_curve(sizes, passing, self.grid)
+                changes[sample_id] = vector
+                if vector is None:
+                    conn.execute('DELETE FROM curve_vectors WHERE sample_id = ?', (sample_id,))
+                    continue
+                stored.append((sample_id, vector.tobytes()))
+
+            conn.executemany('INSERT OR REPLACE INTO curve_vectors (sample_id, vector) VALUES (?, ?)', stored)
+        conn.commit()
+        return changes
+
+    def apply(self, changes):
+        """Bring the in-memory matrix in line with rows written by store()."""
+        for sample_id, vector in changes.items():
+            if vector is None:
+                self.remove(sample_id)
+                continue
+            with self.lock:
+                self._set(sample_id, vector)
+
+    def remove(self, sample_id):
+        """Drop a sample's row from the in-memory matrix."""
+        with self.lock:
+            row = self._rows.pop(sample_id, None)
+            if row is None:
+                return
+            last = self._count - 1
+            if row != last:
+                # Move the last row into the gap so the matrix stays dense
+                self._vectors[row] = self._vectors[last]
+                self._norms[row] = self._norms[last]
+                self._ids[row] = self._ids[last]
+                self._rows[int(self._ids[row])] = row
+            self._count = last
+
+    def row(self, sample_id):
+        """A copy of one sample's resampled curve, or None if it has none."""
+        with self.lock:
+            row = self._rows.get(sample_id)
+            return None if row is None else self._vectors[row].copy()
+
+    def select(self, sample_ids=None):
+        """
+        Copy out (sample IDs, matrix) for the given samples, or for every sample.
+        Samples without a curve are left out.
+        """
+        with self.lock:
+            if sample_ids is None:
+                return self._ids[:self._count].copy(), self._vectors[:self._count].copy()
+            rows = [self._rows[sample_id] for sample_id in sample_ids if sample_id in self._rows]
+            return self._ids[rows].copy(), self._vectors[rows].copy()
+
+    def arrays(self):
+        """
+        Live views of (sample IDs, matrix, squared row norms) without copying.
+        The caller must hold self.lock while using them.
+        """
+        count = self._count
+        return self._ids[:count], self._vectors[:count], self._norms[:count]
+
+    def _set(self, sample_id, vector):
+        # Caller holds the lock
+        row = self._rows.get(sample_id)
+        if row is None:
+            if self._count == len(self._vectors):
+                capacity = max(1024, 2 * len(self._vectors))
+                self._vectors = np.resize(self._vectors, (capacity, len(self.grid)))
+                self._norms = np.resize(self._norms, capacity)
+                self._ids = np.resize(self._ids, capacity)
+            row = self._count
+            self._count += 1
+            self._rows[sample_id] = row
+            self._ids[row] = sample_id
+        self._vectors[row] = vector
+        # Squared norms let similarity queries use |a - b|^2 = |a|^2 - 2 a.b + |b|^2
+        self._norms[row] = float(vector @ vector)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Single Database Writer
+SQLite allows one writer per database file at a time. When uploads, imports,
+analyses and deletes each open a connection and commit on their own, they queue on
+the file's write lock, and whoever waits past the busy timeout fails with
+"database is locked". This module gives every write to the same thread instead.
+
+Callers submit an operation, a function called as operation(conn, *args) that
+writes through conn and does not commit, together with the database file it
+writes to, and get a Future for its return value. The writer thread takes
+everything queued, waiting at most MAX_DELAY seconds after the first operation
+for more (so an operation never waits longer than that for its batch to start),
+and runs the batch as one transaction per database file:
+
+- each operation runs inside its own SAVEPOINT, so an operation that raises is
+  rolled back alone and its future gets the exception while the rest of the
+  batch still commits
+- the futures get their results only once the transaction has committed; if the
+  commit fails, every operation of the transaction gets that error
+
+The writer thread keeps one connection open per database file for as long as it
+runs (a connection whose transaction failed is closed and reopened on the next
+batch) and closes them all when the writer is closed.
+
+Operations run in the submitting thread's context, so their stages and queries
+count towards the request or job that submitted them. commit() and `with conn:`
+on the writer's connections do nothing, so helpers that commit
+(update_membership(), CurveMatrix.store(), ...) can be run as operations as they are.
+"""
+
+import contextvars
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+MAX_DELAY = 0.002   # Seconds the writer waits for more operations to join a batch
+MAX_BATCH = 500     # Operations per batch
+
+
+class GroupConnection(sqlite3.Connection):
+    """
+    Writer connection: the writer commits each transaction, so commit() and leaving
+    a `with conn:` block inside an operation do nothing (an error still propagates).
+    """
+
+    def commit(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def commit_group(self):
+        super().commit()
+
+
+def execute(conn, sql, parameters=()):
+    """Operation running a single statement; returns the number of rows it changed and the last row ID inserted."""
+    cursor = conn.execute(sql, parameters)
+    return cursor.rowcount, cursor.lastrowid
+
+
+class _Write:
+    __slots__ = ('path', 'operation', 'args', 'kwargs', 'context', 'future')
+
+    def __init__(self, path, operation, args, kwargs):
+        self.path = path
+        self.operation = operation
+        self.args = args
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context()
+        self.future = Future()
+
+
+class DatabaseWriter:
+    """
+    One background thread running every database write, batched into grouped
+    transactions. prepare(conn, path), if given, sets up each connection the writer
+    opens (row factory, attached databases, query tracing, ...) and returns it; the
+    writer opens one per database file and keeps it until it is closed.
+    """
+
+    def __init__(self, prepare=None, max_delay=MAX_DELAY, max_batch=MAX_BATCH):
+        self.prepare = prepare
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._connections = {}   # path -> connection, used only by the writer thread
+
+    def submit(self, path, operation, *args, **kwargs):
+        """Queue operation(conn, *args, **kwargs) for the database file at path; returns a Future."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('Operations cannot submit writes of their own; the writer would wait for itself')
+        write = _Write(path, operation, args, kwargs)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The database writer is closed')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+            self._queue.put(write)
+        return write.future
+
+    def run(self, path, operation, *args, **kwargs):
+        """submit() and wait: returns the operation's result once committed, or raises its error."""
+        future = self.submit(path, operation, *args, **kwargs)
+        with metrics.stage('db_write_wait'):
+            return future.result()
+
+    def close(self):
+        """Finish the writes already queued, stop the thread and close its connections."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        try:
+            self._serve()
+        finally:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+    def _serve(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    write = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+
+            by_path = {}
+            for write in batch:
+                by_path.setdefault(write.path, []).append(write)
+            for path, writes in by_path.items():
+                self._write(path, [write for write in writes if write.future.set_running_or_notify_cancel()])
+
+    def _connect(self, path):
+        conn = self._connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, isolation_level=None, factory=GroupConnection)
+            if self.prepare:
+                try:
+                    conn = self.prepare(conn, path)
+                except Exception:
+                    conn.close()
+                    raise
+            self._connections[path] = conn
+        return conn
+
+    def _discard(self, path):
+        conn = self._connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+    def _write(self, path, writes):
+        """Run one file's share of a batch as a single transaction."""
+        if not writes:
+            return
+        done = []   # (write, result) of operations that succeeded
+        try:
+            conn = self._connect(path)
+        except Exception as e:
+            for write in writes:
+                write.future.set_exception(e)
+            return
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write in writes:
+                conn.execute('SAVEPOINT operation')
+                try:
+                    result = write.context.run(write.operation, conn, *write.args, **write.kwargs)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO operation')
+                    conn.execute('RELEASE operation')
+                    metrics.inc('sieve_db_write_operations_total', result='error')
+                    write.future.set_exception(e)
+                    continue
+                conn.execute('RELEASE operation')
+                done.append((write, result))
+            conn.commit_group()
+        except Exception as e:
+            # The connection may be unusable (or left in a transaction); open a fresh one next time
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                pass
+            self._discard(path)
+            failed = [write for write in writes if not write.future.done()]
+            metrics.inc('sieve_db_write_operations_total', len(failed), result='error')
+            for write in failed:
+                write.future.set_exception(e)
+            return
+
+        metrics.inc('sieve_db_write_transactions_total')
+        metrics.inc('sieve_db_write_operations_total', len(done), result='ok')
+        for write, result in done:
+            write.future.set_result(result)
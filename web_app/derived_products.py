@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Derived Products
+Screened products (the 1 mm underflow of a sample, the 0.075 mm overflow of that
+underflow, ...) are stored as lineage instead of as copies of the readings: a parent
+sample plus the list of screen operations that produce the product. Only that
+definition lives in the derived_products table.
+
+Curves and analyses of derived products are computed when they are asked for and
+memoized by the hash of the parent's readings and the operations applied so far,
+so products sharing a prefix of operations share its result. When a parent's
+readings change, its hash changes: the stale entries are dropped the next time the
+parent is seen (or straight away through invalidate()), and nothing derived from
+the old readings can be served.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from sieve_analysis import SCREEN_OPERATIONS, DEFAULT_INTERPOLATION, analyze_sample
+
+CACHE_SIZE = 4096   # Memoized products (one per parent and operation prefix)
+
+
+def create_derived_tables(conn):
+    """Create the derived products table and the trigger that drops a deleted parent's products."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS derived_products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            operations TEXT NOT NULL,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (parent_id) REFERENCES samples (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_derived_products_parent ON derived_products (parent_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS derived_products_parent_delete AFTER DELETE ON samples
+        BEGIN
+            DELETE FROM derived_products WHERE parent_id = OLD.id;
+        END
+    ''')
+
+
+def parse_operations(operations):
+    """
+    Validate screen operations given as [{"op": "underflow", "cutoff": 1.0}, ...] or
+    [["underflow", 1.0], ...]; returns a list of (kind, cutoff) tuples or raises ValueError.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('operations must be a non-empty list')
+    parsed = []
+    for operation in operations:
+        if isinstance(operation, dict):
+            kind, cutoff = operation.get('op'), operation.get('cutoff')
+        elif isinstance(operation, (list, tuple)) and len(operation) == 2:
+            kind, cutoff = operation
+        else:
+            raise ValueError('Each operation must be {"op": ..., "cutoff": ...}')
+        if kind not in SCREEN_OPERATIONS:
+            raise ValueError(f"Unknown operation '{kind}'; use one of {', '.join(SCREEN_OPERATIONS)}")
+        try:
+            cutoff = float(cutoff)
+        except (TypeError, ValueError):
+            raise ValueError('cutoff must be a number (mm)')
+        if not np.isfinite(cutoff) or cutoff <= 0:
+            raise ValueError('cutoff must be a positive size in mm')
+        parsed.append((kind, cutoff))
+    return parsed
+
+
+def operations_json(operations):
+    """Canonical JSON of parsed operations, as stored and used in cache keys."""
+    return json.dumps([{'op': kind, 'cutoff': cutoff} for kind, cutoff in operations])
+
+
+def describe_product(row):
+    """A derived_products row as a dict with its operations decoded."""
+    product = dict(row)
+    product['operations'] = json.loads(product['operations'])
+    return product
+
+
+def readings_hash(sieve_sizes, percent_passing):
+    """Hash of a curve's readings; changes whenever any reading does."""
+    digest = hashlib.sha1()
+    digest.update(np.asarray(sieve_sizes, dtype=np.float64).tobytes())
+    digest.update(np.asarray(percent_passing, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+class DerivedCache:
+    """
+    Memoized curves and analyses of derived products, least recently used dropped first.
+
+    Entries are keyed by (parent readings hash, operations JSON) and hold the
+    product's sieve sizes and percent passing, plus its analysis per interpolation
+    model once computed.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._parents = {}   # parent_id -> readings hash last seen
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, parent_id):
+        """Forget everything derived from a parent (its readings changed or it was deleted)."""
+        with self.lock:
+            parent_hash = self._parents.pop(parent_id, None)
+            if parent_hash is not None:
+                self._drop(parent_hash)
+
+    def _drop(self, parent_hash):
+        # Caller holds the lock
+        for key in [key for key in self._entries if key[0] == parent_hash]:
+            del self._entries[key]
+
+    def _get(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        # Caller holds the lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def curve(self, parent_id, sieve_sizes, percent_passing, operations):
+        """
+        The derived product's curve as a cache entry dict (sieve_sizes, percent_passing).
+
+        Starts from the longest operation prefix already memoized for these readings
+        and memoizes every step it computes. Raises ValueError if a split leaves no
+        material to analyze.
+        """
+        parent_hash = readings_hash(sieve_sizes, percent_passing)
+        keys = [(parent_hash, operations_json(operations[:i + 1])) for i in range(len(operations))]
+
+        with self.lock:
+            previous = self._parents.get(parent_id)
+            if previous is not None and previous != parent_hash:
+                self._drop(previous)
+            self._parents[parent_id] = parent_hash
+
+            entry = self._get(keys[-1])
+            metrics.inc('sieve_cache_requests_total', cache='derived_products',
+                        result='miss' if entry is None else 'hit')
+            if entry is not None:
+                return entry
+
+            done = 0
+            sizes, passing = list(sieve_sizes), list(percent_passing)
+            for i in range(len(keys) - 1, 0, -1):
+                cached = self._get(keys[i - 1])
+                if cached is not None:
+                    done, sizes, passing = i, cached['sieve_sizes'], cached['percent_passing']
+                    break
+
+        # The splits themselves run outside the lock
+        computed = []
+        with metrics.stage('derive_curve'):
+            for i in range(done, len(operations)):
+                kind, cutoff = operations[i]
+                sizes, passing = SCREEN_OPERATIONS[kind](sizes, passing, cutoff)
+                if len(sizes) < 2:
+                    raise ValueError(f'The {cutoff} mm {kind} leaves no material to analyze')
+                computed.append((keys[i], {'sieve_sizes': [float(size) for size in sizes],
+                                           'percent_passing': [float(percent) for percent in passing]}))
+
+        with self.lock:
+            # Another thread may have filled the same keys meanwhile; keep the first result
+            for key, new_entry in computed:
+                if self._get(key) is None:
+                    self._put(key, new_entry)
+            return self._get(keys[-1]) or computed[-1][1]
+
+    def analysis(self, parent_id, sieve_sizes, percent_passing, operations, name,
+                 interpolation=DEFAULT_INTERPOLATION):
+        """The derived product's analyze_sample() results, computed once per curve and interpolation model."""
+        entry = self.curve(parent_id, sieve_sizes, percent_passing, operations)
+        analysis = entry.setdefault('analyses', {}).get(interpolation)
+        if analysis is None:
+            with metrics.stage('analyze_sample'):
+                analysis = analyze_sample(entry['sieve_sizes'], entry['percent_passing'], name, interpolation)
+            entry['analyses'][interpolation] = analysis
+        return analysis
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Envelope Membership
+Checks which samples' gradation curves lie inside a grading envelope.
+
+Each envelope is resampled once onto the standard sieve series of the curve
+matrix, so testing every sample is a single vectorized comparison of the matrix
+against two bound vectors. For every sample the check records whether it is
+inside, the largest excursion outside the envelope (in percent passing), the sieve
+where that excursion occurs and whether the curve was above or below the envelope.
+Results are stored in envelope_membership, indexed so "all samples outside the
+envelope" is a plain indexed query. Stored results are always of the envelope
+itself; checks with a tolerance are computed on request (check_envelopes()) and
+never stored, so later incremental checks cannot mix tolerances.
+"""
+
+import numpy as np
+
+from sieve_analysis import generate_envelope_curves
+
+BLOCK_SIZE = 65536   # Matrix rows checked at a time
+EPSILON = 1e-3       # Percent passing ignored as float32 round-off
+
+# Envelope name -> function returning (sizes in mm, one bound, other bound)
+ENVELOPES = {
+    'beach_sand': generate_envelope_curves,
+}
+DEFAULT_ENVELOPE = 'beach_sand'
+
+
+def create_envelope_tables(conn):
+    """Create the membership table, its index and the trigger that drops a deleted sample's rows."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS envelope_membership (
+            envelope TEXT NOT NULL,
+            sample_id INTEGER NOT NULL,
+            inside INTEGER NOT NULL,
+            max_excursion REAL NOT NULL,
+            excursion_sieve REAL,
+            direction TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (envelope, sample_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_envelope_membership_outside
+        ON envelope_membership (envelope, inside, max_excursion DESC)
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS envelope_membership_sample_delete AFTER DELETE ON samples
+        BEGIN
+            DELETE FROM envelope_membership WHERE sample_id = OLD.id;
+        END
+    ''')
+
+
+def envelope_on_grid(name, grid):
+    """
+    The named envelope as (low, high) percent-passing vectors on the grid.
+
+    The two bounds cross over, so the band at each sieve is taken as the smaller
+    and larger of the two curves there. Percent passing can only grow with sieve
+    size, so each bound is also made non-decreasing (the fines ramp of the upper
+    bound would otherwise dip just above 0.063 mm).
+    """
+    if name not in ENVELOPES:
+        raise ValueError(f"Unknown envelope '{name}'; use one of {', '.join(ENVELOPES)}")
+    sizes, first, second = ENVELOPES[name]()
+    log_grid = np.log(grid)
+    first = np.interp(log_grid, np.log(sizes), first)
+    second = np.interp(log_grid, np.log(sizes), second)
+    low = np.minimum.accumulate(np.minimum(first, second)[::-1])[::-1]
+    high = np.maximum.accumulate(np.maximum(first, second))
+    return low.astype(np.float32), high.astype(np.float32)
+
+
+def check_membership(matrix, low, high, grid, tolerance=0.0):
+    """
+    Test every row of a curve matrix against an envelope.
+
+    Returns arrays (inside, max_excursion, excursion_sieve, above): whether the whole
+    curve lies within tolerance of the band, the largest distance outside it, the
+    sieve size where that happens (NaN when inside) and whether it was above the band.
+    """
+    below = low - matrix    # > 0 where the curve is under the band
+    above = matrix - high   # > 0 where the curve is over the band
+    excursion = np.maximum(np.maximum(below, above), 0.0)
+    worst = np.argmax(excursion, axis=1)
+    rows = np.arange(len(matrix))
+    max_excursion = excursion[rows, worst]
+    inside = max_excursion <= tolerance + EPSILON
+    excursion_sieve = np.where(inside, np.nan, np.asarray(grid)[worst])
+    return inside, max_excursion, excursion_sieve, above[rows, worst] > 0
+
+
+def membership_rows(curve_matrix, sample_ids=None, envelopes=None, tolerance=0.0):
+    """
+    Check samples (default: all with a curve) against envelopes (default: all),
+    yielding blocks of (envelope, sample_id, inside, max_excursion, excursion_sieve,
+    direction) rows.
+    """
+    ids, matrix = curve_matrix.select(sample_ids)
+    for name in list(envelopes or ENVELOPES):
+        low, high = envelope_on_grid(name, curve_matrix.grid)
+        for start in range(0, len(ids), BLOCK_SIZE):
+            block_ids = ids[start:start + BLOCK_SIZE]
+            inside, max_excursion, excursion_sieve, above = check_membership(
+                matrix[start:start + BLOCK_SIZE], low, high, curve_matrix.grid, tolerance
+            )
+            yield [
+                (name, int(sample_id), int(is_in), round(float(excursion), 4),
+                 None if is_in else float(sieve), None if is_in else ('above' if is_above else 'below'))
+                for sample_id, is_in, excursion, sieve, is_above
+                in zip(block_ids, inside, max_excursion, excursion_sieve, above)
+            ]
+
+
+def check_envelopes(curve_matrix, envelopes=None, tolerance=0.0, limit=100):
+    """
+    Check every sample against the envelopes with a tolerance in percent passing,
+    without storing anything. Returns, per envelope, the counts inside and outside
+    and the worst limit samples outside.
+    """
+    results = {name: {'inside': 0, 'outside': 0, 'samples_outside': []} for name in list(envelopes or ENVELOPES)}
+    for rows in membership_rows(curve_matrix, None, envelopes, tolerance):
+        for name, sample_id, inside, excursion, sieve, direction in rows:
+            result = results[name]
+            if inside:
+                result['inside'] += 1
+                continue
+            result['outside'] += 1
+            result['samples_outside'].append({'sample_id': sample_id, 'max_excursion': excursion,
+                                              'excursion_sieve': sieve, 'direction': direction})
+    for result in results.values():
+        result['samples_outside'].sort(key=lambda row: -row['max_excursion'])
+        del result['samples_outside'][limit:]
+    return results
+
+
+def update_membership(conn, curve_matrix, sample_ids=None, envelopes=None):
+    """
+    Check the given samples (default: all with a curve) against the given envelopes
+    (default: all) and store the results. Returns the number of rows written.
+    """
+    envelopes = list(envelopes or ENVELOPES)
+    ids, _ = curve_matrix.select(sample_ids)
+    if sample_ids is None:
+        # A full check replaces everything, including rows of samples that lost their curve
+        conn.executemany('DELETE FROM envelope_membership WHERE envelope = ?',
+                         [(name,) for name in envelopes])
+    elif sample_ids:
+        # Samples that no longer have a curve have nothing to check
+        stale = set(sample_ids) - set(ids.tolist())
+        conn.executemany('DELETE FROM envelope_membership WHERE sample_id = ?',
+                         [(sample_id,) for sample_id in stale])
+
+    written = 0
+    for rows in membership_rows(curve_matrix, sample_ids, envelopes):
+        conn.executemany('''
+            INSERT OR REPLACE INTO envelope_membership
+                (envelope, sample_id, inside, max_excursion, excursion_sieve, direction)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        written += len(rows)
+    conn.commit()
+    return written
+
+
+def sync_membership(conn, curve_matrix):
+    """Check the samples in the curve matrix that have no stored result yet."""
+    checked = {row[0] for row in conn.execute(
+        'SELECT sample_id FROM envelope_membership WHERE envelope = ?', (DEFAULT_ENVELOPE,))}
+    ids, _ = curve_matrix.select()
+    missing = [int(sample_id) for sample_id in ids if int(sample_id) not in checked]
+    if missing:
+        update_membership(conn, curve_matrix, missing)
+
+
+def outside_envelope(conn, envelope=DEFAULT_ENVELOPE, limit=100, offset=0):
+    """
+    Samples outside the envelope, worst excursion first. Reads only the main
+    database's membership table, so the samples' names are left to the caller.
+    """
+    rows = conn.execute('''
+        SELECT sample_id, max_excursion, excursion_sieve, direction, checked_at
+        FROM envelope_membership
+        WHERE envelope = ? AND inside = 0
+        ORDER BY max_excursion DESC
+        LIMIT ? OFFSET ?
+    ''', (envelope, limit, offset)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def membership_counts(conn, envelope=DEFAULT_ENVELOPE):
+    """Number of checked samples inside and outside the envelope."""
+    counts = {'inside': 0, 'outside': 0}
+    for inside, count in conn.execute('''
+        SELECT inside, COUNT(*) FROM envelope_membership WHERE envelope = ? GROUP BY inside
+    ''', (envelope,)):
+        counts['inside' if inside else 'outside'] = count
+    return counts
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Background Job Queue
+Runs slow work (workbook imports, batch analyses) on a bounded pool of worker
+threads so that request handlers can return immediately with a job ID.
+
+Job state lives in memory and is read back through the /jobs/<job_id> endpoint.
+Every job also keeps a numbered event log (progress with throughput and ETA,
+partial results, status changes) that /jobs/<job_id>/events streams as
+Server-Sent Events; a client that reconnects passes the last event number it saw
+and continues from there. Once a job finishes its log shrinks to the final event,
+so finished jobs kept for status lookups do not hold on to partial results.
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 2        # Jobs running at the same time
+MAX_PENDING = 16       # Jobs allowed to wait for a free worker
+MAX_FINISHED = 200     # Finished jobs kept around for status lookups
+MAX_EVENTS = 5000      # Events kept per job for resuming streams
+PROGRESS_INTERVAL = 0.5   # Minimum seconds between progress events
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """State and progress of a single background job."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._events = deque(maxlen=MAX_EVENTS)   # (sequence number, event type, data)
+        self._next_event = 1
+        self._last_progress = 0.0
+
+    def update(self, done=None, total=None, message=None):
+        """Record progress; called from inside the running job."""
+        with self._lock:
+            if done is not None:
+                self.done = done
+            if total is not None:
+                self.total = total
+            if message is not None:
+                self.message = message
+            # Progress events are throttled, but a new message or the final count always goes out
+            now = time.time()
+            if message is not None or (self.total and self.done >= self.total) or \
+                    now - self._last_progress >= PROGRESS_INTERVAL:
+                self._last_progress = now
+                self._emit('progress', self._progress())
+
+    def partial(self, results):
+        """Publish results that are already final while the job keeps running."""
+        with self._lock:
+            self._emit('partial', {'done': self.done, 'results': results})
+
+    def set_status(self, status):
+        """Change the job status and publish it (finished/failed events carry the outcome and replace the log)."""
+        with self._lock:
+            self.status = status
+            if status == 'running':
+                self.started_at = time.time()
+                self._emit('status', {'status': status})
+            elif status in ('finished', 'failed'):
+                self.finished_at = time.time()
+                self._events.clear()
+                self._emit(status, {'status': status, 'result': self.result, 'error': self.error,
+                                    'progress': self._progress()})
+
+    def events_since(self, cursor, timeout=None):
+        """
+        Events numbered above cursor, waiting up to timeout seconds for one to arrive.
+        Returns (events, complete) where complete means no more events will follow.
+        Events that have been dropped from the log are skipped.
+        """
+        with self._lock:
+            if not self._has_events_after(cursor) and self.finished_at is None:
+                self._changed.wait_for(lambda: self._has_events_after(cursor) or self.finished_at is not None,
+                                       timeout)
+            events = [event for event in self._events if event[0] > cursor]
+            # The final event is logged together with finished_at, so it is in this batch
+            return events, self.finished_at is not None
+
+    def _has_events_after(self, cursor):
+        return bool(self._events) and self._events[-1][0] > cursor
+
+    def _emit(self, event_type, data):
+        # Caller holds the lock
+        self._events.append((self._next_event, event_type, data))
+        self._next_event += 1
+        self._changed.notify_all()
+
+    def _progress(self):
+        # Caller holds the lock
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        throughput = self.done / elapsed if elapsed > 0 else None
+        eta = None
+        if throughput and self.total:
+            eta = round(max(self.total - self.done, 0) / throughput, 1)
+        return {
+            'done': self.done,
+            'total': self.total,
+            'progress': round(100.0 * self.done / self.total, 1) if self.total else None,
+            'throughput': round(throughput, 2) if throughput else None,
+            'eta_seconds': eta,
+            'elapsed_seconds': round(elapsed, 1),
+            'message': self.message,
+        }
+
+    def to_dict(self):
+        """Return a JSON-serialisable snapshot of the job."""
+        with self._lock:
+            progress = None
+            if self.total:
+                progress = round(100.0 * self.done / self.total, 1)
+            return {
+                'id': self.id,
+                'name': self.name,
+                'status': self.status,
+                'done': self.done,
+                'total': self.total,
+                'progress': progress,
+                'message': self.message,
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class JobQueue:
+    """
+    Bounded background worker pool.
+
+    At most max_workers jobs run at once and at most max_pending more may wait;
+    submitting beyond that raises JobQueueFull instead of growing without limit.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='job-worker')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) to run in the background.
+        Whatever fn returns becomes the job result.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull('Too many jobs are queued, please try again shortly')
+
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Look up a job by ID, or None if it is unknown or has been pruned."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.set_status('running')
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.set_status('finished')
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.set_status('failed')
+        finally:
+            self._slots.release()
+
+    def _prune(self):
+        # Drop the oldest finished jobs once we hold more than MAX_FINISHED
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        if len(finished) > MAX_FINISHED:
+            finished.sort(key=lambda job: job.finished_at)
+            for job in finished[:len(finished) - MAX_FINISHED]:
+                del self._jobs[job.id]
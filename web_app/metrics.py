@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Request and Stage Metrics
+Lightweight timing hooks for the web app, exported at /metrics in the Prometheus
+text format.
+
+- stage(name) times a block of work (a SQLite query, analyze_sample, a matplotlib
+  render, the results write) into the sieve_stage_seconds histogram and into the
+  breakdown of the request or job that is running it
+- timed(name) wraps a function, e.g. the sieve_analysis functions the app calls,
+  so every call is timed the same way
+- trace_queries(conn) counts the statements run on a connection
+- inc(name, **labels) bumps a counter such as plot renders or cache hits
+
+Per-request state is kept in a context variable, so stages recorded by a request
+thread or a background job never mix.
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'sieve_request_seconds': ('histogram', 'Time spent handling HTTP requests by endpoint'),
+    'sieve_stage_seconds': ('histogram', 'Time spent in each stage of request and job handling'),
+    'sieve_requests_total': ('counter', 'HTTP requests by endpoint and status'),
+    'sieve_db_queries_total': ('counter', 'SQLite statements executed'),
+    'sieve_db_write_operations_total': ('counter', 'Operations run by the database writer by result'),
+    'sieve_db_write_transactions_total': ('counter', 'Transactions committed by the database writer'),
+    'sieve_plot_renders_total': ('counter', 'Plots rendered by kind'),
+    'sieve_cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'sieve_slow_requests_total': ('counter', 'Requests slower than the slow-request threshold'),
+    'sieve_spc_alarms_total': ('counter', 'Control chart alarms raised by metric and rule'),
+}
+
+_lock = threading.Lock()
+_histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}     # (name, labels) -> value
+
+# Breakdown of the request or job currently running: {'stages': {name: seconds}, 'queries': n}
+_current = contextvars.ContextVar('sieve_metrics_current', default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Record a duration in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        values[bisect.bisect_left(BUCKETS, seconds)] += 1
+        values[-1] += seconds
+
+
+def inc(name, amount=1, **labels):
+    """Increase a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def start_breakdown():
+    """Start collecting the stages of a request or job in the current context; returns a token."""
+    return _current.set({'stages': {}, 'queries': 0})
+
+
+def finish_breakdown(token):
+    """Stop collecting and return the breakdown started by start_breakdown()."""
+    current = _current.get()
+    _current.reset(token)
+    return current
+
+
+@contextmanager
+def breakdown():
+    """Collect the stages run inside the block; yields the breakdown dict."""
+    token = start_breakdown()
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work as one stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('sieve_stage_seconds', elapsed, stage=name)
+        current = _current.get()
+        if current is not None:
+            current['stages'][name] = current['stages'].get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _count_query(statement):
+    inc('sieve_db_queries_total')
+    current = _current.get()
+    if current is not None:
+        current['queries'] += 1
+
+
+def trace_queries(conn):
+    """Count every statement executed on a SQLite connection (including trigger bodies)."""
+    conn.set_trace_callback(_count_query)
+    return conn
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'histogram':
+            for (name, labels), values in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, values):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                cumulative += values[len(BUCKETS)]
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {values[-1]:.6f}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+        else:
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
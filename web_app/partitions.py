@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Database Partitioning
+With PARTITION_BY set to 'project' or 'year', samples are written to one SQLite file
+per project or per year next to the main database (beach_sand.<key>.db) instead of
+all going into beach_sand.db, so a long import for one project only locks that
+project's file. The main database stays partition 0: existing samples remain where
+they are, and it keeps the catalog of partitions plus the app-wide tables derived
+from samples (curve vectors, envelope membership, derived products).
+
+Sample IDs stay unique across files: partition n numbers its samples from
+n << ID_SHIFT, so the partition holding a sample follows from its ID alone.
+
+Cross-partition reads go through one connection to the main database with the
+partitions ATTACHed and TEMP views named samples, sieve_data, sample_curves,
+analysis_results and psd_fits that UNION ALL them. Temp objects shadow the main
+tables, so existing queries read the partitions unchanged, while writes through
+such a connection fail loudly and have to go to the sample's own partition. Reads
+of given samples attach only the partitions their IDs fall in (id_groups() splits
+longer ID lists into groups one connection can attach). SQLite attaches at most
+SQLITE_LIMIT_ATTACHED (10) databases to a connection, so reads of every partition
+check fits() first; beyond the limit, and for additive aggregates such as the
+summary statistics, they use fan_out() instead: the same function runs on every
+partition in parallel and the caller merges the results.
+
+With PARTITION_BY unset there is a single partition, the main database, and
+nothing is attached.
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMES = ('project', 'year')
+ID_SHIFT = 40            # Sample IDs of partition n start above n << ID_SHIFT
+DEFAULT_KEY = 'default'  # Key of the main database as a partition
+FAN_OUT_WORKERS = 8      # Partitions read at the same time by fan_out()
+
+# Tables kept in every partition and read across them through views
+PARTITIONED_TABLES = ('samples', 'sieve_data', 'sample_curves', 'analysis_results', 'psd_fits')
+
+
+def create_partition_catalog(conn):
+    """Create the catalog of partition files in the main database."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS partitions (
+            id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            filename TEXT NOT NULL,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def partition_slug(value):
+    """A key as it appears in a file name: lower case letters, digits, '-' and '_'."""
+    slug = re.sub(r'[^a-z0-9_-]+', '-', str(value or '').strip().lower()).strip('-')
+    return slug[:64] or DEFAULT_KEY
+
+
+class PartitionRouter:
+    """Picks the database file for writes and opens connections that read across partitions."""
+
+    def __init__(self, main_path, scheme=None):
+        if scheme not in (None,) + SCHEMES:
+            raise ValueError(f"Unknown partitioning scheme '{scheme}'; use one of {', '.join(SCHEMES)}")
+        self.main_path = main_path
+        self.scheme = scheme
+        self.lock = threading.Lock()
+        self._create_tables = None
+        self._paths = {0: main_path}   # partition number -> file path
+        self._numbers = {DEFAULT_KEY: 0}
+        self._columns = {}             # table -> columns selected by the views
+        limits = sqlite3.connect(':memory:')
+        self.attach_limit = limits.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        limits.close()
+
+    @property
+    def enabled(self):
+        return self.scheme is not None
+
+    def __len__(self):
+        return len(self._paths)
+
+    def load(self, conn, create_tables):
+        """
+        Read the catalog from a connection to the main database and bring every
+        partition's schema up to date with create_tables(conn), which is also used
+        to set up new partition files.
+        """
+        self._create_tables = create_tables
+        create_partition_catalog(conn)
+        conn.execute("INSERT OR IGNORE INTO partitions (id, key, filename) VALUES (0, ?, ?)",
+                     (DEFAULT_KEY, os.path.basename(self.main_path)))
+        conn.commit()
+
+        directory = os.path.dirname(self.main_path)
+        with self.lock:
+            for number, key, filename in conn.execute('SELECT id, key, filename FROM partitions'):
+                self._numbers[key] = number
+                if number:
+                    self._paths[number] = os.path.join(directory, filename)
+                    partition = sqlite3.connect(self._paths[number])
+                    create_tables(partition)
+                    partition.commit()
+                    partition.close()
+            self._columns = {table: [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]
+                             for table in PARTITIONED_TABLES}
+
+    def partition_key(self, project=None, date=None):
+        """The partition new samples of a project, or sampled on a date (YYYY-MM-DD), belong to."""
+        if self.scheme == 'project':
+            return partition_slug(project)
+        if self.scheme == 'year':
+            year = str(date)[:4] if date and str(date)[:4].isdigit() else str(datetime.date.today().year)
+            return partition_slug(year)
+        return DEFAULT_KEY
+
+    def path_for_key(self, key):
+        """Database file for writing a partition's samples, created on first use."""
+        if not self.enabled:
+            return self.main_path
+        key = partition_slug(key)
+        with self.lock:
+            number = self._numbers.get(key)
+            if number is not None:
+                return self._paths[number]
+
+            number = max(self._paths) + 1
+            stem, extension = os.path.splitext(os.path.basename(self.main_path))
+            filename = f'{stem}.{key}{extension or ".db"}'
+            path = os.path.join(os.path.dirname(self.main_path), filename)
+
+            partition = sqlite3.connect(path)
+            self._create_tables(partition)
+            # Number this partition's samples from its own ID range
+            partition.execute('''
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT 'samples', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'samples')
+            ''', (number << ID_SHIFT,))
+            partition.commit()
+            partition.close()
+
+            catalog = sqlite3.connect(self.main_path)
+            catalog.execute('INSERT INTO partitions (id, key, filename) VALUES (?, ?, ?)', (number, key, filename))
+            catalog.commit()
+            catalog.close()
+
+            self._paths[number] = path
+            self._numbers[key] = number
+            return path
+
+    def path_for_sample(self, sample_id):
+        """Database file holding a sample (the main database for unknown ranges)."""
+        return self._paths.get(int(sample_id) >> ID_SHIFT, self.main_path)
+
+    def paths(self):
+        """Every partition's file, main database first."""
+        with self.lock:
+            return [self._paths[number] for number in sorted(self._paths)]
+
+    def _attached(self, sample_ids=None):
+        # Partitions other than the main database holding sample_ids (every one for None)
+        if sample_ids is None:
+            return [number for number in sorted(self._paths) if number]
+        return sorted({int(sample_id) >> ID_SHIFT for sample_id in sample_ids} & set(self._paths) - {0})
+
+    def fits(self, sample_ids=None):
+        """Whether attach() can read the given samples, or every partition for None, on one connection."""
+        with self.lock:
+            return len(self._attached(sample_ids)) <= self.attach_limit
+
+    def id_groups(self, sample_ids):
+        """Split sample IDs into lists, in order, whose partitions attach() can read on one connection."""
+        groups = {}
+        for sample_id in sample_ids:
+            groups.setdefault(int(sample_id) >> ID_SHIFT, []).append(sample_id)
+        numbers = sorted(groups)
+        # The main database costs no ATTACH, so its samples join the first group
+        first = 1 if numbers and numbers[0] == 0 else 0
+        chunks = [numbers[:first + self.attach_limit]]
+        chunks += [numbers[start:start + self.attach_limit]
+                   for start in range(first + self.attach_limit, len(numbers), self.attach_limit)]
+        return [[sample_id for number in chunk for sample_id in groups[number]] for chunk in chunks if chunk]
+
+    def attach(self, conn, sample_ids=None):
+        """
+        Make a connection to the main database read the partitions holding sample_ids,
+        or every partition for None: ATTACH those files and shadow the partitioned
+        tables with UNION ALL views. Check fits() first; more partitions than a
+        connection can attach raise ValueError.
+        """
+        with self.lock:
+            others = [(number, self._paths[number]) for number in self._attached(sample_ids)]
+            columns = dict(self._columns)
+        if not others:
+            return conn
+
+        if len(others) > self.attach_limit:
+            raise ValueError(f'{len(others) + 1} partitions exceed the {self.attach_limit + 1} databases '
+                             'SQLite can join in one connection; use fan_out()')
+        for number, path in others:
+            conn.execute(f'ATTACH DATABASE ? AS p{number}', (path,))
+
+        schemas = ['main'] + [f'p{number}' for number, _ in others]
+        for table in PARTITIONED_TABLES:
+            select = ', '.join(columns[table])
+            union = ' UNION ALL '.join(f'SELECT {select} FROM {schema}.{table}' for schema in schemas)
+            conn.execute(f'CREATE TEMP VIEW {table} AS {union}')
+        return conn
+
+    def fan_out(self, function):
+        """
+        Call function(conn) with a connection to each partition, in parallel, and
+        return the results in partition order.
+        """
+        def run(path):
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                return function(conn)
+            finally:
+                conn.close()
+
+        paths = self.paths()
+        if len(paths) == 1:
+            return [run(paths[0])]
+        with ThreadPoolExecutor(max_workers=min(len(paths), FAN_OUT_WORKERS)) as pool:
+            return list(pool.map(run, paths))
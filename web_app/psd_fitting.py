@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+Parametric Size Distributions
+Fits log-normal, Rosin-Rammler and Gates-Gaudin-Schuhmann models to gradation
+curves, so each curve can be stored, compared and extrapolated (below the finest
+sieve, into the 0.063 mm and pan region) as a model name and two parameters.
+
+Every model has a scale (a size in mm) and a shape, with P the fraction passing d:
+- lognormal: P = Phi(ln(d / d50) / sigma); scale d50, shape sigma
+- rosin_rammler: P = 1 - exp(-(d / d63.2)^n); scale d63.2, shape n
+- ggs: P = min(1, (d / dmax)^m); scale dmax, shape m
+
+Fitting is Levenberg-Marquardt least squares on percent passing, run on thousands
+of curves at once: each iteration is a few array operations over curves x sieves,
+and every curve keeps its own damping and stops on its own. Parameters are fitted
+as logarithms so they stay positive, and start from values solved from the
+interpolated D-values, so most curves converge in a few iterations.
+"""
+
+import numpy as np
+from scipy.special import ndtr
+
+from sieve_analysis import pad_curves, fit_curves, evaluate_diameters
+
+MODELS = ('lognormal', 'rosin_rammler', 'ggs')
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-10   # Relative drop in squared error below which a curve has converged
+STEP = 1e-6         # Finite-difference step of the Jacobian, in log parameters
+GGS_STARTS = 8      # Most sieves a ggs fit is also started from (see ggs_starts())
+
+# Sizes the fitted curves are reported at, down to clay sizes (Wentworth classes)
+CURVE_SIZES = (0.002, 0.004, 0.008, 0.016, 0.032, 0.063, 0.125, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+_Z75 = 0.6744897501960817   # Standard normal quantile of 75 %
+
+
+def create_fit_tables(conn):
+    """Create the fitted distributions table and the trigger that drops a deleted sample's fits."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS psd_fits (
+            sample_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            scale REAL,
+            shape REAL,
+            rmse REAL,
+            r2 REAL,
+            converged INTEGER NOT NULL DEFAULT 0,
+            date_fitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (sample_id, model),
+            FOREIGN KEY (sample_id) REFERENCES samples (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS psd_fits_sample_delete AFTER DELETE ON samples
+        BEGIN
+            DELETE FROM psd_fits WHERE sample_id = OLD.id;
+        END
+    ''')
+
+
+def percent_passing(model, scale, shape, sizes):
+    """Percent passing of a fitted model at the given sizes (broadcasting like numpy)."""
+    with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+        ratio = np.asarray(sizes, dtype=float) / scale
+        if model == 'lognormal':
+            return 100 * ndtr(np.log(ratio) / shape)
+        if model == 'rosin_rammler':
+            return 100 * -np.expm1(-ratio ** shape)
+        if model == 'ggs':
+            return 100 * np.minimum(1.0, ratio ** shape)
+    raise ValueError(f"Unknown model '{model}'; use one of {', '.join(MODELS)}")
+
+
+def initial_parameters(model, d):
+    """
+    Starting scale and shape solved from D-values (a dict of arrays d10 ... d75),
+    falling back to a unit shape where the D-values don't pin them down.
+    """
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if model == 'lognormal':
+            scale = d['d50']
+            shape = np.log(d['d75'] / d['d25']) / (2 * _Z75)
+        elif model == 'rosin_rammler':
+            shape = (np.log(-np.log(0.4)) - np.log(-np.log(0.9))) / np.log(d['d60'] / d['d10'])
+            scale = d['d60'] / (-np.log(0.4)) ** (1 / shape)
+        else:
+            shape = np.log(0.6 / 0.1) / np.log(d['d60'] / d['d10'])
+            scale = d['d60'] / 0.6 ** (1 / shape)
+    shape = np.where(np.isfinite(shape) & (shape > 0), shape, 1.0)
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, np.where(d['d50'] > 0, d['d50'], 1.0))
+    return scale, shape
+
+
+def ggs_starts(sizes, passing, d):
+    """
+    Extra starting points for ggs, with dmax just above each sieve of the upper half
+    of the curve (50 to 100 % passing) and well above the coarsest one. Readings
+    above dmax sit on the flat top of the model, where the fit cannot see that
+    raising dmax would improve them, so a fit that starts with dmax too low stalls
+    at the first such reading.
+    """
+    upper = (sizes > 0) & (passing >= 50) & (passing < 100)
+    # Candidate sieves left-aligned, finest first, at most GGS_STARTS of them
+    order = np.argsort(np.where(upper, sizes, np.inf), axis=1, kind='stable')[:, :GGS_STARTS]
+    candidates = np.where(np.take_along_axis(upper, order, axis=1), np.take_along_axis(sizes, order, axis=1), np.nan)
+    top = np.fmax.reduce(np.where((sizes > 0) & (passing < 100), sizes, np.nan), axis=1)
+    starts = []
+    for scale in [candidates[:, i] * 1.001 for i in range(candidates.shape[1])] + [top * 3]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shape = np.log(0.5) / np.log(d['d50'] / scale)
+        usable = np.isfinite(scale) & np.isfinite(shape) & (shape > 0)
+        starts.append((np.where(usable, scale, np.nan), np.where(usable, shape, np.nan)))
+    return starts
+
+
+def _least_squares(model, x, y, valid, theta):
+    """
+    Levenberg-Marquardt on every row at once from log parameters theta (rows x 2).
+    Returns the fitted theta, squared errors, converged flags and iteration counts.
+    """
+    def residuals(theta, rows):
+        # Fitted minus measured percent passing of the given rows, 0 at padding
+        fitted = percent_passing(model, np.exp(theta[:, :1]), np.exp(theta[:, 1:]), x[rows])
+        return np.where(valid[rows], fitted - y[rows], 0.0)
+
+    r = residuals(theta, slice(None))
+    sse = (r ** 2).sum(axis=1)
+    damping = np.full(len(theta), 1e-3)
+    active = (valid.sum(axis=1) >= 2) & np.isfinite(sse)
+    converged = np.zeros(len(theta), dtype=bool)
+    iterations = np.zeros(len(theta), dtype=int)
+
+    for _ in range(MAX_ITERATIONS):
+        if not active.any():
+            break
+        rows = np.flatnonzero(active)
+        t, rr = theta[rows], r[rows]
+
+        # Jacobian by forward differences, then the damped 2x2 normal equations solved in closed form
+        j0 = (residuals(t + [STEP, 0.0], rows) - rr) / STEP
+        j1 = (residuals(t + [0.0, STEP], rows) - rr) / STEP
+        a, b, c = (j0 * j0).sum(axis=1), (j0 * j1).sum(axis=1), (j1 * j1).sum(axis=1)
+        g0, g1 = (j0 * rr).sum(axis=1), (j1 * rr).sum(axis=1)
+        lam = damping[rows]
+        a, c = a * (1 + lam) + 1e-12, c * (1 + lam) + 1e-12
+        det = a * c - b * b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.column_stack([-(c * g0 - b * g1) / det, -(a * g1 - b * g0) / det])
+
+        candidate = t + np.nan_to_num(step)
+        new_r = residuals(candidate, rows)
+        new_sse = (new_r ** 2).sum(axis=1)
+        better = new_sse < sse[rows]   # False for NaN
+
+        accepted = rows[better]
+        theta[accepted] = candidate[better]
+        r[accepted] = new_r[better]
+        done = better & (sse[rows] - new_sse <= TOLERANCE * (sse[rows] + 1e-12))
+        sse[accepted] = new_sse[better]
+        damping[rows] = np.where(better, lam * 0.3, lam * 10)
+        iterations[rows] += 1
+
+        # A row whose damping has blown up cannot improve further: it sits at a minimum
+        stuck = damping[rows] > 1e10
+        converged[rows[done | stuck]] = True
+        active[rows[done | stuck]] = False
+    return theta, sse, converged, iterations
+
+
+def fit_model(model, sizes, passing, d):
+    """
+    Fit one model to every row of the padded arrays (NaN-padded sizes in mm and
+    percent passing); readings at size 0 (the pan) are left out. d holds the
+    rows' D-values for the starting point. Returns a dict of arrays: scale, shape,
+    rmse (percent passing), r2, converged and iterations; rows with fewer than two
+    usable readings get NaN parameters.
+    """
+    valid = (sizes > 0) & np.isfinite(passing)
+    points = valid.sum(axis=1)
+    x = np.where(valid, sizes, 1.0)
+    y = np.where(valid, passing, 0.0)
+
+    # Every start is fitted as its own block of rows; each curve keeps its best fit
+    starts = [initial_parameters(model, d)]
+    if model == 'ggs':
+        starts += ggs_starts(sizes, passing, d)
+    theta = np.log(np.concatenate([np.column_stack(start) for start in starts]))
+    copies = len(starts)
+    theta, sse, converged, iterations = _least_squares(
+        model, np.tile(x, (copies, 1)), np.tile(y, (copies, 1)), np.tile(valid, (copies, 1)), theta)
+    rows = np.arange(len(sizes))
+    best = np.argmin(np.where(np.isfinite(sse), sse, np.inf).reshape(copies, -1), axis=0) * len(sizes) + rows
+    theta, sse, converged = theta[best], sse[best], converged[best]
+    iterations = iterations.reshape(copies, -1).sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, passing, 0.0).sum(axis=1) / points
+        sst = (np.where(valid, passing - mean[:, None], 0.0) ** 2).sum(axis=1)
+        rmse = np.sqrt(sse / points)
+        r2 = np.where(sst > 0, 1 - sse / sst, np.nan)
+
+    usable = points >= 2
+    return {
+        'scale': np.where(usable, np.exp(theta[:, 0]), np.nan),
+        'shape': np.where(usable, np.exp(theta[:, 1]), np.nan),
+        'rmse': np.where(usable, rmse, np.nan),
+        'r2': np.where(usable, r2, np.nan),
+        'converged': converged & usable,
+        'iterations': iterations,
+    }
+
+
+def fit_distributions(curves, models=MODELS, d_values=None):
+    """
+    Fit every model to every curve, a list of (sieve_sizes, percent_passing) pairs.
+
+    d_values, a dict of arrays d10, d25, d50, d60 and d75 (one value per curve, as
+    analyze_samples_batch() gives them), warm-starts the fits; without it they are
+    interpolated here. Returns {model: fit_model() result}.
+    """
+    sizes, passing = pad_curves(curves)
+    if d_values is None:
+        percents = (10, 25, 50, 60, 75)
+        diameters = evaluate_diameters(fit_curves(sizes, passing), percents)
+        d_values = {f'd{percent}': diameters[:, i] for i, percent in enumerate(percents)}
+    d_values = {key: np.asarray(values, dtype=float) for key, values in d_values.items()}
+    return {model: fit_model(model, sizes, passing, d_values) for model in models}
+
+
+def describe_fits(fits, row, sizes=CURVE_SIZES):
+    """
+    One curve's fits as JSON-ready dicts, best (lowest RMSE) first, each with its
+    fitted percent passing at sizes.
+    """
+    described = []
+    for model, fit in fits.items():
+        scale, shape = fit['scale'][row], fit['shape'][row]
+        if not np.isfinite(scale) or not np.isfinite(shape):
+            continue
+        described.append({
+            'model': model,
+            'scale': float(scale),
+            'shape': float(shape),
+            'rmse': float(fit['rmse'][row]),
+            'r2': float(fit['r2'][row]) if np.isfinite(fit['r2'][row]) else None,
+            'converged': bool(fit['converged'][row]),
+            'curve': {'sizes': list(sizes),
+                      'percent_passing': [round(float(value), 4)
+                                          for value in percent_passing(model, scale, shape, sizes)]},
+        })
+    described.sort(key=lambda fit: fit['rmse'])
+    return described
+
+
+def save_fits(conn, sample_ids, fits):
+    """
+    Store the fits of curves, in the order of sample_ids, replacing earlier fits of
+    the same models; a model that no longer fits a curve loses its old row. No commit.
+    """
+    conn.executemany('DELETE FROM psd_fits WHERE sample_id = ? AND model = ?',
+                     ((sample_id, model) for model in fits for sample_id in sample_ids))
+    rows = []
+    for model, fit in fits.items():
+        for i, sample_id in enumerate(sample_ids):
+            if np.isfinite(fit['scale'][i]):
+                rows.append((sample_id, model, float(fit['scale'][i]), float(fit['shape'][i]),
+                             float(fit['rmse'][i]),
+                             float(fit['r2'][i]) if np.isfinite(fit['r2'][i]) else None,
+                             int(fit['converged'][i])))
+    conn.executemany('''
+        INSERT OR REPLACE INTO psd_fits (sample_id, model, scale, shape, rmse, r2, converged)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+Chart Rendering
+Draws the web app's charts on Figure objects created per call instead of through
+pyplot's global figure state, so request threads can render at the same time.
+The plotting functions in sieve_analysis.py follow the same rule.
+"""
+
+from matplotlib.figure import Figure
+
+MARKERS = ['o', 's', '^', 'd', 'v', '<', '>', 'p', '*']
+LINESTYLES = ['-', '--', '-.', ':']
+
+
+def render_comparison(curves, filename):
+    """
+    Plot several gradation curves on one chart and save it.
+
+    curves is a list of (label, sieve sizes, percent passing) tuples.
+    """
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+
+    # Different marker and line style for each sample
+    for i, (label, sieve_sizes, percent_passing) in enumerate(curves):
+        ax.semilogx(sieve_sizes, percent_passing, marker=MARKERS[i % len(MARKERS)],
+                    linestyle=LINESTYLES[i % len(LINESTYLES)], label=label)
+
+    ax.set_xlabel('Particle Size (mm)')
+    ax.set_ylabel('Percent Passing (%)')
+    ax.set_title('Particle Size Distribution Comparison')
+    ax.grid(True, which="both", ls="-")
+    ax.legend()
+
+    fig.savefig(filename)
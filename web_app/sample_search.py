@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Sample Search
+Full-text search over sample names, locations and types with SQLite FTS5, so
+finding "Sample-BS 001" or a beach name never scans the samples table.
+
+Two external-content FTS5 indexes are kept in step with samples by triggers; both
+refer to the samples rows instead of copying them:
+- sample_search (unicode61 tokens, with prefix indexes): word and prefix matches,
+  so "bs 00" finds "Sample-BS 001" and "north" finds "North Beach"
+- sample_search_trigram (trigram tokens): matches anywhere inside a word, so
+  "1234" finds "Sample-BS 001234"
+
+Fuzzy matching works on the index vocabulary (sample_search_vocab) rather than on
+the rows: a misspelt word is replaced by the closest indexed words sharing its
+first or second letter, so "Nroth Baech" still finds "North Beach" at the cost of
+a few small vocabulary lookups.
+"""
+
+import difflib
+import re
+
+COLUMNS = ('name', 'location', 'type')
+FUZZY_TERMS = 3      # Indexed words tried in place of a misspelt word
+FUZZY_CUTOFF = 0.7   # Minimum difflib similarity of those words
+RANK_LIMIT = 10000   # Searches matching more samples than this return them in ID order, unranked
+
+
+def create_search_tables(conn):
+    """Create the search indexes and their triggers, building the indexes the first time."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sample_search'"
+    ).fetchone()
+
+    columns = ', '.join(COLUMNS)
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS sample_search USING fts5(
+            {columns}, content='samples', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2", prefix='1 2 3'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS sample_search_trigram USING fts5(
+            {columns}, content='samples', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS sample_search_vocab USING fts5vocab(sample_search, 'row')")
+
+    new_values = ', '.join(f'NEW.{column}' for column in COLUMNS)
+    old_values = ', '.join(f'OLD.{column}' for column in COLUMNS)
+    insert = '\n'.join(f'INSERT INTO {table} (rowid, {columns}) VALUES (NEW.id, {new_values});'
+                       for table in ('sample_search', 'sample_search_trigram'))
+    delete = '\n'.join(f"INSERT INTO {table} ({table}, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});"
+                       for table in ('sample_search', 'sample_search_trigram'))
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sample_search_insert AFTER INSERT ON samples
+        BEGIN
+            {insert}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sample_search_delete AFTER DELETE ON samples
+        BEGIN
+            {delete}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS sample_search_update AFTER UPDATE OF {columns} ON samples
+        BEGIN
+            {delete}
+            {insert}
+        END
+    ''')
+
+    if not exists:
+        rebuild_search(conn)
+
+
+def rebuild_search(conn):
+    """Rebuild both indexes from the samples table."""
+    conn.execute("INSERT INTO sample_search (sample_search) VALUES ('rebuild')")
+    conn.execute("INSERT INTO sample_search_trigram (sample_search_trigram) VALUES ('rebuild')")
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def prefix_query(text):
+    """FTS5 query matching every word of text as a prefix, or None if text has no words."""
+    return ' AND '.join(_quote(word) + '*' for word in _words(text)) or None
+
+
+def substring_query(text):
+    """FTS5 trigram query matching text anywhere in a column, or None if shorter than a trigram."""
+    text = ' '.join(text.split())
+    return _quote(text) if len(text) >= 3 else None
+
+
+def similar_terms(conn, word):
+    """Indexed words closest to a word, among those starting with its first or second letter."""
+    candidates = set()
+    for letter in dict.fromkeys(word[:2]):
+        candidates.update(row[0] for row in conn.execute(
+            'SELECT term FROM sample_search_vocab WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?',
+            (letter, letter + '\uffff', len(word) - 2, len(word) + 2)))
+    return difflib.get_close_matches(word, candidates, n=FUZZY_TERMS, cutoff=FUZZY_CUTOFF)
+
+
+def fuzzy_query(conn, text):
+    """
+    FTS5 query in which every word that is not the start of an indexed word is
+    replaced by the closest indexed words (or left out if there are none). None
+    when no word could be corrected.
+    """
+    parts = []
+    corrected = False
+    for word in _words(text):
+        known = conn.execute('SELECT 1 FROM sample_search_vocab WHERE term >= ? AND term < ? LIMIT 1',
+                             (word, word + '\uffff')).fetchone()
+        if known:
+            parts.append(_quote(word) + '*')
+            continue
+        alternatives = similar_terms(conn, word) if len(word) >= 3 else []
+        if alternatives:
+            corrected = True
+            parts.append('(' + ' OR '.join(_quote(term) for term in alternatives) + ')')
+    return ' AND '.join(parts) if corrected else None
+
+
+def search_samples(conn, text, limit=20, fuzzy=True):
+    """
+    Samples matching a search text, best first, as a list of dicts with the sample's
+    id, name, location and type, how it matched ('prefix', 'substring' or 'fuzzy')
+    and its score (FTS5 bm25 rank; lower is better). Each kind of match is only
+    looked up while the ones before it gave fewer than limit results.
+
+    Ranking means scoring every match, so a search matching more than RANK_LIMIT
+    samples (say "beach" over a whole campaign) lists them in ID order instead.
+    """
+    results = []
+    seen = set()
+
+    def collect(table, query, match):
+        broad = conn.execute(f'SELECT count(*) FROM (SELECT rowid FROM {table} WHERE {table} MATCH ? LIMIT ?)',
+                             (query, RANK_LIMIT + 1)).fetchone()[0] > RANK_LIMIT
+        order = f'{table}.rowid' if broad else f'{table}.rank'
+        rows = conn.execute(f'''
+            SELECT s.id, s.name, s.location, s.type, {table}.rank AS score
+            FROM {table}
+            JOIN samples s ON s.id = {table}.rowid
+            WHERE {table} MATCH ?
+            ORDER BY {order}
+            LIMIT ?
+        ''', (query, limit + len(seen))).fetchall()
+        for row in rows:
+            if row[0] not in seen and len(results) < limit:
+                seen.add(row[0])
+                results.append({'sample_id': row[0], 'name': row[1], 'location': row[2], 'type': row[3],
+                                'match': match, 'score': round(row[4], 4)})
+
+    query = prefix_query(text)
+    if query:
+        collect('sample_search', query, 'prefix')
+    query = substring_query(text)
+    if query and len(results) < limit:
+        collect('sample_search_trigram', query, 'substring')
+    if fuzzy and len(results) < limit:
+        query = fuzzy_query(conn, text)
+        if query:
+            collect('sample_search', query, 'fuzzy')
+    return results
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Statistical Process Control
+Watches D50, Cu and fines content of production samples as they are analyzed, per
+stream (the sample's location, i.e. the production line or site), with three
+control charts:
+- Shewhart: a single value more than SHEWHART_L sigma from the centre line
+- EWMA: the exponentially weighted mean drifting outside its control limits
+- CUSUM: the upper or lower cumulative sum exceeding CUSUM_H sigma (with an
+  allowance of CUSUM_K sigma), which catches small sustained shifts
+
+The first BASELINE_SAMPLES values of a stream estimate its centre line and sigma
+(Welford's running mean and variance); charting starts after that. Every new
+analysis updates the running statistics in constant time: one state row per stream
+and metric holds everything the next update needs, so restarting the app resumes
+where it left off instead of replaying the history.
+
+Each value is also kept in spc_points for drawing the charts, and alarms are
+stored in spc_alarms: raised when a chart goes out of control, cleared when it is
+back within its limits. A stream that was corrected can be reset to take a new
+baseline. A sample is charted once, when it is first analyzed (spc_charted
+records it, and survives resets); re-analyses do not move the charts, not even
+after a reset, and deleting a sample leaves the process history as it was.
+"""
+
+import math
+
+METRICS = ('d50', 'cu', 'fines')
+BASELINE_SAMPLES = 20   # Values that set a stream's centre line and sigma
+SHEWHART_L = 3.0        # Shewhart limits, in sigma
+EWMA_LAMBDA = 0.2       # Weight of the newest value in the EWMA
+EWMA_L = 3.0            # EWMA limits, in sigma of the EWMA
+CUSUM_K = 0.5           # CUSUM allowance, in sigma
+CUSUM_H = 5.0           # CUSUM decision interval, in sigma
+MIN_SIGMA = 1e-9        # Stands in for a zero sigma (a perfectly constant baseline)
+
+RULES = ('shewhart', 'ewma', 'cusum_high', 'cusum_low')
+DEFAULT_STREAM = 'unassigned'   # Stream of samples without a location
+
+
+def create_spc_tables(conn):
+    """Create the chart state, points, charted samples and alarm tables."""
+    has_charted = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'spc_charted'").fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spc_state (
+            stream TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            mean REAL NOT NULL DEFAULT 0,
+            m2 REAL NOT NULL DEFAULT 0,
+            center REAL,
+            sigma REAL,
+            ewma REAL,
+            cusum_high REAL NOT NULL DEFAULT 0,
+            cusum_low REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (stream, metric)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spc_points (
+            stream TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            sample_id INTEGER NOT NULL,
+            value REAL NOT NULL,
+            ewma REAL,
+            cusum_high REAL,
+            cusum_low REAL,
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (stream, metric, seq),
+            UNIQUE (stream, metric, sample_id)
+        )
+    ''')
+    # Every sample charted on a stream's chart, kept when the stream is reset
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spc_charted (
+            stream TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            sample_id INTEGER NOT NULL,
+            PRIMARY KEY (stream, metric, sample_id)
+        )
+    ''')
+    if not has_charted:
+        conn.execute('INSERT OR IGNORE INTO spc_charted SELECT stream, metric, sample_id FROM spc_points')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spc_alarms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stream TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            sample_id INTEGER NOT NULL,
+            value REAL NOT NULL,
+            statistic REAL NOT NULL,
+            control_limit REAL NOT NULL,
+            raised_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            cleared_at TIMESTAMP
+        )
+    ''')
+    # At most one open alarm per chart; also the lookup done on every update
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_spc_alarms_open
+        ON spc_alarms (stream, metric, rule) WHERE cleared_at IS NULL
+    ''')
+
+
+def stream_name(location):
+    """The stream a sample belongs to."""
+    return (location or '').strip() or DEFAULT_STREAM
+
+
+def ewma_limit(sigma, i):
+    """Half-width of the EWMA control limits i values after the baseline."""
+    factor = EWMA_LAMBDA / (2 - EWMA_LAMBDA) * (1 - (1 - EWMA_LAMBDA) ** (2 * i))
+    return EWMA_L * sigma * math.sqrt(factor)
+
+
+def chart_statistics(state, value):
+    """
+    The state of one chart after a new value, plus the rules it violates as
+    {rule: (statistic, control limit)}. state is a dict of spc_state columns.
+    """
+    state = dict(state)
+    state['n'] += 1
+    violations = {}
+
+    if state['center'] is None:
+        # Still taking the baseline: Welford's update of the mean and variance
+        delta = value - state['mean']
+        state['mean'] += delta / state['n']
+        state['m2'] += delta * (value - state['mean'])
+        if state['n'] == BASELINE_SAMPLES:
+            state['center'] = state['mean']
+            state['sigma'] = max(math.sqrt(state['m2'] / (state['n'] - 1)), MIN_SIGMA)
+            state['ewma'] = state['center']
+        return state, violations
+
+    center, sigma = state['center'], state['sigma']
+    i = state['n'] - BASELINE_SAMPLES
+    state['ewma'] = EWMA_LAMBDA * value + (1 - EWMA_LAMBDA) * state['ewma']
+    state['cusum_high'] = max(0.0, state['cusum_high'] + value - center - CUSUM_K * sigma)
+    state['cusum_low'] = max(0.0, state['cusum_low'] + center - value - CUSUM_K * sigma)
+
+    if abs(value - center) > SHEWHART_L * sigma:
+        violations['shewhart'] = (value, center + math.copysign(SHEWHART_L * sigma, value - center))
+    limit = ewma_limit(sigma, i)
+    if abs(state['ewma'] - center) > limit:
+        violations['ewma'] = (state['ewma'], center + math.copysign(limit, state['ewma'] - center))
+    if state['cusum_high'] > CUSUM_H * sigma:
+        violations['cusum_high'] = (state['cusum_high'], CUSUM_H * sigma)
+    if state['cusum_low'] > CUSUM_H * sigma:
+        violations['cusum_low'] = (state['cusum_low'], CUSUM_H * sigma)
+    return state, violations
+
+
+def observe(conn, location, sample_id, values):
+    """
+    Add a newly analyzed sample's values ({metric: value}) to its stream's charts and
+    raise or clear alarms, without committing. Samples already charted are ignored.
+    Returns the alarms raised, as dicts.
+    """
+    stream = stream_name(location)
+    raised = []
+    for metric in METRICS:
+        value = values.get(metric)
+        if value is None or not math.isfinite(value):
+            continue
+        # Writing first takes the database's write lock, so concurrent updates of a chart queue up
+        conn.execute('INSERT OR IGNORE INTO spc_state (stream, metric) VALUES (?, ?)', (stream, metric))
+        charted = conn.execute('INSERT OR IGNORE INTO spc_charted (stream, metric, sample_id) VALUES (?, ?, ?)',
+                               (stream, metric, sample_id))
+        if not charted.rowcount:
+            continue
+        row = conn.execute('''
+            SELECT n, mean, m2, center, sigma, ewma, cusum_high, cusum_low
+            FROM spc_state WHERE stream = ? AND metric = ?
+        ''', (stream, metric)).fetchone()
+        state = dict(zip(('n', 'mean', 'm2', 'center', 'sigma', 'ewma', 'cusum_high', 'cusum_low'), row))
+        charting = state['center'] is not None
+        state, violations = chart_statistics(state, value)
+
+        conn.execute('''
+            UPDATE spc_state
+            SET n = ?, mean = ?, m2 = ?, center = ?, sigma = ?, ewma = ?, cusum_high = ?, cusum_low = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE stream = ? AND metric = ?
+        ''', (state['n'], state['mean'], state['m2'], state['center'], state['sigma'], state['ewma'],
+              state['cusum_high'], state['cusum_low'], stream, metric))
+        conn.execute('''
+            INSERT INTO spc_points (stream, metric, seq, sample_id, value, ewma, cusum_high, cusum_low)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (stream, metric, state['n'], sample_id, value,
+              state['ewma'] if charting else None,
+              state['cusum_high'] if charting else None,
+              state['cusum_low'] if charting else None))
+        if not charting:
+            continue
+
+        open_rules = {rule for (rule,) in conn.execute(
+            'SELECT rule FROM spc_alarms WHERE stream = ? AND metric = ? AND cleared_at IS NULL', (stream, metric))}
+        for rule, (statistic, control_limit) in violations.items():
+            if rule not in open_rules:
+                conn.execute('''
+                    INSERT INTO spc_alarms (stream, metric, rule, sample_id, value, statistic, control_limit)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (stream, metric, rule, sample_id, value, statistic, control_limit))
+                raised.append({'stream': stream, 'metric': metric, 'rule': rule, 'sample_id': sample_id,
+                               'value': value, 'statistic': statistic, 'control_limit': control_limit})
+        cleared = open_rules - set(violations)
+        conn.executemany('''
+            UPDATE spc_alarms SET cleared_at = CURRENT_TIMESTAMP
+            WHERE stream = ? AND metric = ? AND rule = ? AND cleared_at IS NULL
+        ''', ((stream, metric, rule) for rule in cleared))
+    return raised
+
+
+def reset_stream(conn, stream):
+    """
+    Start a new baseline for a stream (after the process was corrected), closing its
+    open alarms. Samples charted before the reset are not charted again.
+    """
+    conn.execute('''
+        UPDATE spc_state SET n = 0, mean = 0, m2 = 0, center = NULL, sigma = NULL, ewma = NULL,
+                             cusum_high = 0, cusum_low = 0, updated_at = CURRENT_TIMESTAMP
+        WHERE stream = ?
+    ''', (stream,))
+    conn.execute('DELETE FROM spc_points WHERE stream = ?', (stream,))
+    conn.execute('UPDATE spc_alarms SET cleared_at = CURRENT_TIMESTAMP WHERE stream = ? AND cleared_at IS NULL',
+                 (stream,))
+
+
+def list_streams(conn):
+    """Every stream with, per metric, its baseline and the number of open alarms."""
+    streams = {}
+    for row in conn.execute('''
+            SELECT st.stream, st.metric, st.n, st.center, st.sigma,
+                   (SELECT count(*) FROM spc_alarms a
+                    WHERE a.stream = st.stream AND a.metric = st.metric AND a.cleared_at IS NULL) AS open_alarms
+            FROM spc_state st
+            ORDER BY st.stream, st.metric
+        '''):
+        streams.setdefault(row[0], {})[row[1]] = {
+            'samples': row[2], 'center': row[3], 'sigma': row[4],
+            'baseline_complete': row[3] is not None, 'open_alarms': row[5]}
+    return [{'stream': stream, 'metrics': metrics} for stream, metrics in streams.items()]
+
+
+def list_alarms(conn, stream=None, metric=None, open_only=True, limit=100):
+    """Alarms, newest first, optionally only one stream's or metric's and only those still open."""
+    conditions = ['1 = 1']
+    params = []
+    for column, value in (('stream', stream), ('metric', metric)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if open_only:
+        conditions.append('cleared_at IS NULL')
+    rows = conn.execute(f'''
+        SELECT id, stream, metric, rule, sample_id, value, statistic, control_limit, raised_at, cleared_at
+        FROM spc_alarms WHERE {' AND '.join(conditions)}
+        ORDER BY id DESC LIMIT ?
+    ''', params + [limit])
+    columns = ('id', 'stream', 'metric', 'rule', 'sample_id', 'value', 'statistic', 'control_limit',
+               'raised_at', 'cleared_at')
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def chart_data(conn, stream, metric, limit=200):
+    """
+    The latest points of one chart with its centre line and control limits, or None
+    if the stream has no values for the metric.
+    """
+    row = conn.execute('SELECT n, center, sigma FROM spc_state WHERE stream = ? AND metric = ?',
+                       (stream, metric)).fetchone()
+    if row is None:
+        return None
+    n, center, sigma = row
+
+    points = []
+    for seq, sample_id, value, ewma, cusum_high, cusum_low, date_added in reversed(conn.execute('''
+            SELECT seq, sample_id, value, ewma, cusum_high, cusum_low, date_added
+            FROM spc_points WHERE stream = ? AND metric = ?
+            ORDER BY seq DESC LIMIT ?
+        ''', (stream, metric, limit)).fetchall()):
+        point = {'seq': seq, 'sample_id': sample_id, 'value': value, 'date_added': date_added}
+        if ewma is not None:
+            limit_width = ewma_limit(sigma, seq - BASELINE_SAMPLES)
+            point.update(ewma=ewma, ewma_ucl=center + limit_width, ewma_lcl=center - limit_width,
+                         cusum_high=cusum_high, cusum_low=cusum_low)
+        points.append(point)
+
+    chart = {
+        'stream': stream,
+        'metric': metric,
+        'samples': n,
+        'baseline': {'samples': BASELINE_SAMPLES, 'complete': center is not None, 'center': center, 'sigma': sigma},
+        'points': points,
+        'alarms': list_alarms(conn, stream, metric, open_only=False, limit=limit),
+    }
+    if center is not None:
+        chart['limits'] = {
+            'shewhart': {'center': center, 'ucl': center + SHEWHART_L * sigma, 'lcl': center - SHEWHART_L * sigma},
+            'ewma': {'lambda': EWMA_LAMBDA, 'L': EWMA_L, 'center': center,
+                     'ucl': center + ewma_limit(sigma, math.inf), 'lcl': center - ewma_limit(sigma, math.inf)},
+            'cusum': {'k': CUSUM_K * sigma, 'h': CUSUM_H * sigma},
+        }
+    return chart
@@ -13,17 +13,17 @@ document.addEventListener('DOMContentLoaded', function() {
     const fileInput = document.getElementById('sample_file');
     if (fileInput) {
         fileInput.addEventListener('change', function() {
-            const filePath = this.value;
-            const allowedExtensions = /(\.xlsx|\.xls)$/i;
+            const allowedExtensions = /(\.xlsx|\.xls|\.csv|\.parquet|\.zip)$/i;
+            const files = Array.from(this.files);
             
-            if (!allowedExtensions.exec(filePath)) {
-                alert('Please upload Excel file (.xlsx or .xls)');
+            if (files.some(file => !allowedExtensions.exec(file.name))) {
+                alert('Please upload Excel (.xlsx, .xls), CSV or Parquet files, or a ZIP archive of them');
                 this.value = '';
                 return false;
             }
             
             // Show file name in the input
-            const fileName = this.files[0].name;
+            const fileName = files.length === 1 ? files[0].name : `${files.length} files selected`;
             const fileNameDisplay = document.querySelector('.custom-file-label');
             if (fileNameDisplay) {
                 fileNameDisplay.textContent = fileName;
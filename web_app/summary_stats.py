@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+Materialized Summary Statistics
+Keeps running counts, sums, sums of squares and fixed-bin histograms of the
+analysis results per location and month, so dashboards never scan the samples
+or analysis_results tables.
+
+The summary tables are maintained by SQLite triggers on every insert, update or
+delete of an analysis (and on changes to a sample's location or date), whichever
+code path makes the change. Every row is also counted under the '*' location
+and/or month, so any single-group read, including the overall totals, is a
+primary-key lookup.
+"""
+
+import hashlib
+import math
+
+from sieve_analysis import COMPLIANCE_D50_RANGE, COMPLIANCE_CU_MAX, COMPLIANCE_SO_RANGE, COMPLIANCE_FINES_MAX
+
+ALL = '*'
+
+# Histogram layout per metric: (lowest bin edge, bin width, number of bins).
+# Values outside the range land in the first or last bin.
+METRICS = {
+    'd50': (0.0, 0.05, 40),
+    'cu': (1.0, 0.1, 40),
+    'so': (1.0, 0.05, 40),
+}
+
+# Compliance criteria (those of sieve_analysis) as SQL on the analysis row; a missing
+# value fails its criterion. fines is the percent passing 0.063 mm, as
+# check_criteria_compliance() reads it off the curve.
+COMPLIANCE = {
+    'd50_compliant': f'a.d50 BETWEEN {COMPLIANCE_D50_RANGE[0]} AND {COMPLIANCE_D50_RANGE[1]}',
+    'cu_compliant': f'a.cu < {COMPLIANCE_CU_MAX}',
+    'so_compliant': f'a.so BETWEEN {COMPLIANCE_SO_RANGE[0]} AND {COMPLIANCE_SO_RANGE[1]}',
+    'fines_compliant': f'a.fines < {COMPLIANCE_FINES_MAX}',
+}
+
+# Triggers keeping the summary tables up to date
+TRIGGERS = ('summary_analysis_insert', 'summary_analysis_update_old', 'summary_analysis_update_new',
+            'summary_analysis_delete', 'summary_sample_update_old', 'summary_sample_update_new')
+
+# Each analysis is counted four times: in its own group and in the rollups
+_GROUP_SOURCE = '''
+    FROM analysis_results a
+    LEFT JOIN samples s ON s.id = a.sample_id
+    CROSS JOIN (SELECT 0 AS roll UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3) r
+'''
+_LOCATION = "CASE WHEN r.roll IN (1, 3) THEN '*' ELSE COALESCE(s.location, '') END"
+_MONTH = ("CASE WHEN r.roll IN (2, 3) THEN '*' "
+          "ELSE COALESCE(strftime('%Y-%m', s.date), strftime('%Y-%m', a.date_analyzed), '') END")
+
+
+def _apply_statements(sign, condition):
+    """
+    SQL that adds (sign=1) or removes (sign=-1) the analyses matching condition
+    from every summary table.
+    """
+    compliance_columns = ', '.join(COMPLIANCE)
+    compliance_values = ', '.join(f'{sign} * COALESCE({sql}, 0)' for sql in COMPLIANCE.values())
+    all_compliant = 'COALESCE(' + ' AND '.join(f'({sql})' for sql in COMPLIANCE.values()) + ', 0)'
+    compliance_updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in COMPLIANCE)
+
+    statements = [f'''
+        INSERT INTO summary_groups (location, month, analyses, {compliance_columns}, all_compliant)
+        SELECT {_LOCATION}, {_MONTH}, {sign}, {compliance_values}, {sign} * ({all_compliant})
+        {_GROUP_SOURCE}
+        WHERE {condition}
+        ON CONFLICT (location, month) DO UPDATE SET
+            analyses = analyses + excluded.analyses,
+            {compliance_updates},
+            all_compliant = all_compliant + excluded.all_compliant
+    ''']
+
+    for metric, (low, width, bins) in METRICS.items():
+        statements.append(f'''
+            INSERT INTO summary_metrics (location, month, metric, n, total, total_sq)
+            SELECT {_LOCATION}, {_MONTH}, '{metric}', {sign}, {sign} * a.{metric}, {sign} * a.{metric} * a.{metric}
+            {_GROUP_SOURCE}
+            WHERE {condition} AND a.{metric} IS NOT NULL
+            ON CONFLICT (location, month, metric) DO UPDATE SET
+                n = n + excluded.n,
+                total = total + excluded.total,
+                total_sq = total_sq + excluded.total_sq
+        ''')
+        statements.append(f'''
+            INSERT INTO summary_histograms (location, month, metric, bin, count)
+            SELECT {_LOCATION}, {_MONTH}, '{metric}',
+                   MIN(MAX(CAST((a.{metric} - {low}) / {width} AS INTEGER), 0), {bins - 1}), {sign}
+            {_GROUP_SOURCE}
+            WHERE {condition} AND a.{metric} IS NOT NULL
+            ON CONFLICT (location, month, metric, bin) DO UPDATE SET
+                count = count + excluded.count
+        ''')
+
+    return statements
+
+
+def _trigger(name, timing, sign, condition):
+    body = ';\n'.join(_apply_statements(sign, condition))
+    return f'CREATE TRIGGER IF NOT EXISTS {name} {timing} BEGIN {body}; END'
+
+
+def _triggers():
+    # Updates and deletes take the old values out before the row changes (BEFORE
+    # triggers) so the sample's location and date can still be looked up
+    return [
+        _trigger('summary_analysis_insert', 'AFTER INSERT ON analysis_results', 1, 'a.id = NEW.id'),
+        _trigger('summary_analysis_update_old', 'BEFORE UPDATE ON analysis_results', -1, 'a.id = OLD.id'),
+        _trigger('summary_analysis_update_new', 'AFTER UPDATE ON analysis_results', 1, 'a.id = NEW.id'),
+        _trigger('summary_analysis_delete', 'BEFORE DELETE ON analysis_results', -1, 'a.id = OLD.id'),
+        _trigger('summary_sample_update_old', 'BEFORE UPDATE OF location, date ON samples',
+                 -1, 'a.sample_id = OLD.id'),
+        _trigger('summary_sample_update_new', 'AFTER UPDATE OF location, date ON samples',
+                 1, 'a.sample_id = NEW.id'),
+    ]
+
+
+def create_summary_tables(conn):
+    """
+    Create the summary tables and triggers, backfilling them the first time and
+    again whenever the triggers' SQL has changed since (a criterion or its
+    threshold, or a histogram layout): summary_meta holds a signature of the SQL
+    the stored triggers were created from.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'summary_groups'"
+    ).fetchone()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    triggers = _triggers()
+    signature = hashlib.sha1('\n'.join(triggers).encode()).hexdigest()
+    stored = conn.execute("SELECT value FROM summary_meta WHERE key = 'triggers'").fetchone()
+    stale = bool(exists) and (stored is None or stored[0] != signature)
+    if exists:
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(summary_groups)')}
+        for column in COMPLIANCE:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE summary_groups ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+    if stale:
+        # The triggers count with the old criteria
+        for name in TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+    compliance_columns = ',\n'.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in COMPLIANCE)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS summary_groups (
+            location TEXT NOT NULL,
+            month TEXT NOT NULL,
+            analyses INTEGER NOT NULL DEFAULT 0,
+            {compliance_columns},
+            all_compliant INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (location, month)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_metrics (
+            location TEXT NOT NULL,
+            month TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            total_sq REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (location, month, metric)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS summary_histograms (
+            location TEXT NOT NULL,
+            month TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bin INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (location, month, metric, bin)
+        )
+    ''')
+
+    for trigger in triggers:
+        conn.execute(trigger)
+
+    # Deleting a sample removes its analyses first, while the sample row still exists
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS summary_sample_delete BEFORE DELETE ON samples
+        BEGIN
+            DELETE FROM analysis_results WHERE sample_id = OLD.id;
+        END
+    ''')
+
+    if not exists or stale:
+        rebuild_summary(conn)
+        conn.execute("INSERT OR REPLACE INTO summary_meta (key, value) VALUES ('triggers', ?)", (signature,))
+
+
+def rebuild_summary(conn):
+    """Recompute the summary tables from scratch (a full scan; only for backfills)."""
+    conn.execute('DELETE FROM summary_groups')
+    conn.execute('DELETE FROM summary_metrics')
+    conn.execute('DELETE FROM summary_histograms')
+    for statement in _apply_statements(1, '1'):
+        conn.execute(statement)
+
+
+def get_summary(conn, location=ALL, month=ALL):
+    """
+    Read the statistics for one location and month ('*' for all) without
+    touching the analysis tables.
+    """
+    location = location or ALL
+    month = month or ALL
+    group = conn.execute(
+        'SELECT * FROM summary_groups WHERE location = ? AND month = ?', (location, month)
+    ).fetchone()
+    analyses = group['analyses'] if group else 0
+
+    summary = {
+        'location': location,
+        'month': month,
+        'analyses': analyses,
+        'compliance': {},
+        'metrics': {},
+    }
+    for column in list(COMPLIANCE) + ['all_compliant']:
+        count = group[column] if group else 0
+        summary['compliance'][column] = {
+            'count': count,
+            'rate': round(count / analyses, 4) if analyses else None,
+        }
+
+    for metric, (low, width, bins) in METRICS.items():
+        row = conn.execute(
+            'SELECT n, total, total_sq FROM summary_metrics WHERE location = ? AND month = ? AND metric = ?',
+            (location, month, metric)
+        ).fetchone()
+        n = row['n'] if row else 0
+        mean = std = None
+        if n:
+            mean = row['total'] / n
+            std = math.sqrt(max(row['total_sq'] / n - mean * mean, 0.0))
+
+        counts = [0] * bins
+        for hist_row in conn.execute(
+                'SELECT bin, count FROM summary_histograms WHERE location = ? AND month = ? AND metric = ?',
+                (location, month, metric)):
+            counts[hist_row['bin']] = hist_row['count']
+
+        summary['metrics'][metric] = {
+            'n': n,
+            'mean': mean,
+            'std': std,
+            'histogram': {
+                'edges': [round(low + width * i, 6) for i in range(bins + 1)],
+                'counts': counts,
+            },
+        }
+
+    return summary
+
+
+def list_groups(conn):
+    """Locations and months that currently have analyses (excluding the rollups)."""
+    rows = conn.execute('''
+        SELECT location, month, analyses FROM summary_groups
+        WHERE analyses > 0 AND location != '*' AND month != '*'
+        ORDER BY location, month
+    ''').fetchall()
+    return [dict(row) for row in rows]
+
+
+def merge_summaries(summaries):
+    """
+    Combine get_summary() results for the same location and month read from
+    separate databases (partitions) into one, as if read from a single database.
+    """
+    merged = summaries[0]
+    for summary in summaries[1:]:
+        merged['analyses'] += summary['analyses']
+        for column, values in summary['compliance'].items():
+            merged['compliance'][column]['count'] += values['count']
+        for metric, values in summary['metrics'].items():
+            target = merged['metrics'][metric]
+            # Means and standard deviations combine through the sums they came from
+            n = target['n'] + values['n']
+            if values['n']:
+                total = sum(entry['n'] * entry['mean'] for entry in (target, values) if entry['n'])
+                total_sq = sum(entry['n'] * (entry['std'] ** 2 + entry['mean'] ** 2)
+                               for entry in (target, values) if entry['n'])
+                target['mean'] = total / n
+                target['std'] = math.sqrt(max(total_sq / n - target['mean'] ** 2, 0.0))
+            target['n'] = n
+            target['histogram']['counts'] = [a + b for a, b in zip(target['histogram']['counts'],
+                                                                   values['histogram']['counts'])]
+
+    for values in merged['compliance'].values():
+        values['rate'] = round(values['count'] / merged['analyses'], 4) if merged['analyses'] else None
+    return merged
+
+
+def merge_groups(group_lists):
+    """Combine list_groups() results from separate databases (partitions)."""
+    analyses = {}
+    for groups in group_lists:
+        for group in groups:
+            key = (group['location'], group['month'])
+            analyses[key] = analyses.get(key, 0) + group['analyses']
+    return [{'location': location, 'month': month, 'analyses': count}
+            for (location, month), count in sorted(analyses.items())]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+What-If Screening
+The sample page's sliders move a screen cut or a design limit and expect D50, Cu,
+So and the yield back while the slider is still being dragged. Splitting the curve
+with generate_underflow_data() and re-running analyze_sample() (and a plot) on every
+move is far too slow for that, so each sample's curve is prepared once into sorted
+knots kept in memory, and every request is answered from them with binary searches.
+
+Any chain of perfect splits keeps one band of the feed: the material finer than the
+smallest underflow cut and coarser than the largest overflow cut. With P the feed's
+percent passing, the band is P(upper) - P(lower) % of the feed, and its own percent
+passing at a size d is (P(d) - P(lower)) / (P(upper) - P(lower)) * 100. The
+product's D_x is therefore the feed's size where P = P(lower) + x% of the band, a
+lookup on the same knots: O(log n) per value, and no product curve is built.
+
+Knots are the readings ordered by size with percent passing made non-decreasing (a
+reading below the one on a finer sieve is lifted to it), interpolated as the
+analysis interpolates them: linearly in size, linearly in log size, or along the
+monotone PCHIP curve of fit_curves(). Cuts between sieves are interpolated too, so
+results follow the slider smoothly; for underflow cuts on a sieve, linear and
+log-linear results match the analysis of the stored derived product of that split.
+"""
+
+import math
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from sieve_analysis import (D_PERCENTS, DEFAULT_INTERPOLATION, COMPLIANCE_D50_RANGE, COMPLIANCE_CU_MAX,
+                            COMPLIANCE_SO_RANGE, COMPLIANCE_FINES_MAX, check_interpolation, fit_curves, pad_curves, get_sorting_description)
+
+CACHE_SIZE = 20000   # Prepared curves (one per sample and interpolation model)
+FINES_SIZE = 0.063   # mm
+MAX_NEWTON_STEPS = 60   # Inverting a PCHIP segment (Newton, or halving where Newton fails)
+
+# Design limits a request may override, with the web app's compliance criteria as defaults
+LIMITS = {
+    'd50_min': COMPLIANCE_D50_RANGE[0],
+    'd50_max': COMPLIANCE_D50_RANGE[1],
+    'cu_max': COMPLIANCE_CU_MAX,
+    'so_min': COMPLIANCE_SO_RANGE[0],
+    'so_max': COMPLIANCE_SO_RANGE[1],
+    'fines_max': COMPLIANCE_FINES_MAX,
+}
+
+
+class CurveState:
+    """
+    One sample's curve prepared for what-if lookups.
+
+    x holds the knots' percent passing (non-decreasing) and y their sizes (linear) or
+    log10 sizes (log-linear, pchip), both ascending; pchip adds the knot slopes.
+    min_size and max_size are those of all the readings, returned for D-values no
+    pair of knots brackets, as the analysis does.
+    """
+
+    __slots__ = ('model', 'x', 'y', 'slopes', 'min_size', 'max_size')
+
+    def __init__(self, sieve_sizes, percent_passing, model=DEFAULT_INTERPOLATION):
+        self.model = check_interpolation(model)
+        sizes = np.asarray(sieve_sizes, dtype=float)
+        passing = np.asarray(percent_passing, dtype=float)
+        keep = ~(np.isnan(sizes) | np.isnan(passing))
+        sizes, passing = sizes[keep], passing[keep]
+        if len(sizes) < 2:
+            raise ValueError('At least two readings are needed')
+        self.min_size, self.max_size = float(sizes.min()), float(sizes.max())
+        self.slopes = None
+
+        if model == 'pchip':
+            fit = fit_curves(*pad_curves([(sizes, passing)]), model)
+            count = int(fit['count'][0])
+            if count < 2:
+                raise ValueError('At least two increasing readings above the pan are needed')
+            self.x, self.y, self.slopes = (fit[key][0, :count].copy() for key in ('x', 'y', 'slopes'))
+            return
+
+        if model == 'log-linear':
+            positive = sizes > 0
+            sizes, passing = sizes[positive], passing[positive]
+            if len(sizes) < 2:
+                raise ValueError('At least two readings above the pan are needed')
+        order = np.argsort(sizes, kind='stable')
+        self.x = np.maximum.accumulate(passing[order])
+        self.y = np.log10(sizes[order]) if model == 'log-linear' else sizes[order]
+
+    def _size(self, value):
+        return 10 ** value if self.model != 'linear' else value
+
+    def _hermite(self, k, s):
+        # Log size at fraction s along PCHIP segment k
+        h = self.x[k + 1] - self.x[k]
+        return ((2 * s ** 3 - 3 * s ** 2 + 1) * self.y[k] + (s ** 3 - 2 * s ** 2 + s) * h * self.slopes[k]
+                + (-2 * s ** 3 + 3 * s ** 2) * self.y[k + 1] + (s ** 3 - s ** 2) * h * self.slopes[k + 1])
+
+    def _hermite_slope(self, k, s):
+        # Derivative of _hermite() with respect to s
+        h = self.x[k + 1] - self.x[k]
+        return ((6 * s ** 2 - 6 * s) * (self.y[k] - self.y[k + 1]) + (3 * s ** 2 - 4 * s + 1) * h * self.slopes[k]
+                + (3 * s ** 2 - 2 * s) * h * self.slopes[k + 1])
+
+    def diameters(self, percents):
+        """Particle sizes (mm) at an array of percent passing values."""
+        targets = np.asarray(percents, dtype=float)
+        x, y = self.x, self.y
+        segment = np.clip(np.searchsorted(x, targets, side='left') - 1, 0, len(x) - 2)
+        x1, x2 = x[segment], x[segment + 1]
+        y1, y2 = y[segment], y[segment + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = np.where(x2 > x1, (targets - x1) / (x2 - x1), 0.0)
+        if self.model == 'pchip':
+            values = self._hermite(segment, s)
+        else:
+            values = y1 + (y2 - y1) * s
+        with np.errstate(over='ignore'):
+            values = self._size(values)
+        outside = np.where(targets <= x[0], self.min_size, self.max_size)
+        return np.where((targets >= x[0]) & (targets <= x[-1]), values, outside)
+
+    def passing_at(self, size):
+        """
+        Percent passing at a size (mm). Below the finest knot it falls in proportion to
+        the size, to nothing at size 0; above the coarsest it stays at its percent passing.
+        """
+        x, y = self.x, self.y
+        finest = self._size(y[0])
+        if size <= 0:
+            return 0.0
+        if size < finest:
+            return float(x[0] * size / finest) if finest > 0 else float(x[0])
+        value = math.log10(size) if self.model != 'linear' else size
+        if value >= y[-1]:
+            return float(x[-1])
+        k = min(bisect_right(y, value) - 1, len(x) - 2)
+        if y[k + 1] <= y[k]:
+            return float(x[k + 1])
+        if self.model != 'pchip':
+            return float(x[k] + (x[k + 1] - x[k]) * (value - y[k]) / (y[k + 1] - y[k]))
+        # The PCHIP curve is monotone on each segment: Newton steps for the fraction along
+        # it, falling back to halving the bracket when a step would leave it
+        low, high = 0.0, 1.0
+        s = (value - y[k]) / (y[k + 1] - y[k])
+        for _ in range(MAX_NEWTON_STEPS):
+            error = self._hermite(k, s) - value
+            if abs(error) < 1e-13:
+                break
+            if error < 0:
+                low = s
+            else:
+                high = s
+            slope = self._hermite_slope(k, s)
+            step = s - error / slope if slope > 0 else low - 1
+            s = step if low < step < high else 0.5 * (low + high)
+        return float(x[k] + s * (x[k + 1] - x[k]))
+
+    def split(self, underflow=(), overflow=()):
+        """
+        The product of screening the feed on every underflow and overflow cut (mm), as a
+        dict: the band's lower and upper cut (None where there is none), its yield in %
+        of the feed, D-values, Cu, So, sorting and fines (% passing 0.063 mm). A band
+        holding no material has a yield of 0 and no other values.
+        """
+        upper = min(underflow) if underflow else None
+        lower = max(overflow) if overflow else None
+        top = self.passing_at(upper) if upper is not None else 100.0
+        bottom = self.passing_at(lower) if lower is not None else 0.0
+        product = {'lower': lower, 'upper': upper, 'yield': max(top - bottom, 0.0)}
+        if top - bottom <= 0 or (upper is not None and lower is not None and lower >= upper):
+            product['yield'] = 0.0
+            return product
+
+        band = top - bottom
+        diameters = self.diameters(bottom + np.asarray(D_PERCENTS, dtype=float) / 100 * band)
+        product.update(zip((f'd{percent}' for percent in D_PERCENTS), diameters.tolist()))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            product['cu'] = float(np.float64(product['d60']) / product['d10'])
+            product['so'] = float(np.sqrt(np.float64(product['d75']) / product['d25']))
+        product['sorting_desc'] = get_sorting_description(product['so'])
+        fines = min(max(self.passing_at(FINES_SIZE), bottom), top)
+        product['fines'] = (fines - bottom) / band * 100
+        return product
+
+
+def check_limits(product, limits):
+    """
+    The design criteria of a split product against limits (a dict with the LIMITS
+    keys), with the *_in_range keys of evaluate_criteria() and their count.
+    """
+    if not product.get('yield'):
+        criteria = dict.fromkeys(('d50_in_range', 'cu_in_range', 'so_in_range', 'percent_063_in_range'), False)
+    else:
+        criteria = {
+            'd50_in_range': limits['d50_min'] <= product['d50'] <= limits['d50_max'],
+            'cu_in_range': product['cu'] < limits['cu_max'],
+            'so_in_range': limits['so_min'] <= product['so'] <= limits['so_max'],
+            'percent_063_in_range': product['fines'] < limits['fines_max'],
+        }
+    criteria['total_in_range'] = sum(criteria.values())
+    return criteria
+
+
+class WhatIfCache:
+    """
+    Prepared curves by (sample ID, interpolation model), least recently used dropped
+    first. Entries are not checked against the database on use: whoever changes or
+    deletes a sample's readings calls invalidate().
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._invalidations = {}   # sample_id -> times invalidated, so a load racing one is not kept
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, sample_id):
+        """Forget a sample's prepared curves (its readings changed or it was deleted)."""
+        with self.lock:
+            self._invalidations[sample_id] = self._invalidations.get(sample_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == sample_id]:
+                del self._entries[key]
+
+    def state(self, sample_id, model, load):
+        """
+        The sample's CurveState for an interpolation model. On a miss, load(sample_id)
+        gives its (sieve sizes, percent passing), or None if it has no readings, in
+        which case None is returned. Raises ValueError for a curve that cannot be prepared.
+        """
+        key = (sample_id, model)
+        with self.lock:
+            state = self._entries.get(key)
+            if state is not None:
+                self._entries.move_to_end(key)
+            generation = self._invalidations.get(sample_id, 0)
+        metrics.inc('sieve_cache_requests_total', cache='what_if', result='miss' if state is None else 'hit')
+        if state is not None:
+            return state
+
+        # Loaded and prepared outside the lock; a concurrent miss just does the same work
+        curve = load(sample_id)
+        if curve is None:
+            return None
+        with metrics.stage('what_if_prepare'):
+            state = CurveState(curve[0], curve[1], model)
+        with self.lock:
+            if self._invalidations.get(sample_id, 0) != generation:
+                return state
+            self._entries[key] = state
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return state